@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+# In-memory Bloom filter of existing account numbers, one per app process. A miss means
+# the account certainly does not exist, so /transfer can reject it without touching
+# Postgres; a hit may be a false positive (about ERROR_RATE of misses), so it still goes
+# to the authoritative check (redis_worker's row lookup, open_account's SELECT).
+#
+# The filter is rebuilt from a streaming scan of accounts (on every shard, see shards.py)
+# whenever follow() (re)subscribes
+# to CHANNEL, and new accounts are added by the process that created them and broadcast
+# on CHANNEL to the others. Until the first build completes every lookup is a hit.
+
+CAPACITY = int(os.environ.get("ACCOUNT_FILTER_CAPACITY", "1000000"))
+ERROR_RATE = float(os.environ.get("ACCOUNT_FILTER_ERROR_RATE", "0.001"))
+CHANNEL = "accounts:created"
+SCAN_CHUNK = 10000
+RETRY_DELAY = 5
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    # Double hashing: the k positions are h1 + i*h2 over one 128-bit digest
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str):
+        array = self.array
+        return all(array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class AccountIndex:
+    def __init__(self, capacity: int = CAPACITY, error_rate: float = ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filter = None
+        self._building = None
+
+    def might_exist(self, account_number: str):
+        return self.filter is None or account_number in self.filter
+
+    def add(self, account_numbers):
+        for bloom in (self.filter, self._building):
+            if bloom is not None:
+                for account_number in account_numbers:
+                    bloom.add(account_number)
+
+    async def rebuild(self, pools):
+        count = 0
+        for pool in pools:
+            async with pool.acquire() as conn:
+                count += await conn.fetchval("SELECT count(*) FROM accounts")
+        # Keep headroom so the error rate holds as accounts are opened
+        self._building = BloomFilter(max(self.capacity, 2 * count), self.error_rate)
+        try:
+            for pool in pools:
+                async with pool.acquire() as conn:
+                    async with conn.transaction(readonly=True):
+                        cursor = await conn.cursor("SELECT account_number FROM accounts")
+                        while True:
+                            rows = await cursor.fetch(SCAN_CHUNK)
+                            if not rows:
+                                break
+                            for row in rows:
+                                self._building.add(row['account_number'])
+            self.filter = self._building
+        finally:
+            self._building = None
+        logger.info("Account filter rebuilt: %s accounts, %s KiB, %s hashes", self.filter.count, len(self.filter.array) // 1024, self.filter.hashes)
+
+    # Record accounts this process just created and tell the other processes
+    async def publish(self, redis_client, account_numbers):
+        self.add(account_numbers)
+        try:
+            await redis_client.publish(CHANNEL, "\n".join(account_numbers))
+        except Exception as e:
+            logger.error("Failed to broadcast new accounts: %s", e)
+
+    # Subscribe first, then rebuild, so accounts created during the scan arrive as messages.
+    # Any error (including a dropped subscription) resubscribes and rebuilds from scratch.
+    async def follow(self, pools, redis_client):
+        # No account databases (in-memory storage): the filter stays off and every lookup hits
+        if not pools:
+            return
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(CHANNEL)
+                await self.rebuild(pools)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.add(message["data"].decode().split("\n"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Creations may be missed until the rebuild, so stop rejecting meanwhile
+                self.filter = None
+                logger.error("Account filter follower failed, rebuilding in %ss: %s", RETRY_DELAY, e)
+                await asyncio.sleep(RETRY_DELAY)
+            finally:
+                await pubsub.aclose()
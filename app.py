@@ -1,8 +1,9 @@
-from fastapi import FastAPI, HTTPException, Response, Form, Request
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Response, Form, Request, Header, Depends
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Dict, Optional, Union
+from datetime import date, datetime, timedelta, timezone
 import uuid
 import asyncpg
 import redis.asyncio as redis
@@ -11,20 +12,48 @@ import logging
 import bcrypt
 import asyncio
 import random
-
-# Setup logging with more detail
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("/opt/banking-app/fastapi.log"),
-        logging.StreamHandler()
-    ]
+from logging_setup import setup_logging
+from functools import lru_cache
+import orjson
+import time
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from fast_json import FastJSONResponse, dumps, dumps_records, raw_json_response
+from metrics import REQUEST_LATENCY, sample_queue, timed_redis
+from query_log import InstrumentedPool, QueryLog, collect_snapshots
+from transfer_timing import get_stages, mark_status_visible, summarize
+from profiling import PROFILE_FRACTION, PROFILE_SECONDS, Profiler, install_signal_handler
+from traffic_capture import TrafficRecorder, capture
+import ledger
+import scheduler
+import versions
+import job_status
+import statements
+import search
+import checkpoints
+import shards
+from storage import BACKEND as STORAGE_BACKEND, make_storage
+from transfer_engine import run_engine
+from transfer_queue import RedisListBackend
+from account_index import AccountIndex
+from profile_cache import ProfileCache
+
+# Setup logging: records go through a queue to a background writer thread,
+# and the per-request INFO lines on request_logger are sampled
+setup_logging(
+    logging.FileHandler("/opt/banking-app/fastapi.log"),
+    sample_rates={f"{__name__}.requests": 0.01, "transfer_engine.jobs": 0.01}
 )
 logger = logging.getLogger(__name__)
+request_logger = logging.getLogger(f"{__name__}.requests")
 
 # FastAPI app
 app = FastAPI()
+profiler = Profiler("app")
+query_log = QueryLog("app")
+traffic_recorder = TrafficRecorder()
+account_index = AccountIndex()
+profile_cache = ProfileCache()
+prefix_index = search.PrefixIndex()
 
 # Mount static files directory for CSS
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -93,6 +122,32 @@ class BulkAccountRequest(BaseModel):
                 raise ValueError(f"Account number must be 6 characters for account {account.account_number}")
         return v
 
+class BulkCreditRequest(BaseModel):
+    credits: List[DepositRequest]
+    reference: Optional[str] = None
+
+    @classmethod
+    def validate(cls, v):
+        if not v.credits:
+            raise ValueError("At least one credit line is required")
+        if len(v.credits) > BULK_CREDIT_MAX_LINES:
+            raise ValueError(f"At most {BULK_CREDIT_MAX_LINES} credit lines per request")
+        return v
+
+class StandingOrderRequest(BaseModel):
+    from_account: str
+    to_account: str
+    amount: float
+    start_at: datetime
+    every: Optional[str] = None
+
+    @classmethod
+    def validate(cls, v):
+        TransferRequest.validate(v)
+        if v.every is not None and v.every not in scheduler.EVERY:
+            raise ValueError(f"every must be one of {', '.join(scheduler.EVERY)}")
+        return v
+
 class WithdrawRequest(BaseModel):
     account_number: str
     amount: float
@@ -147,58 +202,152 @@ async def init_db():
         logger.info("Database pool initialized successfully")
         return pool
     except Exception as e:
-        logger.error(f"Failed to initialize database pool: {str(e)}")
+        logger.error("Failed to initialize database pool: %s", e)
         raise HTTPException(status_code=500, detail="Database initialization failed")
 
+# Statements, bulk credit, search, as-of balances, standing orders and reports query
+# Postgres directly; with another storage backend they answer 501 instead of failing
+def require_database():
+    if app.state.db_pool is None:
+        raise HTTPException(status_code=501, detail=f"Not available with STORAGE_BACKEND={STORAGE_BACKEND}")
+
 # Initialize app with DB and Redis
 @app.on_event("startup")
 async def startup():
-    app.state.db_pool = await init_db()
+    if STORAGE_BACKEND == "postgres":
+        app.state.db_pool = InstrumentedPool(await init_db(), query_log)
+        # Pools of the databases holding accounts; just db_pool unless SHARD_DATABASES is set
+        app.state.shards = await shards.create_router(app.state.db_pool, max_size=25, wrap=lambda pool, database: InstrumentedPool(pool, query_log, database))
+    else:
+        # No database: only the handlers going through app.state.storage work
+        app.state.db_pool = None
+        app.state.shards = shards.ShardRouter([])
+    app.state.storage = make_storage(STORAGE_BACKEND, app.state.db_pool, app.state.shards)
     try:
         app.state.redis = redis.Redis(host='localhost', port=6379, db=0)
         await app.state.redis.ping()
         logger.info("Redis connection established successfully")
     except Exception as e:
-        logger.error(f"Failed to connect to Redis: {str(e)}")
+        logger.error("Failed to connect to Redis: %s", e)
         raise HTTPException(status_code=500, detail="Redis initialization failed")
+    app.state.queue_sampler = asyncio.create_task(sample_queue(app.state.redis))
+    app.state.query_stats_publisher = asyncio.create_task(query_log.publish(app.state.redis))
+    app.state.account_index_follower = asyncio.create_task(account_index.follow(app.state.shards.pools, app.state.redis))
+    app.state.profile_invalidation_follower = asyncio.create_task(profile_cache.follow(app.state.redis))
+    app.state.job_status_writer = asyncio.create_task(job_status.run_writer(app.state.storage, app.state.redis))
+    app.state.prefix_index_follower = asyncio.create_task(prefix_index.follow(app.state.shards.pools, app.state.redis))
+    # Memory storage is only reachable from this process, so the transfer engine runs here
+    # too; benchmark.py sets external_engine to pop and process transfers itself
+    app.state.transfer_engine = None
+    if STORAGE_BACKEND != "postgres" and not getattr(app.state, "external_engine", False):
+        app.state.transfer_engine = asyncio.create_task(run_engine(app.state.storage, app.state.redis, RedisListBackend(app.state.redis)))
+    install_signal_handler(profiler)
+    traffic_recorder.start()
 
 @app.on_event("shutdown")
 async def shutdown():
+    app.state.queue_sampler.cancel()
+    app.state.query_stats_publisher.cancel()
+    app.state.account_index_follower.cancel()
+    app.state.profile_invalidation_follower.cancel()
+    app.state.job_status_writer.cancel()
+    app.state.prefix_index_follower.cancel()
+    if app.state.transfer_engine is not None:
+        app.state.transfer_engine.cancel()
+    traffic_recorder.stop()
     try:
-        await app.state.db_pool.close()
+        await app.state.shards.close()
+        if app.state.db_pool is not None:
+            await app.state.db_pool.close()
         logger.info("Database pool closed")
     except Exception as e:
-        logger.error(f"Error closing database pool: {str(e)}")
+        logger.error("Error closing database pool: %s", e)
     try:
         await app.state.redis.close()
         logger.info("Redis connection closed")
     except Exception as e:
-        logger.error(f"Error closing Redis connection: {str(e)}")
+        logger.error("Error closing Redis connection: %s", e)
+
+# Per-route latency, labelled by route template so path parameters don't explode cardinality
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        if profiler.active and profiler.should_sample():
+            with profiler.profile():
+                response = await call_next(request)
+        else:
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_LATENCY.labels(
+            request.method, route.path if route else "unmatched", str(status)
+        ).observe(time.perf_counter() - start)
+
+# Traffic capture for replay (TRAFFIC_CAPTURE_RATE > 0); not registered at all when off
+if traffic_recorder.enabled:
+    @app.middleware("http")
+    async def capture_traffic(request: Request, call_next):
+        return await capture(traffic_recorder, request, call_next)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# Open a profiling window on this process; files land in PROFILE_DIR when it closes
+@app.post("/admin/profile")
+async def start_profile(seconds: float = PROFILE_SECONDS, fraction: float = PROFILE_FRACTION):
+    if seconds <= 0 or not 0 < fraction <= 1:
+        raise HTTPException(status_code=400, detail="seconds must be positive and fraction in (0, 1]")
+    if not profiler.start(seconds, fraction):
+        raise HTTPException(status_code=409, detail="A profiling window is already open")
+    return FastJSONResponse(profiler.status())
+
+@app.get("/admin/profile")
+async def profile_status():
+    return FastJSONResponse(profiler.status())
+
+# Slow-query log: this process's live stats plus the latest snapshot from every other app/worker process
+@app.get("/admin/queries")
+async def query_stats():
+    snapshots = [query_log.snapshot()]
+    try:
+        snapshots += [s for s in await collect_snapshots(app.state.redis) if s["pid"] != snapshots[0]["pid"] or s["name"] != "app"]
+    except Exception as e:
+        logger.warning("Failed to collect query stats from Redis: %s", e)
+    return FastJSONResponse({"processes": snapshots})
+
+# Navigation items; the logged-in entries carry a {username} placeholder
+NAV_ITEMS_ANONYMOUS = (
+    ("Home", "/"),
+    ("Login", "/login"),
+    ("Register", "/register")
+)
+NAV_ITEMS_USER = (
+    ("Home", "/"),
+    ("Dashboard", "/dashboard?username={username}"),
+    ("Check Balance", "/check-balance?username={username}"),
+    ("View History", "/view-history?username={username}"),
+    ("Deposit", "/deposit?username={username}"),
+    ("Logout", "/logout")
+)
 
-# Helper function to render navigation bar
+# Helper function to render navigation bar (cached, the nav only depends on username and path)
+@lru_cache(maxsize=4096)
 def render_nav(username: str = "", current_path: str = "/"):
-    nav_items = [
-        ("Home", "/"),
-        ("Login", "/login"),
-        ("Register", "/register")
-    ] if not username else [
-        ("Home", "/"),
-        ("Dashboard", f"/dashboard?username={username}"),
-        ("Check Balance", f"/check-balance?username={username}"),
-        ("View History", f"/view-history?username={username}"),
-        ("Deposit", f"/deposit?username={username}"),
-        ("Logout", "/logout")
-    ]
-    nav_html = "<ul>"
+    nav_items = NAV_ITEMS_USER if username else NAV_ITEMS_ANONYMOUS
+    parts = ["<ul>"]
     for name, url in nav_items:
         active_class = "active" if current_path == url.split("?")[0] else ""
-        nav_html += f'<li><a href="{url}" class="{active_class}">{name}</a></li>'
-    nav_html += "</ul>"
-    return nav_html
+        parts.append(f'<li><a href="{url.replace("{username}", username)}" class="{active_class}">{name}</a></li>')
+    parts.append("</ul>")
+    return "".join(parts)
 
-# Helper function to render base HTML structure
-def render_base_html(title: str, content: str, username: str = "", current_path: str = "/"):
-    return f"""
+# Static page shell, split once at startup into the literal parts around the dynamic fields
+BASE_HTML_TEMPLATE = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -214,7 +363,7 @@ def render_base_html(title: str, content: str, username: str = "", current_path:
             <h1>Test Bank</h1>
         </div>
         <div class="nav">
-            {render_nav(username, current_path)}
+            {nav}
         </div>
         <div class="container">
             {content}
@@ -223,6 +372,31 @@ def render_base_html(title: str, content: str, username: str = "", current_path:
     </html>
     """
 
+def split_template(template: str, *fields: str):
+    parts = []
+    rest = template
+    for field in fields:
+        before, rest = rest.split("{" + field + "}", 1)
+        parts.append(before)
+    parts.append(rest)
+    return tuple(parts)
+
+SHELL_BEFORE_TITLE, SHELL_BEFORE_NAV, SHELL_BEFORE_CONTENT, SHELL_TAIL = split_template(
+    BASE_HTML_TEMPLATE, "title", "nav", "content"
+)
+
+# Helper function to render everything in the page shell up to the content
+def render_page_head(title: str, username: str = "", current_path: str = "/"):
+    return "".join((
+        SHELL_BEFORE_TITLE, title,
+        SHELL_BEFORE_NAV, render_nav(username, current_path),
+        SHELL_BEFORE_CONTENT
+    ))
+
+# Helper function to render base HTML structure
+def render_base_html(title: str, content: str, username: str = "", current_path: str = "/"):
+    return "".join((render_page_head(title, username, current_path), content, SHELL_TAIL))
+
 # HTML UI for root (welcome page with login link)
 @app.get("/", response_class=HTMLResponse)
 async def root(username: str = ""):
@@ -239,7 +413,7 @@ async def root(username: str = ""):
 # Dashboard UI
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(username: str, message: str = None):
-    logger.info(f"Dashboard: Received username={username}")
+    request_logger.info("Dashboard: Received username=%s", username)
     if not username:
         logger.warning("Dashboard: No username provided")
         return RedirectResponse(url="/login", status_code=303)
@@ -275,34 +449,30 @@ async def login_page():
 @app.post("/login", response_class=HTMLResponse)
 async def login(username: str = Form(...), password: str = Form(...)):
     try:
-        async with app.state.db_pool.acquire() as conn:
-            user = await conn.fetchrow(
-                "SELECT username, password_hash FROM users WHERE username = $1",
-                username
-            )
-            if not user:
-                logger.warning(f"Login failed: Username {username} not found")
-                content = """
-                <h1>Login Failed</h1>
-                <p class="error-message">Invalid username or password. Please try again.</p>
-                <a href="/login" class="button">Back to Login</a>
-                """
-                return HTMLResponse(content=render_base_html("Login Failed", content, current_path="/login"), status_code=401)
-
-            stored_hash = user['password_hash'].encode('utf-8')
-            if not bcrypt.checkpw(password.encode('utf-8'), stored_hash):
-                logger.warning(f"Login failed: Incorrect password for user {username}")
-                content = """
-                <h1>Login Failed</h1>
-                <p class="error-message">Invalid username or password. Please try again.</p>
-                <a href="/login" class="button">Back to Login</a>
-                """
-                return HTMLResponse(content=render_base_html("Login Failed", content, current_path="/login"), status_code=401)
-
-            logger.info(f"User {username} logged in successfully")
-            return RedirectResponse(url=f"/dashboard?username={username}", status_code=303)
+        password_hash = await app.state.storage.password_hash(username)
+        if not password_hash:
+            logger.warning("Login failed: Username %s not found", username)
+            content = """
+            <h1>Login Failed</h1>
+            <p class="error-message">Invalid username or password. Please try again.</p>
+            <a href="/login" class="button">Back to Login</a>
+            """
+            return HTMLResponse(content=render_base_html("Login Failed", content, current_path="/login"), status_code=401)
+
+        stored_hash = password_hash.encode('utf-8')
+        if not bcrypt.checkpw(password.encode('utf-8'), stored_hash):
+            logger.warning("Login failed: Incorrect password for user %s", username)
+            content = """
+            <h1>Login Failed</h1>
+            <p class="error-message">Invalid username or password. Please try again.</p>
+            <a href="/login" class="button">Back to Login</a>
+            """
+            return HTMLResponse(content=render_base_html("Login Failed", content, current_path="/login"), status_code=401)
+
+        logger.info("User %s logged in successfully", username)
+        return RedirectResponse(url=f"/dashboard?username={username}", status_code=303)
     except Exception as e:
-        logger.error(f"Error during login for user {username}: {str(e)}")
+        logger.error("Error during login for user %s: %s", username, e)
         content = """
         <h1>Login Error</h1>
         <p class="error-message">An error occurred during login. Please try again later.</p>
@@ -336,7 +506,7 @@ async def logout(response: Response):
 # Check Balance UI
 @app.get("/check-balance", response_class=HTMLResponse)
 async def check_balance_page(username: str):
-    logger.info(f"Check-balance: Received username={username}")
+    request_logger.info("Check-balance: Received username=%s", username)
     if not username:
         logger.warning("Check-balance: No username provided")
         return RedirectResponse(url="/login", status_code=303)
@@ -355,7 +525,7 @@ async def check_balance_page(username: str):
 
 @app.post("/check-balance", response_class=HTMLResponse)
 async def check_balance_submit(account_number: str = Form(...), username: str = Form(...)):
-    logger.info(f"Check-balance POST: Received username={username}")
+    request_logger.info("Check-balance POST: Received username=%s", username)
     if not username:
         logger.warning("Check-balance POST: No username provided")
         return RedirectResponse(url="/login", status_code=303)
@@ -364,7 +534,7 @@ async def check_balance_submit(account_number: str = Form(...), username: str =
 # View History UI
 @app.get("/view-history", response_class=HTMLResponse)
 async def view_history_page(username: str):
-    logger.info(f"View-history: Received username={username}")
+    request_logger.info("View-history: Received username=%s", username)
     if not username:
         logger.warning("View-history: No username provided")
         return RedirectResponse(url="/login", status_code=303)
@@ -383,7 +553,7 @@ async def view_history_page(username: str):
 
 @app.post("/view-history", response_class=HTMLResponse)
 async def view_history_submit(account_number: str = Form(...), username: str = Form(...)):
-    logger.info(f"View-history POST: Received username={username}")
+    request_logger.info("View-history POST: Received username=%s", username)
     if not username:
         logger.warning("View-history POST: No username provided")
         return RedirectResponse(url="/login", status_code=303)
@@ -392,25 +562,28 @@ async def view_history_submit(account_number: str = Form(...), username: str = F
 # Balance UI
 @app.get("/balance/{account_number}", response_class=HTMLResponse)
 async def balance_page(account_number: str, username: str):
-    logger.info(f"Balance: Received username={username}")
+    request_logger.info("Balance: Received username=%s", username)
     if not username:
         logger.warning("Balance: No username provided")
         return RedirectResponse(url="/login", status_code=303)
 
     try:
-        async with app.state.db_pool.acquire() as conn:
-            account = await conn.fetchrow(
-                "SELECT account_number, balance, first_name, last_name, dob, address_line_one, address_line_two, town, city, post_code FROM accounts WHERE account_number = $1",
-                account_number
-            )
-            if not account:
-                logger.warning(f"Account {account_number} not found")
-                content = """
-                <h1>Account Not Found</h1>
-                <p>The account number you entered was not found.</p>
-                <a href="/check-balance?username={username}" class="button">Back to Check Balance</a>
-                """.format(username=username)
-                return HTMLResponse(content=render_base_html("Account Not Found", content, username, "/check-balance"), status_code=404)
+        # Profile fields come from profile_cache when possible; only the balance is read fresh
+        profile = await profile_cache.get(app.state.redis, account_number)
+        if profile is None:
+            profile = await app.state.storage.profile(account_number)
+            if profile:
+                await profile_cache.put(app.state.redis, account_number, profile)
+        balance = await app.state.storage.balance(account_number)
+        account = dict(profile, account_number=account_number, balance=balance) if profile and balance is not None else None
+        if not account:
+            logger.warning("Account %s not found", account_number)
+            content = """
+            <h1>Account Not Found</h1>
+            <p>The account number you entered was not found.</p>
+            <a href="/check-balance?username={username}" class="button">Back to Check Balance</a>
+            """.format(username=username)
+            return HTMLResponse(content=render_base_html("Account Not Found", content, username, "/check-balance"), status_code=404)
 
         content = f"""
         <h1>Account Details</h1>
@@ -430,7 +603,7 @@ async def balance_page(account_number: str, username: str):
         """
         return HTMLResponse(content=render_base_html("Account Details", content, username, "/balance"))
     except Exception as e:
-        logger.error(f"Error fetching balance for {account_number}: {str(e)}")
+        logger.error("Error fetching balance for %s: %s", account_number, e)
         content = """
         <h1>Error</h1>
         <p>Failed to fetch account details. Please try again later.</p>
@@ -439,43 +612,9 @@ async def balance_page(account_number: str, username: str):
         return HTMLResponse(content=render_base_html("Error", content, username, "/check-balance"), status_code=500)
 
 # History UI
-@app.get("/history/{account_number}", response_class=HTMLResponse)
-async def history_page(account_number: str, username: str):
-    logger.info(f"History: Received username={username}")
-    if not username:
-        logger.warning("History: No username provided")
-        return RedirectResponse(url="/login", status_code=303)
+HISTORY_CHUNK_SIZE = 500
 
-    try:
-        async with app.state.db_pool.acquire() as conn:
-            transfers = await conn.fetch(
-                "SELECT transfer_id, from_account, to_account, amount, status, result FROM transfer_jobs WHERE from_account = $1 OR to_account = $1",
-                account_number
-            )
-            if not transfers:
-                content = f"""
-                <h1>Transfer History for {account_number}</h1>
-                <p>No transfers found for this account.</p>
-                <a href="/view-history?username={username}" class="button">Back to View History</a>
-                """
-                return HTMLResponse(content=render_base_html("Transfer History", content, username, "/view-history"))
-
-        table_rows = ""
-        for t in transfers:
-            result = t['result'] if t['result'] else {}
-            result_message = result.get('message', 'N/A') if isinstance(result, dict) else 'N/A'
-            table_rows += f"""
-            <tr>
-                <td>{t['transfer_id']}</td>
-                <td>{t['from_account']}</td>
-                <td>{t['to_account']}</td>
-                <td>£{t['amount']:.2f}</td>
-                <td>{t['status']}</td>
-                <td>{result_message}</td>
-            </tr>
-            """
-
-        content = f"""
+HISTORY_TABLE_OPEN = """
         <h1>Transfer History for {account_number}</h1>
         <table>
             <tr>
@@ -486,13 +625,66 @@ async def history_page(account_number: str, username: str):
                 <th>Status</th>
                 <th>Result</th>
             </tr>
-            {table_rows}
+"""
+HISTORY_ROW = """
+            <tr>
+                <td>{}</td>
+                <td>{}</td>
+                <td>{}</td>
+                <td>£{:.2f}</td>
+                <td>{}</td>
+                <td>{}</td>
+            </tr>
+"""
+HISTORY_TABLE_CLOSE = """
         </table>
         <a href="/view-history?username={username}" class="button">Back to View History</a>
-        """
-        return HTMLResponse(content=render_base_html("Transfer History", content, username, "/history"))
+"""
+
+# Helper function to pull the message out of a transfer_jobs result (stored as JSON text)
+def result_message(result):
+    if isinstance(result, str):
+        try:
+            result = json.loads(result)
+        except ValueError:
+            return 'N/A'
+    return result.get('message', 'N/A') if isinstance(result, dict) else 'N/A'
+
+def render_history_rows(transfers):
+    return "".join([
+        HISTORY_ROW.format(t['transfer_id'], t['from_account'], t['to_account'], t['amount'], t['status'], result_message(t['result']))
+        for t in transfers
+    ])
+
+# Streams the history table chunk by chunk as the storage backend reads them (from a
+# server-side cursor on Postgres), so large histories render in linear time without
+# holding the whole table in memory
+async def stream_history(chunks, first_chunk, account_number: str, username: str):
+    try:
+        yield render_page_head("Transfer History", username, "/history")
+        yield HISTORY_TABLE_OPEN.format(account_number=account_number)
+        yield render_history_rows(first_chunk)
+        async for chunk in chunks:
+            yield render_history_rows(chunk)
+        yield HISTORY_TABLE_CLOSE.format(username=username)
+        yield SHELL_TAIL
+    except Exception as e:
+        logger.error("Error streaming history for %s: %s", account_number, e)
+    finally:
+        await chunks.aclose()
+
+@app.get("/history/{account_number}", response_class=HTMLResponse)
+async def history_page(account_number: str, username: str):
+    request_logger.info("History: Received username=%s", username)
+    if not username:
+        logger.warning("History: No username provided")
+        return RedirectResponse(url="/login", status_code=303)
+
+    chunks = app.state.storage.history(account_number, HISTORY_CHUNK_SIZE)
+    try:
+        first_chunk = await anext(chunks, None)
     except Exception as e:
-        logger.error(f"Error fetching history for {account_number}: {str(e)}")
+        logger.error("Error fetching history for %s: %s", account_number, e)
         content = """
         <h1>Error</h1>
         <p>Failed to fetch transfer history. Please try again later.</p>
@@ -500,10 +692,59 @@ async def history_page(account_number: str, username: str):
         """.format(username=username)
         return HTMLResponse(content=render_base_html("Error", content, username, "/view-history"), status_code=500)
 
+    if not first_chunk:
+        content = f"""
+        <h1>Transfer History for {account_number}</h1>
+        <p>No transfers found for this account.</p>
+        <a href="/view-history?username={username}" class="button">Back to View History</a>
+        """
+        return HTMLResponse(content=render_base_html("Transfer History", content, username, "/view-history"))
+
+    return StreamingResponse(
+        stream_history(chunks, first_chunk, account_number, username),
+        media_type="text/html"
+    )
+
+# Statement export: an account's transfer_jobs for a date range (end inclusive) as CSV or
+# Parquet, streamed from a server-side cursor with monthly totals at the end
+@app.get("/statement/{account_number}", dependencies=[Depends(require_database)])
+async def statement(account_number: str, username: str = "", start: date = date(1970, 1, 1), end: Optional[date] = None, format: str = "csv"):
+    request_logger.info("Statement: Received username=%s", username)
+    if not username:
+        logger.warning("Statement: No username provided")
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    end = end or date.today()
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    try:
+        encoder = statements.make_encoder(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    conn = None
+    try:
+        conn = await app.state.db_pool.acquire()
+        transaction = conn.transaction(readonly=True)
+        await transaction.start()
+        cursor = await conn.cursor(statements.STATEMENT_QUERY, account_number, start, end)
+        first_chunk = await cursor.fetch(statements.CHUNK_SIZE)
+    except Exception as e:
+        if conn is not None:
+            await app.state.db_pool.release(conn)
+        logger.error("Error fetching statement for %s: %s", account_number, e)
+        raise HTTPException(status_code=500, detail="Failed to fetch statement")
+
+    filename = f"statement-{account_number}-{start}-{end}.{encoder.extension}"
+    return StreamingResponse(
+        statements.stream_statement(app.state.db_pool, conn, transaction, cursor, first_chunk, account_number, encoder),
+        media_type=encoder.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 # Deposit UI (GET endpoint to render the form)
 @app.get("/deposit", response_class=HTMLResponse)
 async def deposit_page(username: str, error_message: str = None):
-    logger.info(f"Deposit GET: Received username={username}")
+    request_logger.info("Deposit GET: Received username=%s", username)
     if not username:
         logger.warning("Deposit GET: No username provided")
         return RedirectResponse(url="/login", status_code=303)
@@ -527,7 +768,7 @@ async def deposit_page(username: str, error_message: str = None):
 # Deposit UI (POST endpoint to handle form submission)
 @app.post("/deposit", response_class=HTMLResponse)
 async def deposit(account_number: str = Form(...), amount: float = Form(...), username: str = Form(...)):
-    logger.info(f"Deposit POST: Received username={username}, account_number={account_number}, amount={amount}")
+    request_logger.info("Deposit POST: Received username=%s, account_number=%s, amount=%s", username, account_number, amount)
     if not username:
         logger.warning("Deposit POST: No username provided")
         return RedirectResponse(url="/login", status_code=303)
@@ -537,35 +778,149 @@ async def deposit(account_number: str = Form(...), amount: float = Form(...), us
         deposit_request = DepositRequest(account_number=account_number, amount=amount)
         DepositRequest.validate(deposit_request)
     except ValueError as e:
-        logger.warning(f"Invalid deposit request: {str(e)}")
+        logger.warning("Invalid deposit request: %s", e)
         return RedirectResponse(url=f"/deposit?username={username}&error_message={str(e)}", status_code=303)
 
     try:
-        async with app.state.db_pool.acquire() as conn:
-            async with conn.transaction():
-                account = await conn.fetchrow("SELECT balance FROM accounts WHERE account_number = $1 FOR UPDATE", account_number)
-                if not account:
-                    logger.warning(f"Account {account_number} not found")
-                    return RedirectResponse(url=f"/deposit?username={username}&error_message=Account not found", status_code=303)
-                # Update the account balance
-                await conn.execute("UPDATE accounts SET balance = balance + $1 WHERE account_number = $2", amount, account_number)
-                # Log the deposit in transfer_jobs
-                transfer_id = str(uuid.uuid4())
-                result = {"message": f"Deposited £{amount:.2f} to account {account_number}"}
-                result_json = json.dumps(result)
-                await conn.execute(
-                    "INSERT INTO transfer_jobs (transfer_id, from_account, to_account, amount, status, result, timestamp) VALUES ($1, $2, $3, $4, $5, $6, CURRENT_TIMESTAMP)",
-                    transfer_id, "EXTERNAL_DEPOSIT", account_number, amount, "deposit", result_json
-                )
-        logger.info(f"Deposited £{amount:.2f} to account {account_number}")
+        transfer_id = str(uuid.uuid4())
+        credited = await app.state.storage.deposit(transfer_id, account_number, amount)
+        if not credited:
+            logger.warning("Account %s not found", account_number)
+            return RedirectResponse(url=f"/deposit?username={username}&error_message=Account not found", status_code=303)
+        # Log the deposit in transfer_jobs (written behind, see job_status.py)
+        result = {"message": f"Deposited £{amount:.2f} to account {account_number}"}
+        try:
+            await job_status.record(app.state.redis, transfer_id, "EXTERNAL_DEPOSIT", account_number, amount, "deposit", result)
+        except Exception:
+            # The money has moved; the row is in the error log for replay. Don't invite a retry.
+            await versions.bump(app.state.redis, [account_number])
+            return RedirectResponse(url=f"/deposit?username={username}&error_message=Deposit {transfer_id} was applied but not yet recorded; do not repeat it", status_code=303)
+        await versions.bump(app.state.redis, [account_number])
+        request_logger.info("Deposited £%.2f to account %s", amount, account_number)
         return RedirectResponse(url=f"/dashboard?username={username}&message=Successfully deposited £{amount:.2f} to account {account_number}", status_code=303)
     except Exception as e:
-        logger.error(f"Error depositing to account {account_number}: {str(e)}")
+        logger.error("Error depositing to account %s: %s", account_number, e)
         return RedirectResponse(url=f"/deposit?username={username}&error_message=Failed to deposit. Please try again later.", status_code=303)
 
+# Bulk credit API (payroll runs): lines are applied set-based, BULK_CREDIT_CHUNK lines per
+# transaction, with one lock statement, one balance statement and one audit insert per chunk.
+# Each line gets its own result; invalid lines and unknown accounts are skipped, not fatal.
+# Chunks commit independently, so a failed chunk reports its lines as "error" and the
+# others still stand. With sharded accounts the lines are chunked per shard, and the audit
+# rows go to the primary database right after each shard commit, as deposits' do.
+BULK_CREDIT_MAX_LINES = 200000
+BULK_CREDIT_CHUNK = 10000
+
+BULK_CREDIT_UPDATE = """
+    UPDATE accounts a SET balance = a.balance + t.amount
+    FROM (
+        SELECT account_number, sum(amount) AS amount
+        FROM unnest($1::text[], $2::float8[]) AS l(account_number, amount)
+        GROUP BY account_number
+    ) t
+    WHERE a.account_number = t.account_number
+"""
+
+BULK_CREDIT_AUDIT = """
+    INSERT INTO transfer_jobs (transfer_id, from_account, to_account, amount, status, result, timestamp, outcome_xid)
+    SELECT l.transfer_id, 'EXTERNAL_DEPOSIT', l.account_number, l.amount, 'deposit', l.result::jsonb, CURRENT_TIMESTAMP, pg_current_xact_id()
+    FROM unnest($1::text[], $2::text[], $3::float8[], $4::text[]) AS l(transfer_id, account_number, amount, result)
+"""
+
+async def apply_credit_chunk(conn, lines, reference, audit_pool=None):
+    account_numbers = sorted({line.account_number for line in lines})
+    async with conn.transaction():
+        if ledger.ENABLED:
+            existing = await ledger.existing_accounts(conn, account_numbers)
+        else:
+            # Lock in account order so concurrent bulk runs and deposits cannot deadlock
+            rows = await conn.fetch(
+                "SELECT account_number FROM accounts WHERE account_number = ANY($1) ORDER BY account_number FOR UPDATE",
+                account_numbers
+            )
+            existing = {row['account_number'] for row in rows}
+
+        applied = [line for line in lines if line.account_number in existing]
+        transfer_ids = [str(uuid.uuid4()) for _ in applied]
+        accounts = [line.account_number for line in applied]
+        amounts = [line.amount for line in applied]
+        audit = (
+            transfer_ids, accounts, amounts,
+            [dumps({"message": f"Deposited £{line.amount:.2f} to account {line.account_number}", "reference": reference}).decode() for line in applied]
+        )
+        if applied:
+            if ledger.ENABLED:
+                await ledger.append_credits(conn, transfer_ids, accounts, amounts)
+            else:
+                await conn.execute(BULK_CREDIT_UPDATE, accounts, amounts)
+            if audit_pool is None:
+                await conn.execute(BULK_CREDIT_AUDIT, *audit)
+    if applied and audit_pool is not None:
+        # The credits are committed by now, so a failed audit must not report them as errors
+        try:
+            async with audit_pool.acquire() as audit_conn:
+                await audit_conn.execute(BULK_CREDIT_AUDIT, *audit)
+        except Exception as e:
+            logger.error("Failed to write bulk credit audit rows for %s: %s", ", ".join(transfer_ids), e)
+    return existing, iter(transfer_ids)
+
+@app.post("/api/bulk_credit", dependencies=[Depends(require_database)])
+async def bulk_credit(request: BulkCreditRequest, username: str = ""):
+    request_logger.info("Bulk-credit: Received username=%s", username)
+    if not username:
+        logger.warning("Bulk-credit: No username provided")
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        BulkCreditRequest.validate(request)
+    except ValueError as e:
+        logger.warning("Invalid bulk credit request: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    results = [None] * len(request.credits)
+    valid = []
+    for line, credit in enumerate(request.credits):
+        try:
+            DepositRequest.validate(credit)
+            valid.append((line, credit))
+        except ValueError as e:
+            results[line] = {"line": line, "account_number": credit.account_number, "status": "invalid", "error": str(e)}
+
+    credited = 0
+    total = 0.0
+    audit_pool = app.state.db_pool if app.state.shards.sharded else None
+    for pool, shard_valid in app.state.shards.group(valid, key=lambda item: item[1].account_number):
+        async with pool.acquire() as conn:
+            for start in range(0, len(shard_valid), BULK_CREDIT_CHUNK):
+                chunk = shard_valid[start:start + BULK_CREDIT_CHUNK]
+                try:
+                    existing, transfer_ids = await apply_credit_chunk(conn, [credit for _, credit in chunk], request.reference, audit_pool)
+                except Exception as e:
+                    logger.error("Bulk credit chunk at line %s failed: %s", chunk[0][0], e)
+                    for line, credit in chunk:
+                        results[line] = {"line": line, "account_number": credit.account_number, "status": "error", "error": "Failed to apply credit"}
+                    continue
+                await versions.bump(app.state.redis, existing)
+                for line, credit in chunk:
+                    if credit.account_number in existing:
+                        results[line] = {"line": line, "account_number": credit.account_number, "status": "credited", "transfer_id": next(transfer_ids)}
+                        credited += 1
+                        total += credit.amount
+                    else:
+                        results[line] = {"line": line, "account_number": credit.account_number, "status": "account_not_found"}
+
+    logger.info("Bulk credit %s: applied %s of %s lines, £%.2f", request.reference, credited, len(results), total)
+    return raw_json_response(dumps({
+        "reference": request.reference,
+        "lines": len(results),
+        "credited": credited,
+        "failed": len(results) - credited,
+        "total_credited": round(total, 2),
+        "results": results
+    }))
+
 @app.post("/open_account")
 async def open_account(request: Union[AccountRequest, BulkAccountRequest], username: str = ""):
-    logger.info(f"Open-account: Received username={username}")
+    request_logger.info("Open-account: Received username=%s", username)
     if not username:
         logger.warning("Open-account: No username provided")
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -576,160 +931,347 @@ async def open_account(request: Union[AccountRequest, BulkAccountRequest], usern
             BulkAccountRequest.validate(request)
             accounts_to_create = request.accounts
         except ValueError as e:
-            logger.warning(f"Invalid bulk account request: {str(e)}")
+            logger.warning("Invalid bulk account request: %s", e)
             raise HTTPException(status_code=400, detail=str(e))
     else:
         try:
             AccountRequest.validate(request)
             accounts_to_create = [request]
         except ValueError as e:
-            logger.warning(f"Invalid account request: {str(e)}")
+            logger.warning("Invalid account request: %s", e)
             raise HTTPException(status_code=400, detail=str(e))
 
     try:
-        async with app.state.db_pool.acquire() as conn:
-            async with conn.transaction():
-                existing_accounts = await conn.fetch(
-                    "SELECT account_number FROM accounts WHERE account_number = ANY($1)",
-                    [acc.account_number for acc in accounts_to_create]
-                )
-                existing_set = {row['account_number'] for row in existing_accounts}
-                if existing_set:
-                    logger.warning(f"Accounts already exist: {existing_set}")
-                    raise HTTPException(status_code=400, detail=f"Accounts already exist: {existing_set}")
-
-                await conn.executemany(
-                    """
-                    INSERT INTO accounts (
-                        account_number, balance, first_name, last_name, dob, 
-                        address_line_one, address_line_two, town, city, post_code
-                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-                    """,
-                    [
-                        (
-                            acc.account_number,
-                            acc.balance,
-                            acc.first_name,
-                            acc.last_name,
-                            acc.dob,
-                            acc.address_line_one,
-                            acc.address_line_two,
-                            acc.town,
-                            acc.city,
-                            acc.post_code
-                        )
-                        for acc in accounts_to_create if acc.account_number not in existing_set
-                    ]
-                )
+        # Only numbers the filter has seen can already exist. Every shard is checked before
+        # any is written, and each shard's accounts are then inserted in one transaction.
+        candidates = [acc.account_number for acc in accounts_to_create if account_index.might_exist(acc.account_number)]
+        existing_set = await app.state.storage.existing_accounts(candidates) if candidates else set()
+        if existing_set:
+            logger.warning("Accounts already exist: %s", existing_set)
+            raise HTTPException(status_code=400, detail=f"Accounts already exist: {existing_set}")
+
+        await app.state.storage.open_accounts(accounts_to_create)
+        await account_index.publish(app.state.redis, [acc.account_number for acc in accounts_to_create])
+        # A number can be reopened after its account was removed, so drop any cached profile
+        await profile_cache.invalidate(app.state.redis, [acc.account_number for acc in accounts_to_create])
+        await versions.bump(app.state.redis, [acc.account_number for acc in accounts_to_create])
         created_count = len(accounts_to_create)
-        logger.info(f"Opened {created_count} accounts")
+        logger.info("Opened %s accounts", created_count)
         return {"message": f"Opened {created_count} accounts successfully"}
     except Exception as e:
-        logger.error(f"Error opening accounts: {str(e)}")
+        logger.error("Error opening accounts: %s", e)
         raise HTTPException(status_code=500, detail="Failed to open accounts")
 
+# Conditional GETs (see versions.py). The ETag is looked up before the data is read, so
+# it can only be older than the body it is sent with, never newer.
+async def lookup_etag(lookup, *args):
+    try:
+        return await lookup(app.state.redis, *args)
+    except Exception as e:
+        logger.warning("ETag lookup failed: %s", e)
+        return None
+
+def etag_headers(etag):
+    return {"ETag": etag, "Cache-Control": "no-cache"} if etag else None
+
 @app.get("/list", response_model=List[Account])
-async def list_accounts(username: str = ""):
-    logger.info(f"List-accounts: Received username={username}")
+async def list_accounts(username: str = "", if_none_match: Optional[str] = Header(None)):
+    request_logger.info("List-accounts: Received username=%s", username)
     if not username:
         logger.warning("List-accounts: No username provided")
         raise HTTPException(status_code=401, detail="Not authenticated")
 
+    etag = await lookup_etag(versions.list_etag)
+    if versions.not_modified(if_none_match, etag):
+        return Response(status_code=304, headers=etag_headers(etag))
     try:
-        async with app.state.db_pool.acquire() as conn:
-            accounts = await conn.fetch("SELECT account_number, balance FROM accounts")
-        return [{"account_number": acc['account_number'], "balance": float(acc['balance'])} for acc in accounts]
+        accounts = await app.state.storage.balances()
+        # Rows come straight from our own table, so skip response_model revalidation
+        return raw_json_response(dumps_records(accounts), headers=etag_headers(etag))
     except Exception as e:
-        logger.error(f"Error listing accounts: {str(e)}")
+        logger.error("Error listing accounts: %s", e)
         raise HTTPException(status_code=500, detail="Failed to list accounts")
 
+# Account search by name, last name, postcode, town or city (see search.py); pass the
+# returned cursor back to get the next page
+@app.get("/accounts/search", dependencies=[Depends(require_database)])
+async def search_accounts(username: str = "", field: str = "name", q: str = "", fuzzy: bool = False, limit: int = 20, cursor: Optional[str] = None):
+    request_logger.info("Account-search: Received username=%s", username)
+    if not username:
+        logger.warning("Account-search: No username provided")
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        results, next_cursor = await search.search(app.state.shards.pools, prefix_index, field, q, fuzzy, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Error searching accounts by %s: %s", field, e)
+        raise HTTPException(status_code=500, detail="Failed to search accounts")
+    return FastJSONResponse({"results": results, "next_cursor": next_cursor})
+
 @app.get("/api")
 async def api(username: str = ""):
-    logger.info(f"API: Received username={username}")
+    request_logger.info("API: Received username=%s", username)
     if not username:
         logger.warning("API: No username provided")
         raise HTTPException(status_code=401, detail="Not authenticated")
     return {"message": "API endpoint - future implementation"}
 
 @app.get("/api/balance/{account_number}")
-async def api_balance(account_number: str, username: str = ""):
-    logger.info(f"API-balance: Received username={username}")
+async def api_balance(account_number: str, username: str = "", if_none_match: Optional[str] = Header(None)):
+    request_logger.info("API-balance: Received username=%s", username)
     if not username:
         logger.warning("API-balance: No username provided")
         raise HTTPException(status_code=401, detail="Not authenticated")
 
+    etag = await lookup_etag(versions.account_etag, account_number)
+    if versions.not_modified(if_none_match, etag):
+        return Response(status_code=304, headers=etag_headers(etag))
+    try:
+        balance = await app.state.storage.balance(account_number)
+    except Exception as e:
+        logger.error("Error fetching balance for %s: %s", account_number, e)
+        raise HTTPException(status_code=500, detail="Failed to fetch balance")
+    if balance is None:
+        logger.warning("Account %s not found", account_number)
+        raise HTTPException(status_code=404, detail="Account not found")
+    return FastJSONResponse({"account": account_number, "balance": balance}, headers=etag_headers(etag))
+
+# Point-in-time balances from the nearest checkpoint plus the deltas after it (see
+# checkpoints.py). `at` without a timezone is taken as UTC.
+def as_of_time(at: datetime):
+    return at if at.tzinfo else at.replace(tzinfo=timezone.utc)
+
+@app.get("/api/balance/{account_number}/as_of", dependencies=[Depends(require_database)])
+async def api_balance_as_of(account_number: str, at: datetime, username: str = ""):
+    request_logger.info("API-balance-as-of: Received username=%s", username)
+    if not username:
+        logger.warning("API-balance-as-of: No username provided")
+        raise HTTPException(status_code=401, detail="Not authenticated")
     try:
         async with app.state.db_pool.acquire() as conn:
-            account = await conn.fetchrow("SELECT balance FROM accounts WHERE account_number = $1", account_number)
-            if not account:
-                logger.warning(f"Account {account_number} not found")
-                raise HTTPException(status_code=404, detail="Account not found")
-            return {"account": account_number, "balance": float(account['balance'])}
+            row = await checkpoints.balance_at(conn, account_number, as_of_time(at))
     except Exception as e:
-        logger.error(f"Error fetching balance for {account_number}: {str(e)}")
+        logger.error("Error fetching balance for %s as of %s: %s", account_number, at, e)
         raise HTTPException(status_code=500, detail="Failed to fetch balance")
+    if row is None:
+        logger.warning("No balance for %s as of %s", account_number, at)
+        raise HTTPException(status_code=404, detail="Account not found at that time")
+    return FastJSONResponse({
+        "account": account_number,
+        "at": as_of_time(at),
+        "balance": row['balance'],
+        "checkpoint_at": row['checkpoint_at']
+    })
+
+@app.get("/balances/as_of", dependencies=[Depends(require_database)])
+async def balances_as_of(at: datetime, username: str = ""):
+    request_logger.info("Balances-as-of: Received username=%s", username)
+    if not username:
+        logger.warning("Balances-as-of: No username provided")
+        raise HTTPException(status_code=401, detail="Not authenticated")
 
-@app.get("/history/{account_number}", response_class=HTMLResponse)
-async def history_page(account_number: str, username: str):
-    logger.info(f"History: Received username={username}")
+    conn = None
+    try:
+        conn = await app.state.db_pool.acquire()
+        transaction = conn.transaction(readonly=True)
+        await transaction.start()
+        cursor = await conn.cursor(checkpoints.EXPORT_QUERY, as_of_time(at))
+        first_chunk = await cursor.fetch(checkpoints.EXPORT_CHUNK)
+    except Exception as e:
+        if conn is not None:
+            await app.state.db_pool.release(conn)
+        logger.error("Error exporting balances as of %s: %s", at, e)
+        raise HTTPException(status_code=500, detail="Failed to export balances")
+
+    filename = f"balances-{as_of_time(at).isoformat()}.csv"
+    return StreamingResponse(
+        checkpoints.stream_export(app.state.db_pool, conn, transaction, cursor, first_chunk),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Transfer API: record the job, then hand it to redis_worker via the 'transfers' list
+@app.post("/transfer")
+async def transfer(request: TransferRequest):
+    try:
+        TransferRequest.validate(request)
+    except ValueError as e:
+        logger.warning("Invalid transfer request: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+    # Certain misses are rejected here; hits are checked by the worker under its row lock
+    for account_number in (request.from_account, request.to_account):
+        if not account_index.might_exist(account_number):
+            logger.warning("Transfer rejected, account %s does not exist", account_number)
+            raise HTTPException(status_code=404, detail=f"Account {account_number} not found")
+
+    transfer_id = str(uuid.uuid4())
+    job = {
+        "transfer_id": transfer_id,
+        "from_account": request.from_account,
+        "to_account": request.to_account,
+        "amount": request.amount,
+        "enqueued_at": time.time()
+    }
+    try:
+        await app.state.storage.create_job(transfer_id, request.from_account, request.to_account, request.amount)
+        await timed_redis('rpush', app.state.redis.rpush('transfers', dumps(job)))
+    except Exception as e:
+        logger.error("Error enqueuing transfer %s: %s", transfer_id, e)
+        raise HTTPException(status_code=500, detail="Failed to enqueue transfer")
+    request_logger.info("Transfer %s enqueued", transfer_id)
+    return FastJSONResponse({"transfer_id": transfer_id, "status": "pending"})
+
+# Transfer status: 202 while the worker has not finished the job, 200 once it has an outcome
+@app.get("/transfer_status/{transfer_id}", response_model=Transfer)
+async def transfer_status(transfer_id: str):
+    try:
+        job = await app.state.storage.job(transfer_id)
+    except Exception as e:
+        logger.error("Error fetching status for transfer %s: %s", transfer_id, e)
+        raise HTTPException(status_code=500, detail="Failed to fetch transfer status")
+    if not job:
+        raise HTTPException(status_code=404, detail="Transfer not found")
+
+    body = job
+    if isinstance(body['result'], str):
+        body['result'] = orjson.loads(body['result'])
+    if body['status'] == "pending":
+        return FastJSONResponse(body, status_code=202)
+    await mark_status_visible(app.state.redis, transfer_id)
+    return FastJSONResponse(body)
+
+# Per-stage timing breakdown for one transfer
+@app.get("/transfer_timings/{transfer_id}")
+async def transfer_timings(transfer_id: str):
+    timings = await get_stages(app.state.redis, transfer_id)
+    if not any(timings["stages"].values()):
+        raise HTTPException(status_code=404, detail="No timings recorded for this transfer")
+    return FastJSONResponse(timings)
+
+# Percentile summary of stage timings over recently finished transfers
+@app.get("/transfer_timings")
+async def transfer_timings_summary(limit: int = 10000):
+    return FastJSONResponse(await summarize(app.state.redis, limit))
+
+# Standing orders: stored in Postgres and fired by scheduler.py onto the 'transfers:scheduled' list
+@app.post("/standing_orders", dependencies=[Depends(require_database)])
+async def create_standing_order(request: StandingOrderRequest, username: str = ""):
+    request_logger.info("Standing-order: Received username=%s", username)
     if not username:
-        logger.warning("History: No username provided")
-        return RedirectResponse(url="/login", status_code=303)
+        logger.warning("Standing-order: No username provided")
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        StandingOrderRequest.validate(request)
+    except ValueError as e:
+        logger.warning("Invalid standing order: %s", e)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    order_id = str(uuid.uuid4())
+    start_at = request.start_at if request.start_at.tzinfo else request.start_at.replace(tzinfo=timezone.utc)
+    try:
+        async with app.state.db_pool.acquire() as conn:
+            await conn.execute(
+                "INSERT INTO standing_orders (order_id, from_account, to_account, amount, start_at, every, next_run_at) VALUES ($1, $2, $3, $4, $5, $6::text::interval, $5)",
+                order_id, request.from_account, request.to_account, request.amount, start_at,
+                scheduler.EVERY.get(request.every)
+            )
+        await scheduler.schedule(app.state.redis, order_id, start_at.timestamp())
+    except Exception as e:
+        logger.error("Error creating standing order: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to create standing order")
+    return FastJSONResponse({"order_id": order_id, "next_run_at": start_at, "every": request.every})
 
+@app.get("/standing_orders/{account_number}", dependencies=[Depends(require_database)])
+async def list_standing_orders(account_number: str, username: str = ""):
+    request_logger.info("Standing-orders: Received username=%s", username)
+    if not username:
+        logger.warning("Standing-orders: No username provided")
+        raise HTTPException(status_code=401, detail="Not authenticated")
     try:
         async with app.state.db_pool.acquire() as conn:
-            transfers = await conn.fetch(
-                "SELECT transfer_id, from_account, to_account, amount, status, result FROM transfer_jobs WHERE from_account = $1 OR to_account = $1",
+            orders = await conn.fetch(
+                "SELECT order_id, from_account, to_account, amount, start_at, every::text AS every, runs, next_run_at, last_transfer_id FROM standing_orders WHERE from_account = $1 AND active ORDER BY next_run_at",
                 account_number
             )
-            if not transfers:
-                content = f"""
-                <h1>Transfer History for {account_number}</h1>
-                <p>No transfers found for this account.</p>
-                <a href="/view-history?username={username}" class="button">Back to View History</a>
-                """
-                return HTMLResponse(content=render_base_html("Transfer History", content, username, "/view-history"))
-
-        table_rows = ""
-        for t in transfers:
-            # Parse the result JSON string into a dictionary
-            result = json.loads(t['result']) if t['result'] else {}
-            result_message = result.get('message', 'N/A') if isinstance(result, dict) else 'N/A'
-            table_rows += f"""
-            <tr>
-                <td>{t['transfer_id']}</td>
-                <td>{t['from_account']}</td>
-                <td>{t['to_account']}</td>
-                <td>£{t['amount']:.2f}</td>
-                <td>{t['status']}</td>
-                <td>{result_message}</td>
-            </tr>
-            """
+    except Exception as e:
+        logger.error("Error listing standing orders for %s: %s", account_number, e)
+        raise HTTPException(status_code=500, detail="Failed to list standing orders")
+    return raw_json_response(dumps_records(orders))
 
-        content = f"""
-        <h1>Transfer History for {account_number}</h1>
-        <table>
-            <tr>
-                <th>Transfer ID</th>
-                <th>From Account</th>
-                <th>To Account</th>
-                <th>Amount</th>
-                <th>Status</th>
-                <th>Result</th>
-            </tr>
-            {table_rows}
-        </table>
-        <a href="/view-history?username={username}" class="button">Back to View History</a>
-        """
-        return HTMLResponse(content=render_base_html("Transfer History", content, username, "/history"))
+@app.delete("/standing_orders/{order_id}", dependencies=[Depends(require_database)])
+async def cancel_standing_order(order_id: str, username: str = ""):
+    request_logger.info("Cancel-standing-order: Received username=%s", username)
+    if not username:
+        logger.warning("Cancel-standing-order: No username provided")
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        async with app.state.db_pool.acquire() as conn:
+            cancelled = await conn.fetchval(
+                "UPDATE standing_orders SET active = FALSE WHERE order_id = $1 AND active RETURNING order_id",
+                order_id
+            )
+        if cancelled:
+            await scheduler.unschedule(app.state.redis, order_id)
     except Exception as e:
-        logger.error(f"Error fetching history for {account_number}: {str(e)}")
-        content = """
-        <h1>Error</h1>
-        <p>Failed to fetch transfer history. Please try again later.</p>
-        <a href="/view-history?username={username}" class="button">Back to View History</a>
-        """.format(username=username)
-        return HTMLResponse(content=render_base_html("Error", content, username, "/view-history"), status_code=500)
+        logger.error("Error cancelling standing order %s: %s", order_id, e)
+        raise HTTPException(status_code=500, detail="Failed to cancel standing order")
+    if not cancelled:
+        raise HTTPException(status_code=404, detail="Standing order not found")
+    return {"message": f"Standing order {order_id} cancelled"}
+
+# Bank-wide transfer reports, read from the rollup tables maintained by rollups.py
+ROLLUP_TABLES = {"hour": "transfer_rollup_hourly", "day": "transfer_rollup_daily"}
+
+def summarize_rollup(rows):
+    summary = {"transfers": 0, "transfer_volume": 0.0, "deposits": 0, "deposit_volume": 0.0, "failed": 0, "failures": {}}
+    for row in rows:
+        if row['status'] == "completed":
+            summary["transfers"] += row['transfers']
+            summary["transfer_volume"] += row['volume']
+        elif row['status'] == "deposit":
+            summary["deposits"] += row['transfers']
+            summary["deposit_volume"] += row['volume']
+        elif row['status'] == "failed":
+            summary["failed"] += row['transfers']
+            summary["failures"][row['reason']] = summary["failures"].get(row['reason'], 0) + row['transfers']
+    attempted = summary["transfers"] + summary["failed"]
+    summary["failure_rate"] = summary["failed"] / attempted if attempted else 0.0
+    summary["transfer_volume"] = round(summary["transfer_volume"], 2)
+    summary["deposit_volume"] = round(summary["deposit_volume"], 2)
+    return summary
+
+@app.get("/reports/transfers", dependencies=[Depends(require_database)])
+async def transfer_report(username: str = "", granularity: str = "day", start: Optional[date] = None, end: Optional[date] = None):
+    request_logger.info("Transfer-report: Received username=%s", username)
+    if not username:
+        logger.warning("Transfer-report: No username provided")
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if granularity not in ROLLUP_TABLES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(ROLLUP_TABLES)}")
+    end = end or date.today()
+    start = start or end - timedelta(days=30)
+
+    try:
+        async with app.state.db_pool.acquire() as conn:
+            rows = await conn.fetch(
+                f"SELECT bucket, status, reason, transfers, volume FROM {ROLLUP_TABLES[granularity]} WHERE bucket >= $1::date AND bucket < $2::date + 1 ORDER BY bucket",
+                start, end
+            )
+    except Exception as e:
+        logger.error("Error reading transfer rollups: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to build report")
+
+    buckets = {}
+    for row in rows:
+        buckets.setdefault(row['bucket'], []).append(row)
+    return FastJSONResponse({
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "total": summarize_rollup(rows),
+        "buckets": [dict(summarize_rollup(bucket_rows), bucket=bucket) for bucket, bucket_rows in buckets.items()]
+    })
 
 @app.post("/register")
 async def register(request: Request, username: str = Form(None), password: str = Form(None)):
@@ -738,7 +1280,7 @@ async def register(request: Request, username: str = Form(None), password: str =
             register_request = RegisterRequest(username=username, password=password)
             is_form_submission = True
         except ValueError as e:
-            logger.warning(f"Invalid form data: {str(e)}")
+            logger.warning("Invalid form data: %s", e)
             content = f"""
             <h1>Registration Failed</h1>
             <p class="error-message">Invalid form data: {str(e)}</p>
@@ -751,57 +1293,49 @@ async def register(request: Request, username: str = Form(None), password: str =
             register_request = RegisterRequest(**body)
             is_form_submission = False
         except ValueError as e:
-            logger.warning(f"Invalid JSON data: {str(e)}")
+            logger.warning("Invalid JSON data: %s", e)
             raise HTTPException(status_code=400, detail=f"Invalid JSON data: {str(e)}")
         except Exception as e:
-            logger.warning(f"Failed to parse JSON request: {str(e)}")
+            logger.warning("Failed to parse JSON request: %s", e)
             raise HTTPException(status_code=400, detail="Invalid request format")
 
-    async with app.state.db_pool.acquire() as conn:
-        existing_user = await conn.fetchrow(
-            "SELECT username FROM users WHERE username = $1",
-            register_request.username
-        )
-        if existing_user:
-            logger.warning(f"Registration failed: Username {register_request.username} already exists")
-            if is_form_submission:
-                content = f"""
-                <h1>Registration Failed</h1>
-                <p class="error-message">Username {register_request.username} already exists.</p>
-                <a href="/register" class="button">Try Again</a>
-                """
-                return HTMLResponse(content=render_base_html("Registration Failed", content, current_path="/register"), status_code=400)
-            raise HTTPException(status_code=400, detail=f"Username {register_request.username} already exists")
+    if await app.state.storage.password_hash(register_request.username) is not None:
+        logger.warning("Registration failed: Username %s already exists", register_request.username)
+        if is_form_submission:
+            content = f"""
+            <h1>Registration Failed</h1>
+            <p class="error-message">Username {register_request.username} already exists.</p>
+            <a href="/register" class="button">Try Again</a>
+            """
+            return HTMLResponse(content=render_base_html("Registration Failed", content, current_path="/register"), status_code=400)
+        raise HTTPException(status_code=400, detail=f"Username {register_request.username} already exists")
 
-        try:
-            password_hash = bcrypt.hashpw(register_request.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        except Exception as e:
-            logger.error(f"Error hashing password for user {register_request.username}: {str(e)}")
-            if is_form_submission:
-                content = """
-                <h1>Error</h1>
-                <p class="error-message">Failed to hash password. Please try again later.</p>
-                <a href="/register" class="button">Try Again</a>
-                """
-                return HTMLResponse(content=render_base_html("Error", content, current_path="/register"), status_code=500)
-            raise HTTPException(status_code=500, detail="Failed to hash password")
+    try:
+        password_hash = bcrypt.hashpw(register_request.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    except Exception as e:
+        logger.error("Error hashing password for user %s: %s", register_request.username, e)
+        if is_form_submission:
+            content = """
+            <h1>Error</h1>
+            <p class="error-message">Failed to hash password. Please try again later.</p>
+            <a href="/register" class="button">Try Again</a>
+            """
+            return HTMLResponse(content=render_base_html("Error", content, current_path="/register"), status_code=500)
+        raise HTTPException(status_code=500, detail="Failed to hash password")
 
-        try:
-            await conn.execute(
-                "INSERT INTO users (username, password_hash) VALUES ($1, $2)",
-                register_request.username, password_hash
-            )
-            logger.info(f"User {register_request.username} registered successfully")
-            if is_form_submission:
-                return RedirectResponse(url="/login", status_code=303)
-            return JSONResponse(content={"message": f"User {register_request.username} registered successfully"})
-        except Exception as e:
-            logger.error(f"Error inserting user {register_request.username} into database: {str(e)}")
-            if is_form_submission:
-                content = """
-                <h1>Error</h1>
-                <p class="error-message">Failed to register user. Please try again later.</p>
-                <a href="/register" class="button">Try Again</a>
-                """
-                return HTMLResponse(content=render_base_html("Error", content, current_path="/register"), status_code=500)
-            raise HTTPException(status_code=500, detail="Failed to register user")
+    try:
+        await app.state.storage.create_user(register_request.username, password_hash)
+        logger.info("User %s registered successfully", register_request.username)
+        if is_form_submission:
+            return RedirectResponse(url="/login", status_code=303)
+        return JSONResponse(content={"message": f"User {register_request.username} registered successfully"})
+    except Exception as e:
+        logger.error("Error inserting user %s into database: %s", register_request.username, e)
+        if is_form_submission:
+            content = """
+            <h1>Error</h1>
+            <p class="error-message">Failed to register user. Please try again later.</p>
+            <a href="/register" class="button">Try Again</a>
+            """
+            return HTMLResponse(content=render_base_html("Error", content, current_path="/register"), status_code=500)
+        raise HTTPException(status_code=500, detail="Failed to register user")
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import uuid
+import bcrypt
+import httpx
+
+# In-process benchmark suite. Drives app.py through its ASGI interface (no network, no
+# uvicorn) against the local Postgres and Redis configured in app.py, and calls
+# transfer_engine.process_transfer directly. Results are written as JSON and compared with
+# a stored baseline; a hot path that got slower than the noise threshold fails the run.
+#
+#   ./benchmark.py --save-baseline      # record benchmarks/baseline.json on this machine
+#   ./benchmark.py                      # compare against it, exit 1 on regression
+#
+# Run it against a scratch database with no redis_worker attached: it seeds its own
+# accounts (900000-900099, 800000+ for opens) and removes them afterwards.
+#
+# With STORAGE_BACKEND=memory the app and engine share storage.MemoryStorage and no
+# Postgres is used, which gives the ceiling of the Python layer; keep its results apart
+# with --baseline/--output.
+
+BASELINE_PATH = "benchmarks/baseline.json"
+RESULTS_PATH = "benchmarks/latest.json"
+USERNAME = "bench_user"
+PASSWORD = "bench_password"
+SEED_ACCOUNTS = [f"{900000 + i}" for i in range(100)]
+HISTORY_ACCOUNT = SEED_ACCOUNTS[0]
+HISTORY_ROWS = 500
+OPEN_BATCH = 100
+ROUNDS = 5
+THRESHOLD = 0.10
+
+BENCHMARKS = {}
+
+def benchmark(name: str, iterations: int = 200, prepare=None):
+    def register(func):
+        BENCHMARKS[name] = (func, iterations, prepare)
+        return func
+    return register
+
+class Context:
+    def __init__(self, client, pool, storage, redis_client):
+        self.client = client
+        self.pool = pool
+        self.storage = storage
+        self.redis = redis_client
+        self.counter = 0
+        self.opened = []
+
+    def next_account(self):
+        self.counter += 1
+        return f"{800000 + self.counter % 100000:06d}"
+
+@benchmark("list")
+async def bench_list(ctx, _):
+    response = await ctx.client.get("/list", params={"username": USERNAME})
+    assert response.status_code == 200, response.status_code
+
+@benchmark("api_balance", iterations=1000)
+async def bench_api_balance(ctx, _):
+    response = await ctx.client.get(f"/api/balance/{SEED_ACCOUNTS[ctx.counter % len(SEED_ACCOUNTS)]}", params={"username": USERNAME})
+    ctx.counter += 1
+    assert response.status_code == 200, response.status_code
+
+# Unchanged poll: the client already holds the current ETag
+async def prepare_conditional(ctx):
+    account = SEED_ACCOUNTS[ctx.counter % len(SEED_ACCOUNTS)]
+    ctx.counter += 1
+    response = await ctx.client.get(f"/api/balance/{account}", params={"username": USERNAME})
+    return account, response.headers["etag"]
+
+@benchmark("api_balance_not_modified", iterations=1000, prepare=prepare_conditional)
+async def bench_api_balance_not_modified(ctx, payload):
+    account, etag = payload
+    response = await ctx.client.get(f"/api/balance/{account}", params={"username": USERNAME}, headers={"If-None-Match": etag})
+    assert response.status_code == 304, response.status_code
+
+@benchmark("history")
+async def bench_history(ctx, _):
+    response = await ctx.client.get(f"/history/{HISTORY_ACCOUNT}", params={"username": USERNAME})
+    assert response.status_code == 200, response.status_code
+
+async def prepare_open(ctx):
+    numbers = [ctx.next_account() for _ in range(OPEN_BATCH)]
+    await ctx.storage.remove_accounts(numbers)
+    ctx.opened.extend(numbers)
+    return {"accounts": [{"account_number": number, "balance": 100.0, "first_name": "Bench"} for number in numbers]}
+
+@benchmark("open_account_bulk", iterations=50, prepare=prepare_open)
+async def bench_open_account(ctx, payload):
+    response = await ctx.client.post("/open_account", params={"username": USERNAME}, json=payload)
+    assert response.status_code == 200, response.text
+
+@benchmark("deposit", iterations=500)
+async def bench_deposit(ctx, _):
+    data = {"account_number": SEED_ACCOUNTS[ctx.counter % len(SEED_ACCOUNTS)], "amount": "1.00", "username": USERNAME}
+    ctx.counter += 1
+    response = await ctx.client.post("/deposit", data=data)
+    assert response.status_code == 303 and response.headers["location"].startswith("/dashboard"), response.headers.get("location")
+
+@benchmark("login", iterations=20)
+async def bench_login(ctx, _):
+    response = await ctx.client.post("/login", data={"username": USERNAME, "password": PASSWORD})
+    assert response.status_code == 303, response.status_code
+
+# Full transfer path: enqueue through the API, then pop the job and process it as the worker would
+@benchmark("transfer", iterations=500)
+async def bench_transfer(ctx, _):
+    from_account = SEED_ACCOUNTS[ctx.counter % len(SEED_ACCOUNTS)]
+    to_account = SEED_ACCOUNTS[(ctx.counter + 1) % len(SEED_ACCOUNTS)]
+    ctx.counter += 1
+    response = await ctx.client.post("/transfer", json={"from_account": from_account, "to_account": to_account, "amount": 1.0})
+    assert response.status_code == 200, response.text
+    job = json.loads(await ctx.redis.lpop("transfers"))
+    job["dequeued_at"] = time.time()
+    assert await transfer_engine.process_transfer(ctx.worker_storage, ctx.redis, job) == "completed"
+
+async def prepare_process_transfer(ctx):
+    transfer_id = str(uuid.uuid4())
+    from_account = SEED_ACCOUNTS[ctx.counter % len(SEED_ACCOUNTS)]
+    to_account = SEED_ACCOUNTS[(ctx.counter + 1) % len(SEED_ACCOUNTS)]
+    ctx.counter += 1
+    await ctx.storage.create_job(transfer_id, from_account, to_account, 1.0)
+    return {"transfer_id": transfer_id, "from_account": from_account, "to_account": to_account, "amount": 1.0, "enqueued_at": time.time()}
+
+@benchmark("process_transfer", iterations=500, prepare=prepare_process_transfer)
+async def bench_process_transfer(ctx, job):
+    assert await transfer_engine.process_transfer(ctx.worker_storage, ctx.redis, job) == "completed"
+
+async def seed(pool):
+    password_hash = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM users WHERE username = $1", USERNAME)
+            await conn.execute("INSERT INTO users (username, password_hash) VALUES ($1, $2)", USERNAME, password_hash)
+            await conn.execute("DELETE FROM accounts WHERE account_number = ANY($1)", SEED_ACCOUNTS)
+            await conn.executemany(
+                "INSERT INTO accounts (account_number, balance, first_name, last_name) VALUES ($1, $2, 'Bench', 'Account')",
+                [(number, 1000000.0) for number in SEED_ACCOUNTS]
+            )
+            if ledger.ENABLED:
+                await delete_ledger(conn, SEED_ACCOUNTS)
+                await ledger.create_snapshots(conn, [(number, 1000000.0) for number in SEED_ACCOUNTS])
+            await conn.executemany(
+                "INSERT INTO transfer_jobs (transfer_id, from_account, to_account, amount, status, result, timestamp) VALUES ($1, $2, $3, $4, 'completed', $5, CURRENT_TIMESTAMP)",
+                [
+                    (str(uuid.uuid4()), HISTORY_ACCOUNT, SEED_ACCOUNTS[1 + i % 99], 1.0, json.dumps({"message": "Transfer successful"}))
+                    for i in range(HISTORY_ROWS)
+                ]
+            )
+
+# STORAGE_BACKEND=memory: the app's storage starts empty and is discarded at exit
+async def seed_memory(storage):
+    await storage.create_user(USERNAME, bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'))
+    await storage.open_accounts([
+        AccountRequest(account_number=number, balance=1000000.0, first_name="Bench", last_name="Account")
+        for number in SEED_ACCOUNTS
+    ])
+    await storage.save_outcomes([
+        {"transfer_id": str(uuid.uuid4()), "from_account": HISTORY_ACCOUNT, "to_account": SEED_ACCOUNTS[1 + i % 99], "amount": 1.0,
+         "status": "completed", "result": {"message": "Transfer successful"}, "recorded_at": time.time()}
+        for i in range(HISTORY_ROWS)
+    ])
+
+async def delete_ledger(conn, accounts):
+    for table in ("ledger_entries", "ledger_entries_archive", "balance_snapshots"):
+        await conn.execute(f"DELETE FROM {table} WHERE account_number = ANY($1)", accounts)
+
+async def cleanup(ctx):
+    accounts = SEED_ACCOUNTS + ctx.opened
+    # Outcomes still in the write-behind would recreate transfer_jobs rows after the delete
+    if not await job_status.drain(ctx.redis):
+        print("Transfer outcomes still queued after 30s; some transfer_jobs rows may outlive cleanup")
+    async with ctx.pool.acquire() as conn:
+        if ledger.ENABLED:
+            await delete_ledger(conn, accounts)
+        await conn.execute("DELETE FROM transfer_jobs WHERE from_account = ANY($1) OR to_account = ANY($1)", accounts)
+        await conn.execute("DELETE FROM accounts WHERE account_number = ANY($1)", accounts)
+        await conn.execute("DELETE FROM users WHERE username = $1", USERNAME)
+
+async def measure(ctx, func, iterations: int, prepare, rounds: int):
+    round_medians = []
+    samples = []
+    for _ in range(rounds):
+        timings = []
+        for _ in range(iterations):
+            arg = await prepare(ctx) if prepare else None
+            start = time.perf_counter()
+            await func(ctx, arg)
+            timings.append(time.perf_counter() - start)
+        round_medians.append(statistics.median(timings))
+        samples.extend(timings)
+    samples.sort()
+    median = statistics.median(round_medians)
+    return {
+        "iterations": iterations * rounds,
+        "median_ms": median * 1000,
+        "p95_ms": samples[int(0.95 * (len(samples) - 1))] * 1000,
+        "ops_per_sec": 1 / median if median else 0.0,
+        # Spread between rounds, used to widen the regression threshold on noisy benchmarks
+        "noise": statistics.pstdev(round_medians) / median if median else 0.0
+    }
+
+async def run(selected, rounds: int):
+    # The benchmarks pop and process transfers themselves, so the app must not run its own engine
+    app.state.external_engine = True
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            ctx = Context(client, app.state.db_pool, app.state.storage, app.state.redis)
+            in_memory = ctx.pool is None
+            if in_memory:
+                # The engine has to share the app's in-memory storage
+                ctx.worker_storage = ctx.storage
+                await seed_memory(ctx.storage)
+            else:
+                # Seeding writes to the primary database, so the benchmarks run unsharded
+                ctx.worker_pool = await redis_worker.init_db_pool()
+                ctx.worker_storage = make_storage("postgres", ctx.worker_pool)
+                await seed(ctx.pool)
+            # The app built its account filter and profile cache before the seed accounts existed
+            await account_index.publish(ctx.redis, SEED_ACCOUNTS)
+            await profile_cache.invalidate(ctx.redis, SEED_ACCOUNTS)
+            results = {}
+            try:
+                for name in selected:
+                    func, iterations, prepare = BENCHMARKS[name]
+                    for _ in range(min(10, iterations)):
+                        await func(ctx, await prepare(ctx) if prepare else None)
+                    results[name] = await measure(ctx, func, iterations, prepare, rounds)
+                    print(f"{name:20s} median {results[name]['median_ms']:9.3f}ms  p95 {results[name]['p95_ms']:9.3f}ms  "
+                          f"{results[name]['ops_per_sec']:9.1f} ops/s  noise {results[name]['noise']:.1%}")
+            finally:
+                if not in_memory:
+                    await cleanup(ctx)
+                    await ctx.worker_pool.close()
+    return results
+
+def compare(results: dict, baseline: dict, threshold: float):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"{name:20s} no baseline")
+            continue
+        allowed = max(threshold, 3 * max(result["noise"], base["noise"]))
+        change = result["median_ms"] / base["median_ms"] - 1
+        verdict = "REGRESSION" if change > allowed else "ok"
+        print(f"{name:20s} {base['median_ms']:9.3f}ms -> {result['median_ms']:9.3f}ms  {change:+7.1%} (allowed +{allowed:.1%})  {verdict}")
+        if change > allowed:
+            regressions.append(name)
+    return regressions
+
+def main(args):
+    selected = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        sys.exit(f"Unknown benchmarks: {sorted(unknown)}")
+    results = asyncio.run(run(selected, args.rounds))
+    payload = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "rounds": args.rounds,
+        "results": results
+    }
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(payload, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(payload, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline first")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print("\n--- Comparison with baseline ---")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        sys.exit(f"Performance regression in: {', '.join(regressions)}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process benchmarks for app.py and redis_worker.py")
+    parser.add_argument("--only", help="comma-separated benchmark names: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--rounds", type=int, default=ROUNDS)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="minimum allowed slowdown before failing (0.10 = 10%%)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+    # Imported late: both modules set up logging and metrics at import time
+    from app import app, account_index, profile_cache, AccountRequest
+    import redis_worker
+    import transfer_engine
+    import job_status
+    import ledger
+    from storage import make_storage
+    main(args)
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Point-in-time balances for app.py's as-of endpoints (tables in
+# migrations/007_balance_checkpoints.sql).
+#
+# A balance at time T is the account's latest checkpoint at or before T plus its
+# transfer_jobs deltas (completed transfers out, completed transfers and deposits in)
+# after the checkpoint, up to T. The deltas come from the (from_account, timestamp) and
+# (to_account, timestamp) indexes, so a lookup costs the activity since the checkpoint,
+# not the account's whole history.
+#
+# run_checkpoints() (started by redis_worker) takes a run every CHECKPOINT_INTERVAL
+# seconds. Each run covers the window since the previous one and writes a checkpoint
+# for every account that moved in it: the account's previous checkpoint plus the
+# window's deltas. A run stops CHECKPOINT_LAG seconds before now, and also before the
+# oldest transfer still pending, so transfers in flight and deposits still in
+# job_status's write-behind fall into a later window instead of being missed.
+# open_account writes an account's first checkpoint with its opening balance.
+
+CHECKPOINT_INTERVAL = float(os.environ.get("CHECKPOINT_INTERVAL", "3600"))
+CHECKPOINT_LAG = float(os.environ.get("CHECKPOINT_LAG", "300"))
+# Pending rows older than this are treated as lost rather than holding runs back
+STALE_PENDING = float(os.environ.get("CHECKPOINT_STALE_PENDING", "86400"))
+EXPORT_CHUNK = 5000
+LOCK_KEY = "balance_checkpoints"
+
+def deltas_query(low: str, high: str, account: str = ""):
+    debit = f"AND from_account = {account}" if account else ""
+    credit = f"AND to_account = {account}" if account else ""
+    return f"""
+        SELECT account_number, sum(delta) AS delta FROM (
+            SELECT from_account AS account_number, -amount AS delta FROM transfer_jobs
+            WHERE status = 'completed' {debit} AND timestamp > {low} AND timestamp <= {high}
+            UNION ALL
+            SELECT to_account, amount FROM transfer_jobs
+            WHERE status IN ('completed', 'deposit') {credit} AND timestamp > {low} AND timestamp <= {high}
+        ) d GROUP BY account_number
+    """
+
+TAKE_QUERY = f"""
+    WITH bounds AS (
+        SELECT COALESCE((SELECT max(taken_at) FROM balance_checkpoint_runs), '-infinity'::timestamp) AS low,
+               date_trunc('second', LEAST(
+                   localtimestamp - $1 * interval '1 second',
+                   (SELECT min(timestamp) - interval '1 microsecond' FROM transfer_jobs
+                    WHERE status = 'pending' AND timestamp > localtimestamp - $2 * interval '1 second')
+               )) AS high
+    ), window_bounds AS (
+        SELECT low, high FROM bounds WHERE high > low
+    ), deltas AS ({deltas_query("(SELECT low FROM window_bounds)", "(SELECT high FROM window_bounds)")}
+    ), taken AS (
+        INSERT INTO balance_checkpoints (account_number, taken_at, balance)
+        SELECT d.account_number, w.high, c.balance + d.delta
+        FROM deltas d CROSS JOIN window_bounds w
+        CROSS JOIN LATERAL (
+            SELECT balance FROM balance_checkpoints
+            WHERE account_number = d.account_number AND taken_at <= w.high
+            ORDER BY taken_at DESC LIMIT 1
+        ) c
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    ), run AS (
+        INSERT INTO balance_checkpoint_runs (taken_at, accounts)
+        SELECT high, (SELECT count(*) FROM taken) FROM window_bounds
+        RETURNING taken_at, accounts
+    )
+    SELECT taken_at, accounts FROM run
+"""
+
+BALANCE_AT_QUERY = f"""
+    WITH cp AS (
+        SELECT taken_at, balance FROM balance_checkpoints
+        WHERE account_number = $1 AND taken_at <= $2::timestamptz
+        ORDER BY taken_at DESC LIMIT 1
+    ), deltas AS ({deltas_query("(SELECT taken_at FROM cp)", "$2::timestamptz", "$1")}
+    )
+    SELECT NULLIF(cp.taken_at, '-infinity') AS checkpoint_at,
+           cp.balance + COALESCE((SELECT delta FROM deltas), 0) AS balance
+    FROM cp
+"""
+
+# Every account is at its latest checkpoint as of the last run before T (runs are
+# contiguous), so only the deltas between that run and T have to be added
+EXPORT_QUERY = f"""
+    WITH run AS (
+        SELECT COALESCE(max(taken_at), '-infinity'::timestamp) AS at
+        FROM balance_checkpoint_runs WHERE taken_at <= $1::timestamptz
+    ), deltas AS ({deltas_query("(SELECT at FROM run)", "$1::timestamptz")}
+    )
+    SELECT c.account_number, c.balance + COALESCE(d.delta, 0) AS balance
+    FROM (
+        SELECT DISTINCT ON (account_number) account_number, balance FROM balance_checkpoints
+        WHERE taken_at <= $1::timestamptz
+        ORDER BY account_number, taken_at DESC
+    ) c
+    LEFT JOIN deltas d USING (account_number)
+    ORDER BY c.account_number
+"""
+
+async def create_checkpoints(conn, balances):
+    await conn.executemany(
+        "INSERT INTO balance_checkpoints (account_number, taken_at, balance) VALUES ($1, localtimestamp, $2) ON CONFLICT DO NOTHING",
+        balances
+    )
+
+async def take_checkpoint(pool):
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if not await conn.fetchval("SELECT pg_try_advisory_xact_lock(hashtext($1))", LOCK_KEY):
+                return None
+            return await conn.fetchrow(TAKE_QUERY, CHECKPOINT_LAG, STALE_PENDING)
+
+async def run_checkpoints(pool, interval: float = CHECKPOINT_INTERVAL):
+    while True:
+        try:
+            run = await take_checkpoint(pool)
+            if run:
+                logger.info("Balance checkpoint at %s: %s accounts", run['taken_at'], run['accounts'])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Balance checkpoint failed: %s", e)
+        await asyncio.sleep(interval)
+
+async def balance_at(conn, account_number: str, at):
+    return await conn.fetchrow(BALANCE_AT_QUERY, account_number, at)
+
+async def stream_export(pool, conn, transaction, cursor, first_chunk):
+    try:
+        yield "account_number,balance\n"
+        chunk = first_chunk
+        while chunk:
+            yield "".join(f"{row['account_number']},{row['balance']:.2f}\n" for row in chunk)
+            if len(chunk) < EXPORT_CHUNK:
+                break
+            chunk = await cursor.fetch(EXPORT_CHUNK)
+    except Exception as e:
+        logger.error("Error streaming as-of balances: %s", e)
+    finally:
+        try:
+            await transaction.rollback()
+        finally:
+            await pool.release(conn)
@@ -0,0 +1,29 @@
+from decimal import Decimal
+from fastapi.responses import Response
+import orjson
+
+# Fast JSON responses for trusted internal data. Handlers return these directly,
+# so FastAPI skips response_model validation and serializes with orjson instead.
+
+def default(obj):
+    # asyncpg returns NUMERIC columns as Decimal, which orjson does not encode natively
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=default)
+
+# Encode asyncpg Records straight to a JSON array of objects
+def dumps_records(records) -> bytes:
+    return orjson.dumps([dict(record) for record in records], default=default)
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+# Response wrapping JSON bytes that were already encoded (e.g. by dumps_records)
+def raw_json_response(body: bytes, status_code: int = 200, headers=None):
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
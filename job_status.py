@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import orjson
+from fast_json import dumps
+
+logger = logging.getLogger(__name__)
+
+# Write-behind for transfer_jobs. Transfer outcomes (redis_worker) and deposit audit rows
+# (app.py /deposit) are appended to the Redis stream STREAM right after the balance
+# change commits, instead of being written to Postgres in the same transaction. Every
+# app and worker process runs a writer in the consumer group GROUP that upserts them
+# into transfer_jobs (storage.save_outcomes) in batches of up to FLUSH_BATCH rows, at
+# most FLUSH_LINGER after the first one arrives.
+#
+# An entry is acknowledged only once its batch has committed, so nothing appended to the
+# stream is lost: a writer re-reads its own unacknowledged entries after a failed flush,
+# and entries left by a crashed writer are claimed by the others after CLAIM_IDLE_MS.
+# Upserts are idempotent, so a redelivered entry is harmless.
+
+STREAM = "transfer_outcomes"
+GROUP = "transfer_jobs_writer"
+FLUSH_BATCH = int(os.environ.get("STATUS_FLUSH_BATCH", "1000"))
+FLUSH_LINGER = float(os.environ.get("STATUS_FLUSH_LINGER", "0.05"))
+BLOCK_MS = 1000
+CLAIM_IDLE_MS = 30000
+CLAIM_INTERVAL = 10
+RETRY_DELAY = 1
+# Attempts at appending a row before record() gives up and raises; backoff doubles from
+# RECORD_BACKOFF up to RETRY_DELAY
+RECORD_ATTEMPTS = 5
+RECORD_BACKOFF = 0.05
+
+# The balance change has already committed when this runs, and checkpoints and rollups
+# rebuild balances from transfer_jobs, so a row must not be dropped. Appends are retried;
+# with attempts=None they are retried until Redis takes them (the worker and saga
+# recovery, which can make no progress without Redis anyway), otherwise the error is
+# raised after the last attempt so the caller does not report a clean success.
+async def record(redis_client, transfer_id: str, from_account: str, to_account: str, amount: float, status: str, result: dict,
+                 attempts: int = RECORD_ATTEMPTS):
+    job = {
+        "transfer_id": transfer_id,
+        "from_account": from_account,
+        "to_account": to_account,
+        "amount": amount,
+        "status": status,
+        "result": result,
+        "recorded_at": time.time()
+    }
+    delay = RECORD_BACKOFF
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            await redis_client.xadd(STREAM, {"job": dumps(job)})
+            return
+        except Exception as e:
+            if attempts is not None and attempt >= attempts:
+                # Keep the row in the log so it can be replayed by hand
+                logger.error("Failed to record transfer_jobs row after %s attempts (%s), not persisted: %s", attempt, e, dumps(job).decode())
+                raise
+            logger.warning("Failed to record transfer_jobs row for %s (attempt %s): %s", transfer_id, attempt, e)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, RETRY_DELAY)
+
+# Waits until every entry appended so far has been flushed (flush deletes them from the
+# stream); returns False if that takes longer than timeout
+async def drain(redis_client, timeout: float = 30, interval: float = 0.05):
+    deadline = time.monotonic() + timeout
+    while await redis_client.xlen(STREAM):
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(interval)
+    return True
+
+async def ensure_group(redis_client):
+    try:
+        await redis_client.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+    except Exception as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+async def flush(storage, redis_client, entries):
+    # Last outcome wins if a transfer appears twice in one batch
+    jobs = {}
+    for _, fields in entries:
+        # Pending entries that were deleted from the stream come back without fields
+        if fields:
+            job = orjson.loads(fields[b"job"])
+            jobs[job["transfer_id"]] = job
+    if jobs:
+        await storage.save_outcomes(list(jobs.values()))
+    ids = list({entry_id for entry_id, _ in entries})
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.xack(STREAM, GROUP, *ids)
+        pipe.xdel(STREAM, *ids)
+        await pipe.execute()
+
+async def _read(redis_client, consumer: str, start: str, count: int, block=None):
+    response = await redis_client.xreadgroup(GROUP, consumer, {STREAM: start}, count=count, block=block)
+    return response[0][1] if response else []
+
+async def run_writer(storage, redis_client, consumer: str = None):
+    consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+    await ensure_group(redis_client)
+    # Start with our own unacknowledged entries, left over from a failed flush
+    start = "0"
+    last_claim = 0.0
+    while True:
+        try:
+            entries = []
+            if time.monotonic() - last_claim >= CLAIM_INTERVAL:
+                last_claim = time.monotonic()
+                claimed = await redis_client.xautoclaim(STREAM, GROUP, consumer, CLAIM_IDLE_MS, count=FLUSH_BATCH)
+                entries.extend(claimed[1])
+            if start == "0":
+                pending = await _read(redis_client, consumer, "0", FLUSH_BATCH)
+                entries.extend(pending)
+                if len(pending) < FLUSH_BATCH:
+                    start = ">"
+            if not entries:
+                entries = await _read(redis_client, consumer, ">", FLUSH_BATCH, BLOCK_MS)
+                if entries and len(entries) < FLUSH_BATCH:
+                    await asyncio.sleep(FLUSH_LINGER)
+                    entries.extend(await _read(redis_client, consumer, ">", FLUSH_BATCH - len(entries)))
+            if entries:
+                await flush(storage, redis_client, entries)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("transfer_jobs write-behind flush failed, retrying: %s", e)
+            start = "0"
+            await asyncio.sleep(RETRY_DELAY)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Ledger storage mode (BALANCE_STORAGE=ledger, tables in migrations/001_ledger.sql).
+# Transfers and deposits append signed entries to ledger_entries instead of updating
+# accounts.balance, so there is no row update and no dead tuple per transfer.
+#
+# Balance = balance_snapshots.balance + sum(live ledger_entries). Credits need no check
+# and take no lock, so a hot receiving account (merchant, payroll) never serialises.
+# Debits must not overdraw, so they take a transaction-scoped advisory lock on the
+# source account, held only while its balance is summed and the entries appended.
+# Reads (/api/balance, /list) are lock-free.
+
+ENABLED = os.environ.get("BALANCE_STORAGE", "row") == "ledger"
+COMPACT_INTERVAL = float(os.environ.get("LEDGER_COMPACT_INTERVAL", "5"))
+COMPACT_MIN_ENTRIES = int(os.environ.get("LEDGER_COMPACT_MIN_ENTRIES", "50"))
+COMPACT_BATCH = 500
+
+# Relation that yields (account_number, balance) in the current mode
+BALANCES = "account_balances" if ENABLED else "accounts"
+
+BALANCE_QUERY = """
+    SELECT s.balance + COALESCE((SELECT sum(amount) FROM ledger_entries e WHERE e.account_number = $1), 0) AS balance
+    FROM balance_snapshots s WHERE s.account_number = $1
+"""
+
+async def account_balance(conn, account_number: str):
+    return await conn.fetchval(BALANCE_QUERY, account_number)
+
+async def account_exists(conn, account_number: str):
+    return await conn.fetchval("SELECT 1 FROM balance_snapshots WHERE account_number = $1", account_number) is not None
+
+# Serialise debits per source account, then read its balance (None if the account doesn't exist)
+async def lock_for_debit(conn, account_number: str):
+    await conn.execute("SELECT pg_advisory_xact_lock(hashtext('ledger:' || $1))", account_number)
+    return await account_balance(conn, account_number)
+
+async def append_transfer(conn, transfer_id: str, from_account: str, to_account: str, amount: float):
+    await conn.execute(
+        "INSERT INTO ledger_entries (transfer_id, account_number, amount) VALUES ($1, $2, $3), ($1, $4, $5)",
+        transfer_id, from_account, -amount, to_account, amount
+    )
+
+async def append_credit(conn, transfer_id: str, account_number: str, amount: float):
+    await conn.execute(
+        "INSERT INTO ledger_entries (transfer_id, account_number, amount) VALUES ($1, $2, $3)",
+        transfer_id, account_number, amount
+    )
+
+async def append_credits(conn, transfer_ids, account_numbers, amounts):
+    await conn.execute(
+        "INSERT INTO ledger_entries (transfer_id, account_number, amount) SELECT * FROM unnest($1::text[], $2::text[], $3::float8[])",
+        transfer_ids, account_numbers, amounts
+    )
+
+async def existing_accounts(conn, account_numbers):
+    rows = await conn.fetch("SELECT account_number FROM balance_snapshots WHERE account_number = ANY($1)", account_numbers)
+    return {row['account_number'] for row in rows}
+
+async def create_snapshots(conn, balances):
+    await conn.executemany(
+        "INSERT INTO balance_snapshots (account_number, balance) VALUES ($1, $2) ON CONFLICT (account_number) DO NOTHING",
+        balances
+    )
+
+# Fold the live entries of busy accounts into their snapshots. Entries are moved to the
+# archive and summed into the snapshot in one statement, so readers always see either the
+# entries or the folded snapshot, never both or neither. Uncommitted entries are invisible
+# to the DELETE and simply wait for the next round. accounts.balance is refreshed too, so
+# it lags the ledger by at most one compaction interval.
+COMPACT_QUERY = """
+    WITH busy AS (
+        SELECT account_number FROM ledger_entries
+        GROUP BY account_number HAVING count(*) >= $1
+        LIMIT $2
+    ), moved AS (
+        DELETE FROM ledger_entries e USING busy b
+        WHERE e.account_number = b.account_number
+        RETURNING e.entry_id, e.transfer_id, e.account_number, e.amount, e.created_at
+    ), archived AS (
+        INSERT INTO ledger_entries_archive (entry_id, transfer_id, account_number, amount, created_at)
+        SELECT entry_id, transfer_id, account_number, amount, created_at FROM moved
+    ), deltas AS (
+        SELECT account_number, sum(amount) AS delta, count(*) AS entries FROM moved GROUP BY account_number
+    ), snapshots AS (
+        UPDATE balance_snapshots s SET balance = s.balance + d.delta, taken_at = now()
+        FROM deltas d WHERE s.account_number = d.account_number
+        RETURNING s.account_number, s.balance
+    ), synced AS (
+        UPDATE accounts a SET balance = s.balance FROM snapshots s WHERE a.account_number = s.account_number
+    )
+    SELECT count(*) AS accounts, COALESCE(sum(entries), 0) AS entries FROM deltas
+"""
+
+async def compact(pool, min_entries: int = COMPACT_MIN_ENTRIES, batch: int = COMPACT_BATCH):
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(COMPACT_QUERY, min_entries, batch)
+    return row['accounts'], row['entries']
+
+async def run_compactor(pool, interval: float = COMPACT_INTERVAL):
+    while True:
+        try:
+            accounts, entries = await compact(pool)
+            if accounts:
+                logger.info("Compacted %s ledger entries into %s snapshots", entries, accounts)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Ledger compaction failed: %s", e)
+        await asyncio.sleep(interval)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import random
+import aiohttp
+from loadgen import run_step, summarize_histogram, write_results
+from load_test_transfer import HEADERS, USERNAME, get_valid_accounts, run_transfer
+
+# Mixed-workload scenario runner. A JSON profile declares the operation mix, how account
+# popularity is distributed, and the rate schedule, e.g.
+#
+#   {
+#     "seed": 42,
+#     "operations": {"balance": 60, "history": 10, "deposit": 10, "open": 5, "transfer": 15},
+#     "accounts": {"distribution": "zipf", "s": 1.1},
+#     "amounts": {"deposit": [10, 500], "transfer": [1, 100]},
+#     "schedule": [{"rate": 50, "seconds": 30}, {"rate": 200, "seconds": 60}]
+#   }
+#
+# Supported distributions: "uniform", "zipf" (parameter s) and "hotspot" (hot_fraction of
+# the accounts receive hot_traffic of the requests). See scenarios/ for ready-made profiles.
+
+BASE_URL = "http://localhost:5000"
+
+# Account pickers. Ranks are shuffled once (seeded) so the hot accounts aren't simply
+# the first rows of /list.
+def uniform_picker(accounts, rng, **_):
+    return lambda: accounts[rng.randrange(len(accounts))]
+
+def zipf_picker(accounts, rng, s: float = 1.1, **_):
+    ranked = accounts[:]
+    rng.shuffle(ranked)
+    cumulative = list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, len(ranked) + 1)))
+    total = cumulative[-1]
+    return lambda: ranked[bisect.bisect_left(cumulative, rng.random() * total)]
+
+def hotspot_picker(accounts, rng, hot_fraction: float = 0.01, hot_traffic: float = 0.5, **_):
+    ranked = accounts[:]
+    rng.shuffle(ranked)
+    split = max(1, int(len(ranked) * hot_fraction))
+    hot, cold = ranked[:split], ranked[split:] or ranked
+
+    def pick():
+        pool = hot if rng.random() < hot_traffic else cold
+        return pool[rng.randrange(len(pool))]
+    return pick
+
+PICKERS = {"uniform": uniform_picker, "zipf": zipf_picker, "hotspot": hotspot_picker}
+
+def make_picker(accounts, rng, spec: dict):
+    spec = dict(spec)
+    distribution = spec.pop("distribution", "uniform")
+    if distribution not in PICKERS:
+        raise ValueError(f"Unknown account distribution: {distribution}")
+    return PICKERS[distribution](accounts, rng, **spec)
+
+def new_account_payload(rng):
+    return {
+        "account_number": f"{rng.randrange(10 ** 6):06d}",
+        "balance": round(rng.uniform(0, 1000), 2),
+        "first_name": rng.choice(["John", "Jane", "Alice", "Bob"]),
+        "last_name": rng.choice(["Smith", "Jones", "Brown", "Taylor"]),
+        "town": rng.choice(["West End", "Riverside"]),
+        "city": rng.choice(["London", "Leeds"]),
+        "post_code": f"AB{rng.randint(10, 99)} {rng.randint(1, 9)}CD"
+    }
+
+# Each operation returns (ok, {histogram: seconds}, error, op) for loadgen.run_step
+def make_operations(session, base_url: str, pick, rng, amounts: dict):
+    loop = asyncio.get_running_loop()
+    params = {"username": USERNAME}
+
+    async def balance(intended):
+        async with session.get(f"{base_url}/api/balance/{pick()}", params=params, headers=HEADERS) as response:
+            await response.read()
+            ok = response.status == 200
+        return ok, {"balance": loop.time() - intended}, None if ok else f"balance HTTP {response.status}", "balance"
+
+    async def history(intended):
+        async with session.get(f"{base_url}/history/{pick()}", params=params) as response:
+            await response.read()
+            ok = response.status == 200
+        return ok, {"history": loop.time() - intended}, None if ok else f"history HTTP {response.status}", "history"
+
+    async def deposit(intended):
+        low, high = amounts.get("deposit", (10, 500))
+        data = {"account_number": pick(), "amount": f"{rng.uniform(low, high):.2f}", "username": USERNAME}
+        async with session.post(f"{base_url}/deposit", data=data, allow_redirects=False) as response:
+            ok = response.status == 303 and response.headers.get("Location", "").startswith("/dashboard")
+        return ok, {"deposit": loop.time() - intended}, None if ok else "deposit rejected", "deposit"
+
+    async def open_account(intended):
+        async with session.post(f"{base_url}/open_account", params=params, json=new_account_payload(rng), headers=HEADERS) as response:
+            await response.read()
+            ok = response.status == 200
+        return ok, {"open": loop.time() - intended}, None if ok else f"open HTTP {response.status}", "open"
+
+    async def transfer(intended):
+        low, high = amounts.get("transfer", (1, 100))
+        from_account = pick()
+        to_account = pick()
+        while to_account == from_account:
+            to_account = pick()
+        ok, latencies, error = await run_transfer(session, base_url, from_account, to_account, rng.uniform(low, high), intended)
+        latencies = {f"transfer.{name}": seconds for name, seconds in latencies.items()}
+        return ok, latencies, error and f"transfer: {error}", "transfer"
+
+    return {"balance": balance, "history": history, "deposit": deposit, "open": open_account, "transfer": transfer}
+
+def make_mix(operations: dict, weights: dict, rng):
+    unknown = set(weights) - set(operations)
+    if unknown:
+        raise ValueError(f"Unknown operations in profile: {sorted(unknown)}")
+    names = list(weights)
+    cumulative = list(itertools.accumulate(weights[name] for name in names))
+
+    # An operation that raises still counts as a failure of that operation, with its latency
+    # in the operation's own histogram rather than loadgen's shared "total"
+    async def mixed(intended):
+        name = names[bisect.bisect_right(cumulative, rng.random() * cumulative[-1])]
+        try:
+            return await operations[name](intended)
+        except Exception as e:
+            histogram = "transfer.total" if name == "transfer" else name
+            return False, {histogram: asyncio.get_running_loop().time() - intended}, f"{name}: {type(e).__name__}", name
+    return mixed
+
+def print_operations(result):
+    print(f"step {result.rate:g}/s for {result.elapsed:.1f}s, dropped {result.dropped}")
+    for op, counts in sorted(result.by_op.items()):
+        histogram = result.histograms.get(op) or result.histograms.get(f"{op}.total")
+        latency = summarize_histogram(histogram) if histogram else {}
+        print(
+            f"  {op:10s} ok {counts['ok']:7d}  failed {counts['failed']:6d}  "
+            f"{result.ok_in_window_by_op.get(op, 0) / result.elapsed:8.1f}/s  "
+            f"p50 {latency.get('p50_ms', 0):9.2f}ms  p99 {latency.get('p99_ms', 0):9.2f}ms  "
+            f"p99.9 {latency.get('p99.9_ms', 0):9.2f}ms"
+        )
+    if result.errors:
+        print(f"  errors: {result.errors}")
+
+async def main(args):
+    with open(args.profile) as f:
+        profile = json.load(f)
+    rng = random.Random(profile.get("seed"))
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        accounts = await get_valid_accounts(session, args.base_url)
+        pick = make_picker(accounts, rng, profile.get("accounts", {}))
+        operations = make_operations(session, args.base_url, pick, rng, profile.get("amounts", {}))
+        mixed = make_mix(operations, profile["operations"], rng)
+        results = []
+        for step in profile["schedule"]:
+            result = await run_step(mixed, step["rate"], step["seconds"])
+            results.append(result)
+            print_operations(result)
+    if args.json:
+        write_results(args.json, results, None, {"scenario": args.profile, "profile": profile})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a mixed-workload load profile against the bank")
+    parser.add_argument("profile", help="path to a JSON scenario profile")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--json", help="write per-step results to this file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import time
+from hdrh.histogram import HdrHistogram
+
+# Open-loop load generation shared by the load test scripts. Requests are started on a
+# fixed arrival schedule whether or not earlier ones have finished, and every latency is
+# measured from the request's intended start time rather than from when it was actually
+# sent. A slow server therefore shows up as queueing delay in the percentiles instead of
+# silently lowering the offered rate (coordinated omission).
+
+LATENCY_MAX_US = 300_000_000
+SIGNIFICANT_FIGURES = 3
+MAX_INFLIGHT = 20000
+DRAIN_TIMEOUT = 60
+PERCENTILES = (50, 90, 99, 99.9)
+
+def new_histogram():
+    return HdrHistogram(1, LATENCY_MAX_US, SIGNIFICANT_FIGURES)
+
+def record(histogram, seconds: float):
+    histogram.record_value(min(LATENCY_MAX_US, max(1, int(seconds * 1_000_000))))
+
+def summarize_histogram(histogram):
+    count = histogram.get_total_count()
+    if not count:
+        return {"count": 0}
+    summary = {"count": count, "mean_ms": histogram.get_mean_value() / 1000}
+    for p in PERCENTILES:
+        summary[f"p{p:g}_ms"] = histogram.get_value_at_percentile(p) / 1000
+    summary["max_ms"] = histogram.get_max_value() / 1000
+    return summary
+
+class StepResult:
+    def __init__(self, rate: float, duration: float):
+        self.rate = rate
+        self.duration = duration
+        self.elapsed = 0.0
+        self.started = 0
+        self.ok = 0
+        # Successes that finished before the arrival window closed, overall and per operation
+        self.ok_in_window = 0
+        self.ok_in_window_by_op = {}
+        self.window_closed = False
+        self.failed = 0
+        self.dropped = 0
+        self.errors = {}
+        self.histograms = {}
+        self.by_op = {}
+
+    def histogram(self, name: str):
+        if name not in self.histograms:
+            self.histograms[name] = new_histogram()
+        return self.histograms[name]
+
+    # Only completions inside the window count: ones finishing during the drain were served
+    # slower than offered, and counting them would report the offered rate regardless
+    @property
+    def achieved(self):
+        return self.ok_in_window / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self):
+        return {
+            "offered_rate": self.rate,
+            "achieved_rate": self.achieved,
+            "duration": self.elapsed,
+            "started": self.started,
+            "ok": self.ok,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "operations": {
+                op: dict(counts, throughput=self.ok_in_window_by_op.get(op, 0) / self.elapsed if self.elapsed else 0.0)
+                for op, counts in self.by_op.items()
+            },
+            "latency": {name: summarize_histogram(h) for name, h in self.histograms.items()}
+        }
+
+# operation(intended_start) must return (ok, {name: seconds}, error), optionally followed by
+# an operation name for mixed workloads. Each named latency is recorded into its own
+# histogram, e.g. "enqueue" and "total" for a transfer.
+async def run_step(operation, rate: float, duration: float, max_inflight: int = MAX_INFLIGHT):
+    loop = asyncio.get_running_loop()
+    result = StepResult(rate, duration)
+    tasks = {}
+
+    async def run_one(intended: float):
+        op = None
+        try:
+            outcome = await operation(intended)
+            ok, latencies, error = outcome[:3]
+            op = outcome[3] if len(outcome) > 3 else None
+        except Exception as e:
+            ok, latencies, error = False, {"total": loop.time() - intended}, type(e).__name__
+        in_window = ok and not result.window_closed
+        if op is not None:
+            counts = result.by_op.setdefault(op, {"ok": 0, "failed": 0})
+            counts["ok" if ok else "failed"] += 1
+            if in_window:
+                result.ok_in_window_by_op[op] = result.ok_in_window_by_op.get(op, 0) + 1
+        if in_window:
+            result.ok_in_window += 1
+        for name, seconds in latencies.items():
+            record(result.histogram(name), seconds)
+        if ok:
+            result.ok += 1
+        else:
+            result.failed += 1
+            result.errors[error] = result.errors.get(error, 0) + 1
+
+    interval = 1.0 / rate
+    count = int(rate * duration)
+    start = loop.time()
+    for i in range(count):
+        intended = start + i * interval
+        delay = intended - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= max_inflight:
+            # The generator itself is saturated; count the arrival instead of hiding it
+            result.dropped += 1
+            continue
+        result.started += 1
+        task = asyncio.create_task(run_one(intended))
+        tasks[task] = intended
+        task.add_done_callback(lambda task: tasks.pop(task, None))
+    # Throughput covers the arrival window only, not the drain below
+    result.elapsed = loop.time() - start
+    result.window_closed = True
+    if tasks:
+        await asyncio.wait(list(tasks), timeout=DRAIN_TIMEOUT)
+    # Requests still running after the drain are failures, not quietly left out of the step
+    timed_out = dict(tasks)
+    for task in timed_out:
+        task.cancel()
+    await asyncio.gather(*timed_out, return_exceptions=True)
+    for intended in timed_out.values():
+        record(result.histogram("total"), loop.time() - intended)
+        result.failed += 1
+        result.errors["timeout"] = result.errors.get("timeout", 0) + 1
+    return result
+
+# A step is past saturation when it can't keep up with the offered rate, its tail latency
+# breaks the SLO, or too many requests fail
+def saturated(result: StepResult, slo_p99_ms: float, max_error_rate: float = 0.01, histogram: str = "total"):
+    attempts = result.started + result.dropped
+    if not attempts:
+        return True
+    if result.achieved < 0.95 * result.rate:
+        return True
+    if (result.failed + result.dropped) / attempts > max_error_rate:
+        return True
+    latency = result.histograms.get(histogram)
+    return latency is not None and latency.get_value_at_percentile(99) / 1000 > slo_p99_ms
+
+async def ramp(operation, rates, step_duration: float, slo_p99_ms: float, report=None):
+    results = []
+    max_sustainable = None
+    for rate in rates:
+        result = await run_step(operation, rate, step_duration)
+        results.append(result)
+        if report:
+            report(result)
+        if saturated(result, slo_p99_ms):
+            break
+        max_sustainable = rate
+    return results, max_sustainable
+
+def print_step(result: StepResult, histogram: str = "total"):
+    latency = summarize_histogram(result.histograms.get(histogram, new_histogram()))
+    print(
+        f"offered {result.rate:8.1f}/s  achieved {result.achieved:8.1f}/s  "
+        f"ok {result.ok:7d}  failed {result.failed:6d}  dropped {result.dropped:6d}  "
+        f"p50 {latency.get('p50_ms', 0):9.2f}ms  p99 {latency.get('p99_ms', 0):9.2f}ms  "
+        f"p99.9 {latency.get('p99.9_ms', 0):9.2f}ms  max {latency.get('max_ms', 0):9.2f}ms"
+    )
+
+def write_results(path: str, results, max_sustainable, extra=None):
+    payload = {
+        "timestamp": time.time(),
+        "max_sustainable_rate": max_sustainable,
+        "steps": [result.to_dict() for result in results]
+    }
+    payload.update(extra or {})
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
@@ -0,0 +1,88 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+# Non-blocking logging shared by app.py and redis_worker.py. Callers only put the
+# LogRecord on an in-memory queue; formatting and disk writes happen on the
+# QueueListener's background thread.
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+QUEUE_SIZE = 100000
+RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+# Keep 1 in every N INFO (and lower) records; warnings and errors always pass
+class SampleFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        if not self.every:
+            return False
+        return next(self.counter) % self.every == 0
+
+# The stdlib QueueHandler formats the message in the calling thread; skip that and
+# leave msg % args for the listener thread
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+# One JSON object per line, including any extra= fields passed by the caller
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "msg": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_FIELDS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+# LOG_SAMPLE_RATES="app.requests=0.01,transfer_engine.jobs=0.1" overrides the defaults
+def parse_sample_rates(value: str):
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+def setup_logging(file_handler: logging.Handler, sample_rates=None, level=logging.INFO):
+    file_handler.setFormatter(JSONFormatter())
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.Queue(QUEUE_SIZE)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(log_queue))
+
+    rates = dict(sample_rates or {})
+    rates.update(parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", "")))
+    for name, rate in rates.items():
+        logging.getLogger(name).addFilter(SampleFilter(rate))
+    return listener
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+import time
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics shared by app.py (/metrics), redis_worker.py and scheduler.py (metrics ports)
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS
+)
+# Labelled by database, so each account shard's pool is reported next to the primary's
+DB_POOL_SIZE = Gauge('db_pool_size', 'Connections currently open in the asyncpg pool', ['pool'])
+DB_POOL_IN_USE = Gauge('db_pool_in_use', 'Connections currently checked out of the asyncpg pool', ['pool'])
+DB_POOL_MAX_SIZE = Gauge('db_pool_max_size', 'Configured maximum size of the asyncpg pool', ['pool'])
+DB_POOL_ACQUIRE_WAIT = Histogram(
+    'db_pool_acquire_wait_seconds', 'Time spent waiting for an asyncpg pool connection',
+    buckets=LATENCY_BUCKETS
+)
+REDIS_RTT = Histogram(
+    'redis_round_trip_seconds', 'Redis command round-trip time', ['command'],
+    buckets=LATENCY_BUCKETS
+)
+QUEUE_DEPTH = Gauge('transfer_queue_depth', 'Jobs waiting in the transfers queue')
+QUEUE_OLDEST_AGE = Gauge('transfer_queue_oldest_job_age_seconds', 'Age of the oldest job waiting in the transfers queue')
+WORKER_JOBS = Counter('worker_jobs_total', 'Transfer jobs processed by outcome', ['outcome'])
+WORKER_JOB_DURATION = Histogram(
+    'worker_job_duration_seconds', 'Time to process one transfer job', ['outcome'],
+    buckets=LATENCY_BUCKETS
+)
+PROFILE_CACHE_LOOKUPS = Counter('profile_cache_lookups_total', 'Account profile lookups by the tier that answered', ['tier'])
+STANDING_ORDERS_FIRED = Counter('standing_orders_fired_total', 'Standing-order occurrences enqueued as transfers')
+STANDING_ORDERS_DUE = Gauge('standing_orders_due', 'Standing orders indexed in the scheduler due set')
+
+QUEUE_SAMPLE_INTERVAL = 5
+
+# Async context for TimedPool.acquire(); supports both "async with" and "await"
+class TimedAcquire:
+    def __init__(self, owner, timeout=None):
+        self._owner = owner
+        self._timeout = timeout
+        self._conn = None
+
+    async def _acquire(self):
+        start = time.perf_counter()
+        conn = await self._owner._pool.acquire(timeout=self._timeout)
+        DB_POOL_ACQUIRE_WAIT.observe(time.perf_counter() - start)
+        return self._owner.wrap(conn)
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+    async def __aenter__(self):
+        self._conn = await self._acquire()
+        return self._conn
+
+    async def __aexit__(self, *exc):
+        conn, self._conn = self._conn, None
+        await self._owner.release(conn)
+
+# Wraps an asyncpg pool so acquire wait time is measured; everything else is passed through.
+# Subclasses can hand out wrapped connections by overriding wrap() and unwrap().
+class TimedPool:
+    def __init__(self, pool, name: str = "test_bank"):
+        self._pool = pool
+        DB_POOL_MAX_SIZE.labels(name).set(pool.get_max_size())
+        DB_POOL_SIZE.labels(name).set_function(pool.get_size)
+        DB_POOL_IN_USE.labels(name).set_function(lambda: pool.get_size() - pool.get_idle_size())
+
+    def acquire(self, *, timeout=None):
+        return TimedAcquire(self, timeout)
+
+    async def release(self, conn, *, timeout=None):
+        await self._pool.release(self.unwrap(conn), timeout=timeout)
+
+    def wrap(self, conn):
+        return conn
+
+    def unwrap(self, conn):
+        return conn
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+async def timed_redis(command: str, awaitable):
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        REDIS_RTT.labels(command).observe(time.perf_counter() - start)
+
+# Background task: Redis ping time, transfers queue depth and age of the job at its head
+async def sample_queue(redis_client, queue_name: str = 'transfers', interval: float = QUEUE_SAMPLE_INTERVAL):
+    while True:
+        try:
+            await timed_redis('ping', redis_client.ping())
+            QUEUE_DEPTH.set(await timed_redis('llen', redis_client.llen(queue_name)))
+            head = await timed_redis('lindex', redis_client.lindex(queue_name, 0))
+            enqueued_at = json.loads(head).get('enqueued_at') if head else None
+            QUEUE_OLDEST_AGE.set(max(0.0, time.time() - enqueued_at) if enqueued_at else 0)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Queue sampling failed: %s", e)
+        await asyncio.sleep(interval)
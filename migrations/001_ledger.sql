@@ -0,0 +1,41 @@
+-- Append-only double-entry ledger (BALANCE_STORAGE=ledger, see ledger.py).
+-- An account's balance is its snapshot plus the sum of its live ledger entries.
+-- The compactor moves live entries into ledger_entries_archive and folds them into
+-- the snapshot in the same transaction.
+
+CREATE TABLE IF NOT EXISTS ledger_entries (
+    entry_id BIGSERIAL PRIMARY KEY,
+    transfer_id TEXT NOT NULL,
+    account_number TEXT NOT NULL,
+    amount DOUBLE PRECISION NOT NULL,  -- signed: debits negative, credits positive
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS ledger_entries_account_idx ON ledger_entries (account_number, entry_id);
+
+CREATE TABLE IF NOT EXISTS ledger_entries_archive (
+    entry_id BIGINT PRIMARY KEY,
+    transfer_id TEXT NOT NULL,
+    account_number TEXT NOT NULL,
+    amount DOUBLE PRECISION NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL,
+    compacted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS ledger_entries_archive_account_idx ON ledger_entries_archive (account_number, created_at);
+
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+    account_number TEXT PRIMARY KEY,
+    balance DOUBLE PRECISION NOT NULL,
+    taken_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Seed one snapshot per existing account from the row balances
+INSERT INTO balance_snapshots (account_number, balance)
+SELECT account_number, balance FROM accounts
+ON CONFLICT (account_number) DO NOTHING;
+
+CREATE OR REPLACE VIEW account_balances AS
+SELECT s.account_number, s.balance + COALESCE(e.delta, 0) AS balance
+FROM balance_snapshots s
+LEFT JOIN (
+    SELECT account_number, sum(amount) AS delta FROM ledger_entries GROUP BY account_number
+) e USING (account_number);
@@ -0,0 +1,19 @@
+-- Standing orders: future and recurring transfers fired by scheduler.py.
+-- Occurrence n (from 0) is due at start_at + every * n, so monthly orders keep their
+-- day of month instead of drifting after a short month. One-off orders have every NULL.
+
+CREATE TABLE IF NOT EXISTS standing_orders (
+    order_id TEXT PRIMARY KEY,
+    from_account TEXT NOT NULL,
+    to_account TEXT NOT NULL,
+    amount DOUBLE PRECISION NOT NULL,
+    start_at TIMESTAMPTZ NOT NULL,
+    every INTERVAL,
+    runs INTEGER NOT NULL DEFAULT 0,
+    next_run_at TIMESTAMPTZ NOT NULL,
+    last_transfer_id TEXT,
+    active BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS standing_orders_due_idx ON standing_orders (next_run_at) WHERE active;
+CREATE INDEX IF NOT EXISTS standing_orders_from_idx ON standing_orders (from_account);
@@ -0,0 +1,2 @@
+-- The transfer_jobs write-behind (job_status.py) upserts on transfer_id.
+CREATE UNIQUE INDEX IF NOT EXISTS transfer_jobs_transfer_id_key ON transfer_jobs (transfer_id);
@@ -0,0 +1,3 @@
+-- Statement export (statements.py) reads an account's transfer_jobs by time range.
+CREATE INDEX IF NOT EXISTS transfer_jobs_from_timestamp_idx ON transfer_jobs (from_account, timestamp);
+CREATE INDEX IF NOT EXISTS transfer_jobs_to_timestamp_idx ON transfer_jobs (to_account, timestamp);
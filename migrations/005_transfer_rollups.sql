@@ -0,0 +1,36 @@
+-- Incremental transfer rollups (rollups.py). Needs PostgreSQL 13+ for xid8.
+-- Writers of final transfer_jobs statuses stamp outcome_xid with their transaction id;
+-- each rollup run aggregates the rows whose outcome_xid lies between the previous
+-- watermark and the current snapshot xmin, below which every transaction has finished.
+
+ALTER TABLE transfer_jobs ADD COLUMN IF NOT EXISTS outcome_xid xid8;
+CREATE INDEX IF NOT EXISTS transfer_jobs_outcome_xid_idx ON transfer_jobs (outcome_xid) WHERE outcome_xid IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS transfer_rollup_hourly (
+    bucket TIMESTAMP NOT NULL,
+    status TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    transfers BIGINT NOT NULL,
+    volume DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (bucket, status, reason)
+);
+
+CREATE TABLE IF NOT EXISTS transfer_rollup_daily (
+    bucket DATE NOT NULL,
+    status TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    transfers BIGINT NOT NULL,
+    volume DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (bucket, status, reason)
+);
+
+-- Rows finished before this point carry no outcome_xid and are covered by
+-- `python rollups.py backfill`
+CREATE TABLE IF NOT EXISTS rollup_watermarks (
+    name TEXT PRIMARY KEY,
+    xmin xid8 NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+INSERT INTO rollup_watermarks (name, xmin)
+VALUES ('transfer_jobs', pg_snapshot_xmin(pg_current_snapshot()))
+ON CONFLICT (name) DO NOTHING;
@@ -0,0 +1,28 @@
+-- Account search (search.py). The expressions must match search.FIELDS exactly.
+-- Prefix search range-scans the btree indexes in byte order (COLLATE "C"), with
+-- account_number as the tie-breaker for keyset pagination; fuzzy search uses the
+-- trigram indexes.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS accounts_search_name_idx
+    ON accounts ((lower(coalesce(first_name, '') || ' ' || coalesce(last_name, '')) COLLATE "C"), account_number);
+CREATE INDEX IF NOT EXISTS accounts_search_last_name_idx
+    ON accounts ((lower(last_name) COLLATE "C"), account_number);
+CREATE INDEX IF NOT EXISTS accounts_search_post_code_idx
+    ON accounts ((upper(replace(post_code, ' ', '')) COLLATE "C"), account_number);
+CREATE INDEX IF NOT EXISTS accounts_search_town_idx
+    ON accounts ((lower(town) COLLATE "C"), account_number);
+CREATE INDEX IF NOT EXISTS accounts_search_city_idx
+    ON accounts ((lower(city) COLLATE "C"), account_number);
+
+CREATE INDEX IF NOT EXISTS accounts_search_name_trgm_idx
+    ON accounts USING gin ((lower(coalesce(first_name, '') || ' ' || coalesce(last_name, ''))) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS accounts_search_last_name_trgm_idx
+    ON accounts USING gin ((lower(last_name)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS accounts_search_post_code_trgm_idx
+    ON accounts USING gin ((upper(replace(post_code, ' ', ''))) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS accounts_search_town_trgm_idx
+    ON accounts USING gin ((lower(town)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS accounts_search_city_trgm_idx
+    ON accounts USING gin ((lower(city)) gin_trgm_ops);
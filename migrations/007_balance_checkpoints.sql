@@ -0,0 +1,31 @@
+-- Point-in-time balances (checkpoints.py). A checkpoint is an account's balance once every
+-- finished transfer_jobs row with timestamp <= taken_at is applied. Runs are contiguous,
+-- so between two runs an account's balance only moves by its transfer_jobs deltas.
+
+CREATE TABLE IF NOT EXISTS balance_checkpoints (
+    account_number TEXT NOT NULL,
+    taken_at TIMESTAMP NOT NULL,
+    balance DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (account_number, taken_at)
+);
+
+CREATE TABLE IF NOT EXISTS balance_checkpoint_runs (
+    taken_at TIMESTAMP PRIMARY KEY,
+    accounts INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS transfer_jobs_timestamp_idx ON transfer_jobs (timestamp);
+CREATE INDEX IF NOT EXISTS transfer_jobs_pending_idx ON transfer_jobs (timestamp) WHERE status = 'pending';
+
+-- Base checkpoint for existing accounts: today's balance with its whole history backed out
+INSERT INTO balance_checkpoints (account_number, taken_at, balance)
+SELECT a.account_number, '-infinity', a.balance - COALESCE(h.net, 0)
+FROM accounts a
+LEFT JOIN (
+    SELECT account_number, sum(delta) AS net FROM (
+        SELECT from_account AS account_number, -amount AS delta FROM transfer_jobs WHERE status = 'completed'
+        UNION ALL
+        SELECT to_account, amount FROM transfer_jobs WHERE status IN ('completed', 'deposit')
+    ) d GROUP BY account_number
+) h ON h.account_number = a.account_number
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,22 @@
+-- Account shards (shards.py). Apply to every database in SHARD_DATABASES, after creating
+-- the accounts table there from schema.sql. Not needed on an unsharded primary.
+
+-- Cross-shard transfers debited on this shard, until the payee's shard settles them
+CREATE TABLE IF NOT EXISTS shard_transfers (
+    transfer_id TEXT PRIMARY KEY,
+    from_account TEXT NOT NULL,
+    to_account TEXT NOT NULL,
+    amount DOUBLE PRECISION NOT NULL,
+    state TEXT NOT NULL DEFAULT 'debited',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    settled_at TIMESTAMPTZ
+);
+CREATE INDEX IF NOT EXISTS shard_transfers_debited_idx ON shard_transfers (created_at) WHERE state = 'debited';
+
+-- Cross-shard transfers decided on this (the payee's) shard: credited, or refused because
+-- the payee does not exist. One row per transfer makes the decision final.
+CREATE TABLE IF NOT EXISTS shard_credits (
+    transfer_id TEXT PRIMARY KEY,
+    credited BOOLEAN NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+import orjson
+from fast_json import dumps
+from metrics import PROFILE_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Two-tier cache for the rarely changing account profile fields (name, DOB, address)
+# shown by app.py's balance page; the balance itself is always read fresh.
+#
+#   L1 - per-process LRU with a short TTL
+#   L2 - Redis, shared by every uvicorn worker (profile:{account_number})
+#
+# invalidate() drops the L2 key and broadcasts on CHANNEL; follow() drops the L1 entry in
+# every process. A fill that raced an invalidation can leave a stale entry for at most
+# the TTL of its tier. When the subscription drops, L1 is cleared on resubscribe because
+# invalidations may have been missed.
+
+L1_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", "10000"))
+L1_TTL = float(os.environ.get("PROFILE_CACHE_TTL", "60"))
+L2_TTL = int(os.environ.get("PROFILE_CACHE_L2_TTL", "3600"))
+CHANNEL = "profiles:invalidate"
+RETRY_DELAY = 5
+
+def l2_key(account_number: str):
+    return f"profile:{account_number}"
+
+class ProfileCache:
+    def __init__(self, size: int = L1_SIZE, ttl: float = L1_TTL, l2_ttl: int = L2_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.l2_ttl = l2_ttl
+        self.entries = OrderedDict()
+
+    def _get_local(self, account_number: str):
+        entry = self.entries.get(account_number)
+        if entry is None:
+            return None
+        expires, profile = entry
+        if expires < time.monotonic():
+            del self.entries[account_number]
+            return None
+        self.entries.move_to_end(account_number)
+        return profile
+
+    def _put_local(self, account_number: str, profile: dict):
+        self.entries[account_number] = (time.monotonic() + self.ttl, profile)
+        self.entries.move_to_end(account_number)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    async def get(self, redis_client, account_number: str):
+        profile = self._get_local(account_number)
+        if profile is not None:
+            PROFILE_CACHE_LOOKUPS.labels("l1").inc()
+            return profile
+        try:
+            data = await redis_client.get(l2_key(account_number))
+        except Exception as e:
+            logger.warning("Profile cache L2 read failed for %s: %s", account_number, e)
+            data = None
+        if data is None:
+            PROFILE_CACHE_LOOKUPS.labels("miss").inc()
+            return None
+        PROFILE_CACHE_LOOKUPS.labels("l2").inc()
+        profile = orjson.loads(data)
+        self._put_local(account_number, profile)
+        return profile
+
+    async def put(self, redis_client, account_number: str, profile: dict):
+        self._put_local(account_number, profile)
+        try:
+            await redis_client.set(l2_key(account_number), dumps(profile), ex=self.l2_ttl)
+        except Exception as e:
+            logger.warning("Profile cache L2 write failed for %s: %s", account_number, e)
+
+    # Call after the transaction that changed the profiles has committed
+    async def invalidate(self, redis_client, account_numbers):
+        for account_number in account_numbers:
+            self.entries.pop(account_number, None)
+        try:
+            await redis_client.delete(*[l2_key(account_number) for account_number in account_numbers])
+            await redis_client.publish(CHANNEL, "\n".join(account_numbers))
+        except Exception as e:
+            logger.error("Failed to invalidate profiles %s: %s", account_numbers, e)
+
+    async def follow(self, redis_client):
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(CHANNEL)
+                self.entries.clear()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        for account_number in message["data"].decode().split("\n"):
+                            self.entries.pop(account_number, None)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Profile invalidation follower failed, resubscribing in %ss: %s", RETRY_DELAY, e)
+                await asyncio.sleep(RETRY_DELAY)
+            finally:
+                await pubsub.aclose()
@@ -0,0 +1,137 @@
+import asyncio
+import cProfile
+import collections
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# On-demand profiling for app.py requests and redis_worker.py jobs. While a window is
+# open, a sampled fraction of requests/jobs switch profiling on: cProfile (written as
+# .pstats) and a background thread sampling the event loop thread's stack (written as
+# .collapsed, ready for flamegraph.pl or speedscope).
+#
+# This is windowed profiling of the whole event loop thread, not of single requests:
+# cProfile sees every coroutine that runs on the thread while any sampled run is in
+# flight, sampled or not. The fraction sets how often profiling is switched on, so under
+# load with overlapping runs it stays on for most of the window, and the overhead is
+# bounded by the window length rather than by the fraction. When no window is open the
+# only cost on the hot path is reading Profiler.active.
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/opt/banking-app/profiles")
+PROFILE_SECONDS = float(os.environ.get("PROFILE_SECONDS", "30"))
+PROFILE_FRACTION = float(os.environ.get("PROFILE_FRACTION", "0.1"))
+STACK_SAMPLE_INTERVAL = 0.005
+
+class Profiler:
+    def __init__(self, name: str, output_dir: str = PROFILE_DIR):
+        self.name = name
+        self.output_dir = output_dir
+        self.active = False
+        self.fraction = 0.0
+        self.inflight = 0
+        self.stopping = False
+        self.profile_obj = None
+        self.stacks = None
+        self.sampler = None
+        self.thread_id = None
+        self.started_at = None
+        self.last_files = []
+
+    def start(self, seconds: float = PROFILE_SECONDS, fraction: float = PROFILE_FRACTION):
+        if self.active:
+            return False
+        self.profile_obj = cProfile.Profile()
+        self.stacks = collections.Counter()
+        self.fraction = fraction
+        self.inflight = 0
+        self.stopping = False
+        self.thread_id = threading.get_ident()
+        self.started_at = time.time()
+        self.active = True
+        self.sampler = threading.Thread(target=self._sample_stacks, args=(self.stacks,), name=f"{self.name}-stack-sampler", daemon=True)
+        self.sampler.start()
+        asyncio.get_running_loop().call_later(seconds, self.stop)
+        logger.warning("Profiling %s for %gs, switched on by %g%% of runs", self.name, seconds, fraction * 100)
+        return True
+
+    def should_sample(self):
+        return not self.stopping and random.random() < self.fraction
+
+    # Overlapping sampled runs share one cProfile session, enabled while any is in flight;
+    # it records everything else on the loop thread meanwhile too
+    @contextmanager
+    def profile(self):
+        if self.inflight == 0:
+            self.profile_obj.enable()
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            if self.inflight == 0:
+                self.profile_obj.disable()
+                if self.stopping:
+                    self._finish()
+
+    def stop(self):
+        if not self.active or self.stopping:
+            return
+        self.stopping = True
+        if self.inflight == 0:
+            self._finish()
+
+    # Runs until its own window is finished, even if the next one has already started
+    def _sample_stacks(self, stacks):
+        while self.active and self.stacks is stacks:
+            if self.inflight:
+                frame = sys._current_frames().get(self.thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    stacks[";".join(reversed(stack))] += 1
+            time.sleep(STACK_SAMPLE_INTERVAL)
+
+    # Joining the sampler and writing the files happen off the event loop
+    def _finish(self):
+        self.active = False
+        prefix = os.path.join(self.output_dir, f"{self.name}-{os.getpid()}-{int(self.started_at)}")
+        asyncio.get_running_loop().run_in_executor(None, self._write, self.sampler, self.profile_obj, self.stacks, prefix)
+        self.profile_obj = None
+        self.stacks = None
+
+    def _write(self, sampler, profile_obj, stacks, prefix: str):
+        try:
+            sampler.join()
+            os.makedirs(self.output_dir, exist_ok=True)
+            profile_obj.dump_stats(f"{prefix}.pstats")
+            with open(f"{prefix}.collapsed", "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        except Exception as e:
+            logger.error("Failed to write profile %s: %s", prefix, e)
+            return
+        self.last_files = [f"{prefix}.pstats", f"{prefix}.collapsed"]
+        logger.warning("Profile written to %s.{pstats,collapsed}", prefix)
+
+    def status(self):
+        return {
+            "active": self.active,
+            "fraction": self.fraction,
+            "scope": "event loop thread while a sampled run is in flight",
+            "started_at": self.started_at,
+            "last_files": self.last_files
+        }
+
+# kill -USR1 <pid> opens a window with the PROFILE_SECONDS/PROFILE_FRACTION defaults
+def install_signal_handler(profiler: Profiler, signum=signal.SIGUSR1):
+    asyncio.get_running_loop().add_signal_handler(signum, profiler.start)
@@ -0,0 +1,176 @@
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import re
+import time
+from metrics import TimedPool
+
+logger = logging.getLogger(__name__)
+
+# Slow-query log for asyncpg. InstrumentedPool hands out connections whose fetch/
+# fetchrow/fetchval/execute/executemany calls are timed and aggregated by normalised
+# query text. Statements slower than SLOW_QUERY_MS are sampled for an
+# EXPLAIN (ANALYZE, BUFFERS), run in the background on a separate connection inside a
+# transaction that is always rolled back, so writes are never applied twice.
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+EXPLAIN_SAMPLE_RATE = float(os.environ.get("SLOW_QUERY_EXPLAIN_RATE", "0.1"))
+EXPLAIN_COOLDOWN = 60
+EXPLAIN_TIMEOUT_MS = 5000
+RECENT_SLOW_LIMIT = 200
+STATS_KEY = "query_stats:{}"
+STATS_TTL = 60
+STATS_PUBLISH_INTERVAL = 10
+
+WHITESPACE = re.compile(r"\s+")
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![$\w])\d+(?:\.\d+)?")
+
+def normalize(query: str):
+    query = STRING_LITERAL.sub("?", query)
+    query = NUMBER_LITERAL.sub("?", query)
+    return WHITESPACE.sub(" ", query).strip()
+
+class QueryStats:
+    __slots__ = ("calls", "total", "max", "slow")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+
+class QueryLog:
+    def __init__(self, name: str, threshold_ms: float = SLOW_QUERY_MS, sample_rate: float = EXPLAIN_SAMPLE_RATE):
+        self.name = name
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.stats = collections.defaultdict(QueryStats)
+        self.recent_slow = collections.deque(maxlen=RECENT_SLOW_LIMIT)
+        self.last_explain = {}
+
+    # pool is the one the query ran on (shards share a log); EXPLAIN needs the same database
+    def record(self, query: str, args, elapsed: float, explainable: bool = True, pool=None):
+        key = normalize(query)
+        stats = self.stats[key]
+        stats.calls += 1
+        stats.total += elapsed
+        if elapsed > stats.max:
+            stats.max = elapsed
+        if elapsed < self.threshold:
+            return
+        stats.slow += 1
+        entry = {"query": key, "ms": round(elapsed * 1000, 3), "at": time.time(), "plan": None}
+        self.recent_slow.append(entry)
+        now = time.monotonic()
+        if (explainable and pool is not None and random.random() < self.sample_rate
+                and now - self.last_explain.get(key, 0) > EXPLAIN_COOLDOWN):
+            self.last_explain[key] = now
+            asyncio.get_running_loop().create_task(self.explain(entry, query, args, pool))
+
+    async def explain(self, entry: dict, query: str, args, pool):
+        try:
+            async with pool.acquire() as conn:
+                transaction = conn.transaction()
+                await transaction.start()
+                try:
+                    await conn.execute(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}")
+                    rows = await conn.raw.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}", *args)
+                finally:
+                    await transaction.rollback()
+            entry["plan"] = "\n".join(row[0] for row in rows)
+        except Exception as e:
+            entry["plan"] = f"EXPLAIN failed: {e}"
+            logger.warning("EXPLAIN capture failed for %s: %s", entry["query"], e)
+
+    def snapshot(self, limit: int = 50):
+        top = sorted(self.stats.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+        return {
+            "name": self.name,
+            "pid": os.getpid(),
+            "threshold_ms": self.threshold * 1000,
+            "queries": [
+                {
+                    "query": query,
+                    "calls": stats.calls,
+                    "total_ms": round(stats.total * 1000, 3),
+                    "mean_ms": round(stats.total * 1000 / stats.calls, 3),
+                    "max_ms": round(stats.max * 1000, 3),
+                    "slow": stats.slow
+                }
+                for query, stats in top
+            ],
+            "recent_slow": list(self.recent_slow)
+        }
+
+    # Every process publishes its snapshot so one admin endpoint can show app and workers
+    async def publish(self, redis_client, interval: float = STATS_PUBLISH_INTERVAL):
+        key = STATS_KEY.format(f"{self.name}:{os.getpid()}")
+        while True:
+            try:
+                await redis_client.set(key, json.dumps(self.snapshot()), ex=STATS_TTL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Failed to publish query stats: %s", e)
+            await asyncio.sleep(interval)
+
+async def collect_snapshots(redis_client):
+    snapshots = []
+    async for key in redis_client.scan_iter(match=STATS_KEY.format("*")):
+        value = await redis_client.get(key)
+        if value:
+            snapshots.append(json.loads(value))
+    return snapshots
+
+# Connection wrapper; anything not timed here (transaction, cursor, ...) goes to the raw connection
+class InstrumentedConnection:
+    __slots__ = ("raw", "query_log", "pool")
+
+    def __init__(self, raw, query_log: QueryLog, pool):
+        self.raw = raw
+        self.query_log = query_log
+        self.pool = pool
+
+    async def _timed(self, method, query, args, explainable=True, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await method(query, *args, **kwargs)
+        finally:
+            self.query_log.record(query, args, time.perf_counter() - start, explainable, self.pool)
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self._timed(self.raw.fetch, query, args, **kwargs)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self._timed(self.raw.fetchrow, query, args, **kwargs)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self._timed(self.raw.fetchval, query, args, **kwargs)
+
+    async def execute(self, query, *args, **kwargs):
+        return await self._timed(self.raw.execute, query, args, explainable=bool(args), **kwargs)
+
+    async def executemany(self, query, args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self.raw.executemany(query, args, **kwargs)
+        finally:
+            self.query_log.record(query, (), time.perf_counter() - start, explainable=False)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+class InstrumentedPool(TimedPool):
+    def __init__(self, pool, query_log: QueryLog, name: str = "test_bank"):
+        super().__init__(pool, name)
+        self.query_log = query_log
+
+    def wrap(self, conn):
+        return InstrumentedConnection(conn, self.query_log, self)
+
+    def unwrap(self, conn):
+        return conn.raw if isinstance(conn, InstrumentedConnection) else conn
@@ -2,10 +2,22 @@ print("Starting worker script...")
 import asyncio
 import redis.asyncio as redis
 import asyncpg
-import json
 import logging
 import logging.handlers
 import os
+from prometheus_client import start_http_server
+from metrics import sample_queue
+from query_log import InstrumentedPool, QueryLog
+from logging_setup import setup_logging
+from profiling import Profiler, install_signal_handler
+from transfer_queue import make_backend
+from storage import BACKEND as STORAGE_BACKEND, make_storage
+from transfer_engine import run_engine
+import ledger
+import job_status
+import rollups
+import checkpoints
+import shards
 
 print("Imports completed")
 pid = os.getpid()
@@ -13,12 +25,21 @@ log_file = f"/opt/banking-app/worker-{pid}.log"
 handler = logging.handlers.RotatingFileHandler(
     log_file, maxBytes=10*1024*1024, backupCount=5
 )
-handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logging.basicConfig(level=logging.INFO, handlers=[handler, logging.StreamHandler()])
+setup_logging(handler, sample_rates={"transfer_engine.jobs": 0.01})
 logger = logging.getLogger(__name__)
 logger.info("Logger initialized")
 print("Logging setup done")
 
+# Each worker process needs its own port when several run on one host
+METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "9100"))
+
+# Where jobs come from: "redis-list" (the 'transfers' list) or "rq" (legacy rq producers)
+QUEUE_BACKEND = os.environ.get("TRANSFER_QUEUE_BACKEND", "redis-list")
+
+# kill -USR1 <worker pid> profiles a sample of jobs for PROFILE_SECONDS
+profiler = Profiler("worker")
+query_log = QueryLog("worker")
+
 async def init_db_pool():
     print("Initializing DB pool...")
     try:
@@ -32,90 +53,47 @@ async def init_db_pool():
         )
         logger.info("Database pool initialized")
         print("DB pool initialized")
-        return pool
+        return InstrumentedPool(pool, query_log)
     except Exception as e:
-        logger.error(f"Failed to initialize DB pool: {e}")
+        logger.error("Failed to initialize DB pool: %s", e)
         print(f"DB pool failed: {e}")
         raise
 
-async def process_transfer(pool, redis_client, transfer_data):
-    transfer_id = transfer_data['transfer_id']
-    from_account = transfer_data['from_account']
-    to_account = transfer_data['to_account']
-    amount = transfer_data['amount']
-
-    try:
-        async with pool.acquire() as conn:
-            async with conn.transaction():
-                from_acc = await conn.fetchrow(
-                    "SELECT balance FROM accounts WHERE account_number = $1 FOR UPDATE",
-                    from_account
-                )
-                to_acc = await conn.fetchrow(
-                    "SELECT balance FROM accounts WHERE account_number = $1",
-                    to_account
-                )
-
-                if not from_acc or not to_acc:
-                    await conn.execute(
-                        "UPDATE transfer_jobs SET status = 'failed', result = $1 WHERE transfer_id = $2",
-                        json.dumps({"error": "Account not found"}), transfer_id
-                    )
-                    logger.warning(f"Transfer {transfer_id} failed: Account not found")
-                    return
-
-                if from_acc['balance'] < amount:
-                    await conn.execute(
-                        "UPDATE transfer_jobs SET status = 'failed', result = $1 WHERE transfer_id = $2",
-                        json.dumps({"error": "Insufficient funds"}), transfer_id
-                    )
-                    logger.warning(f"Transfer {transfer_id} failed: Insufficient funds")
-                    return
-
-                await conn.execute(
-                    "UPDATE accounts SET balance = balance - $1 WHERE account_number = $2",
-                    amount, from_account
-                )
-                await conn.execute(
-                    "UPDATE accounts SET balance = balance + $1 WHERE account_number = $2",
-                    amount, to_account
-                )
-                await conn.execute(
-                    "UPDATE transfer_jobs SET status = 'completed', result = $1 WHERE transfer_id = $2",
-                    json.dumps({"message": "Transfer successful"}), transfer_id
-                )
-                logger.info(f"Transfer {transfer_id} completed")
-    except Exception as e:
-        logger.error(f"Error processing transfer {transfer_id}: {e}")
-        async with pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE transfer_jobs SET status = 'failed', result = $1 WHERE transfer_id = $2",
-                json.dumps({"error": str(e)}), transfer_id
-            )
-
 async def main():
+    if STORAGE_BACKEND != "postgres":
+        # Memory storage lives in one process; app.py runs the engine itself in that mode
+        logger.error("redis_worker needs STORAGE_BACKEND=postgres, got %s", STORAGE_BACKEND)
+        print(f"Unsupported storage backend for a standalone worker: {STORAGE_BACKEND}")
+        return
     print("Connecting to Redis...")
     redis_client = redis.Redis(host='localhost', port=6379, db=0)
     pool = await init_db_pool()
+    router = await shards.create_router(pool, max_size=24, wrap=lambda shard_pool, database: InstrumentedPool(shard_pool, query_log, database))
+    storage = make_storage(STORAGE_BACKEND, pool, router)
     try:
         await redis_client.ping()
         logger.info("Connected to Redis")
         print("Redis ping successful")
     except Exception as e:
-        logger.error(f"Redis connection failed: {e}")
+        logger.error("Redis connection failed: %s", e)
         print(f"Redis failed: {e}")
         return
 
+    start_http_server(METRICS_PORT)
+    logger.info("Metrics served on port %s", METRICS_PORT)
+    asyncio.create_task(sample_queue(redis_client))
+    install_signal_handler(profiler)
+    asyncio.create_task(query_log.publish(redis_client))
+    asyncio.create_task(job_status.run_writer(storage, redis_client))
+    asyncio.create_task(rollups.run_rollups(pool))
+    asyncio.create_task(checkpoints.run_checkpoints(pool))
+    asyncio.create_task(shards.run_recovery(router, redis_client))
+    if ledger.ENABLED:
+        asyncio.create_task(ledger.run_compactor(pool))
+    backend = make_backend(QUEUE_BACKEND, redis_client)
+
     print("Entering worker loop...")
-    while True:
-        try:
-            _, data = await redis_client.blpop('transfers')
-            transfer = json.loads(data)
-            await process_transfer(pool, redis_client, transfer)
-        except Exception as e:
-            logger.error(f"Error in worker loop: {e}")
-            print(f"Worker loop error: {e}")
-            await asyncio.sleep(1)
+    await run_engine(storage, redis_client, backend, profiler)
 
 if __name__ == "__main__":
     print("Running asyncio...")
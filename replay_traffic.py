@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import glob
+import json
+import aiohttp
+import orjson
+from loadgen import new_histogram, record, summarize_histogram
+
+# Replays traffic captured by app.py (see traffic_capture.py) against a local instance.
+# Requests keep their captured relative timing, compressed by --speed, and are sent
+# open-loop so the captured concurrency is reproduced:
+#
+#   ./replay_traffic.py /opt/banking-app/traffic/capture-*.jsonl --speed 4
+#
+# Captures from several app processes are ordered by request start time. Transfer ids in captured
+# /transfer_status polls refer to the original run, so those mostly come back 404; the
+# status-match report separates them out.
+
+BASE_URL = "http://localhost:5000"
+MAX_INFLIGHT = 20000
+
+def read_captures(patterns):
+    files = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    if not files:
+        raise SystemExit(f"No capture files match {patterns}")
+
+    def entries(path):
+        with open(path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    yield orjson.loads(line)
+    # Entries are written when responses finish but stamped with the request's start, so
+    # a file is not in start order; sort everything rather than merge
+    captured = sorted((entry for path in files for entry in entries(path)), key=lambda entry: entry["t"])
+    if not captured:
+        raise SystemExit(f"Nothing to replay: {len(files)} capture file(s) matching {patterns} hold no requests")
+    return captured
+
+class RouteStats:
+    def __init__(self):
+        self.sent = 0
+        self.status_match = 0
+        self.errors = 0
+        self.latency = new_histogram()
+        self.captured = new_histogram()
+
+async def replay(entries, base_url: str, speed: float, connections: int):
+    if not entries:
+        raise ValueError("No captured requests to replay")
+    loop = asyncio.get_running_loop()
+    stats = {}
+    tasks = set()
+    dropped = 0
+
+    async def send(session, entry, intended):
+        route = stats.setdefault(f"{entry['m']} {entry.get('r') or entry['p']}", RouteStats())
+        route.sent += 1
+        record(route.captured, entry["d"] / 1000)
+        url = f"{base_url}{entry['p']}" + (f"?{entry['q']}" if entry["q"] else "")
+        headers = {"Content-Type": entry["ct"]} if entry["ct"] else {}
+        try:
+            async with session.request(entry["m"], url, data=entry["b"].encode() or None, headers=headers, allow_redirects=False) as response:
+                await response.read()
+                status = response.status
+        except aiohttp.ClientError:
+            route.errors += 1
+            return
+        # Latency from the scheduled send time, so replay-side queueing is not hidden
+        record(route.latency, loop.time() - intended)
+        if status == entry["s"]:
+            route.status_match += 1
+
+    connector = aiohttp.TCPConnector(limit=connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        origin = entries[0]["t"]
+        start = loop.time()
+        for entry in entries:
+            intended = start + (entry["t"] - origin) / speed
+            delay = intended - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(tasks) >= MAX_INFLIGHT:
+                dropped += 1
+                continue
+            task = asyncio.create_task(send(session, entry, intended))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        elapsed = loop.time() - start
+    return stats, elapsed, dropped
+
+def main(args):
+    entries = read_captures(args.captures)
+    span = entries[-1]["t"] - entries[0]["t"]
+    print(f"Replaying {len(entries)} requests spanning {span:.1f}s at {args.speed:g}x (~{span / args.speed:.1f}s)")
+    stats, elapsed, dropped = asyncio.run(replay(entries, args.base_url, args.speed, args.connections))
+
+    print(f"\n--- Replay Results ({elapsed:.1f}s, {len(entries) / elapsed:.1f} req/s, dropped {dropped}) ---")
+    report = {}
+    for name, route in sorted(stats.items(), key=lambda item: -item[1].sent):
+        latency = summarize_histogram(route.latency)
+        captured = summarize_histogram(route.captured)
+        print(
+            f"{name:45s} sent {route.sent:7d}  status match {route.status_match / route.sent:6.1%}  errors {route.errors:5d}  "
+            f"p50 {latency.get('p50_ms', 0):8.2f}ms (was {captured.get('p50_ms', 0):8.2f})  "
+            f"p99 {latency.get('p99_ms', 0):8.2f}ms (was {captured.get('p99_ms', 0):8.2f})"
+        )
+        report[name] = {"sent": route.sent, "status_match": route.status_match, "errors": route.errors,
+                        "latency": latency, "captured_latency": captured}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"speed": args.speed, "elapsed": elapsed, "dropped": dropped, "routes": report}, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured app traffic at 1x or Nx speed")
+    parser.add_argument("captures", nargs="+", help="capture files or glob patterns")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression factor (4 = four times faster)")
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--json", help="write per-route results to this file")
+    main(parser.parse_args())
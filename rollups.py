@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import logging
+import os
+from datetime import date, timedelta
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Bank-wide hourly and daily transfer rollups (tables in migrations/005_transfer_rollups.sql)
+# that app.py's /reports endpoints read instead of scanning transfer_jobs.
+#
+# run_rollups() (started by redis_worker) folds newly finished transfer_jobs rows into
+# both tables every ROLLUP_INTERVAL seconds. The rows are found through the
+# outcome_xid index between the stored watermark and the current snapshot xmin, so
+# each row is counted exactly once however its transaction interleaved with others.
+# Concurrent workers skip the run if another holds the watermark.
+#
+# Rows finished before the migration (no outcome_xid) are counted by the backfill:
+#
+#   python rollups.py backfill --start 2025-01-01
+#
+# which recomputes whole days under the watermark lock.
+
+ROLLUP_INTERVAL = float(os.environ.get("ROLLUP_INTERVAL", "10"))
+WATERMARK = "transfer_jobs"
+FINAL_STATUSES = ["completed", "failed", "deposit"]
+
+# Failure reasons with the variable parts (amounts, accounts) stripped
+REASON_SQL = """
+    CASE
+        WHEN j.status <> 'failed' THEN ''
+        WHEN j.result::jsonb ->> 'error' IN ('Account not found', 'Insufficient funds') THEN j.result::jsonb ->> 'error'
+        WHEN j.result::jsonb ->> 'error' LIKE '%fraud check' THEN 'Rejected by fraud check'
+        ELSE 'Error'
+    END
+"""
+
+MERGE_HOURLY = """
+    INSERT INTO transfer_rollup_hourly AS r (bucket, status, reason, transfers, volume)
+    SELECT hour, status, reason, transfers, volume FROM delta
+    ON CONFLICT (bucket, status, reason)
+    DO UPDATE SET transfers = r.transfers + EXCLUDED.transfers, volume = r.volume + EXCLUDED.volume
+"""
+
+MERGE_DAILY = """
+    INSERT INTO transfer_rollup_daily AS r (bucket, status, reason, transfers, volume)
+    SELECT hour::date, status, reason, sum(transfers), sum(volume) FROM delta GROUP BY 1, 2, 3
+    ON CONFLICT (bucket, status, reason)
+    DO UPDATE SET transfers = r.transfers + EXCLUDED.transfers, volume = r.volume + EXCLUDED.volume
+"""
+
+INCREMENTAL_QUERY = f"""
+    WITH mark AS (
+        SELECT xmin AS low, pg_snapshot_xmin(pg_current_snapshot()) AS high
+        FROM rollup_watermarks WHERE name = $1
+        FOR UPDATE SKIP LOCKED
+    ), delta AS (
+        SELECT date_trunc('hour', j.timestamp) AS hour, j.status, {REASON_SQL} AS reason,
+               count(*) AS transfers, sum(j.amount) AS volume
+        FROM transfer_jobs j, mark
+        WHERE j.outcome_xid >= mark.low AND j.outcome_xid < mark.high
+        GROUP BY 1, 2, 3
+    ), hourly AS ({MERGE_HOURLY}
+    ), daily AS ({MERGE_DAILY}
+    ), advanced AS (
+        UPDATE rollup_watermarks w SET xmin = mark.high, updated_at = now()
+        FROM mark WHERE w.name = $1
+    )
+    SELECT (SELECT count(*) FROM mark) AS ran, COALESCE((SELECT sum(transfers) FROM delta), 0) AS rows
+"""
+
+BACKFILL_QUERY = f"""
+    WITH delta AS (
+        SELECT date_trunc('hour', j.timestamp) AS hour, j.status, {REASON_SQL} AS reason,
+               count(*) AS transfers, sum(j.amount) AS volume
+        FROM transfer_jobs j
+        WHERE j.timestamp >= $1::date AND j.timestamp < $1::date + 1 AND j.status = ANY($2)
+          AND (j.outcome_xid IS NULL OR j.outcome_xid < (SELECT xmin FROM rollup_watermarks WHERE name = $3))
+        GROUP BY 1, 2, 3
+    ), hourly AS ({MERGE_HOURLY}
+    ), daily AS ({MERGE_DAILY}
+    )
+    SELECT COALESCE(sum(transfers), 0) AS rows FROM delta
+"""
+
+async def roll_up(pool):
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(INCREMENTAL_QUERY, WATERMARK)
+    return row['rows'] if row['ran'] else None
+
+async def run_rollups(pool, interval: float = ROLLUP_INTERVAL):
+    while True:
+        try:
+            rows = await roll_up(pool)
+            if rows:
+                logger.info("Rolled up %s transfer_jobs rows", rows)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Transfer rollup failed: %s", e)
+        await asyncio.sleep(interval)
+
+# Recompute whole days: rows above the watermark belong to the incremental runs, and
+# holding the watermark lock keeps them from running while a day is rebuilt
+async def backfill(pool, start: date, end: date):
+    total = 0
+    day = start
+    while day <= end:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT 1 FROM rollup_watermarks WHERE name = $1 FOR UPDATE", WATERMARK)
+                await conn.execute("DELETE FROM transfer_rollup_hourly WHERE bucket >= $1::date AND bucket < $1::date + 1", day)
+                await conn.execute("DELETE FROM transfer_rollup_daily WHERE bucket = $1", day)
+                rows = await conn.fetchval(BACKFILL_QUERY, day, FINAL_STATUSES, WATERMARK)
+        total += rows
+        logger.info("Backfilled %s: %s rows", day, rows)
+        day += timedelta(days=1)
+    return total
+
+async def main(args):
+    pool = await asyncpg.create_pool(
+        database="test_bank",
+        user="test_user",
+        password="TestBank2025",
+        host="localhost",
+        min_size=1,
+        max_size=2
+    )
+    try:
+        if args.command == "backfill":
+            async with pool.acquire() as conn:
+                first = await conn.fetchval("SELECT min(timestamp)::date FROM transfer_jobs")
+            start = args.start or first or date.today()
+            total = await backfill(pool, start, args.end)
+            print(f"Backfilled {total} rows from {start} to {args.end}")
+        else:
+            print(f"Rolled up {await roll_up(pool)} rows")
+    finally:
+        await pool.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Maintain the transfer rollup tables")
+    parser.add_argument("command", choices=["run", "backfill"], help="run one incremental pass, or backfill whole days")
+    parser.add_argument("--start", type=date.fromisoformat, help="first day to backfill (default: oldest transfer)")
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today(), help="last day to backfill (default: today)")
+    asyncio.run(main(parser.parse_args()))
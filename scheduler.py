@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+import asyncpg
+import redis.asyncio as redis
+from prometheus_client import start_http_server
+from fast_json import dumps
+from metrics import STANDING_ORDERS_DUE, STANDING_ORDERS_FIRED
+from transfer_queue import SCHEDULED_QUEUE
+
+logger = logging.getLogger(__name__)
+
+# Standing-order scheduler (tables in migrations/002_standing_orders.sql), run as
+# `python scheduler.py`; any number of instances can run side by side.
+#
+# Postgres is the source of truth. Orders due within LOAD_HORIZON are indexed in the
+# Redis sorted set DUE_KEY (member order_id, score due epoch), refreshed every
+# LOAD_INTERVAL. Each tick pops up to BATCH due members atomically, then claims them in
+# Postgres with one conditional UPDATE that advances next_run_at and inserts their
+# pending transfer_jobs rows. The UPDATE only matches orders that are still due, so an
+# occurrence fires once even if a reload re-indexed it while another instance was
+# claiming it. Claimed transfers are pushed to the 'transfers:scheduled' list, which
+# redis_worker only takes from while the interactive 'transfers' list is empty.
+#
+# A full batch is followed by the next one immediately, so a 1st-of-the-month spike
+# drains as fast as the workers consume, bounded by MAX_BACKLOG queued scheduled
+# transfers so the claimed-but-unsent backlog stays small.
+#
+# Claims commit before the push, so a crash in between leaves pending transfer_jobs rows
+# that no worker will ever see. Every SWEEP_INTERVAL, pending rows older than
+# PENDING_TIMEOUT (scheduled or from app.py /transfer, which has the same gap) are marked
+# failed. A transfer that was only stuck in a long queue is still processed when it is
+# reached, and its outcome then replaces the failure.
+
+DUE_KEY = "standing_orders:due"
+BATCH = int(os.environ.get("SCHEDULER_BATCH", "1000"))
+TICK = float(os.environ.get("SCHEDULER_TICK", "1"))
+LOAD_INTERVAL = float(os.environ.get("SCHEDULER_LOAD_INTERVAL", "30"))
+LOAD_HORIZON = float(os.environ.get("SCHEDULER_LOAD_HORIZON", "300"))
+LOAD_CHUNK = 10000
+MAX_BACKLOG = int(os.environ.get("SCHEDULER_MAX_BACKLOG", "50000"))
+PENDING_TIMEOUT = float(os.environ.get("SCHEDULER_PENDING_TIMEOUT", "3600"))
+SWEEP_INTERVAL = float(os.environ.get("SCHEDULER_SWEEP_INTERVAL", "60"))
+SWEEP_BATCH = 1000
+METRICS_PORT = int(os.environ.get("SCHEDULER_METRICS_PORT", "9200"))
+
+EVERY = {"daily": "1 day", "weekly": "7 days", "monthly": "1 month"}
+
+# Pop up to ARGV[2] members due by ARGV[1]; atomic, so two instances never pop the same one
+CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due > 0 then
+    redis.call('ZREM', KEYS[1], unpack(due))
+end
+return due
+"""
+
+LOAD_QUERY = """
+    SELECT order_id, extract(epoch FROM next_run_at)::float8 AS due
+    FROM standing_orders
+    WHERE active AND next_run_at <= now() + make_interval(secs => $1)
+"""
+
+CLAIM_QUERY = """
+    WITH claimed AS (
+        UPDATE standing_orders s
+        SET runs = s.runs + 1,
+            next_run_at = CASE WHEN s.every IS NULL THEN s.next_run_at ELSE s.start_at + s.every * (s.runs + 1) END,
+            active = s.every IS NOT NULL,
+            last_transfer_id = c.transfer_id
+        FROM unnest($1::text[], $2::text[]) AS c(order_id, transfer_id)
+        WHERE s.order_id = c.order_id AND s.active AND s.next_run_at <= now()
+        RETURNING s.order_id, c.transfer_id, s.from_account, s.to_account, s.amount,
+                  s.active, extract(epoch FROM s.next_run_at)::float8 AS next_due
+    ), jobs AS (
+        INSERT INTO transfer_jobs (transfer_id, from_account, to_account, amount, status, timestamp)
+        SELECT transfer_id, from_account, to_account, amount, 'pending', CURRENT_TIMESTAMP FROM claimed
+    )
+    SELECT * FROM claimed
+"""
+
+SWEEP_QUERY = """
+    UPDATE transfer_jobs SET status = 'failed', result = '{"error": "Transfer was never processed"}'::jsonb,
+                             outcome_xid = pg_current_xact_id()
+    WHERE transfer_id IN (
+        SELECT transfer_id FROM transfer_jobs
+        WHERE status = 'pending' AND timestamp < localtimestamp - $1 * interval '1 second'
+        LIMIT $2
+    ) AND status = 'pending'
+"""
+
+# Index an order in the due set if it falls within the load horizon (app.py calls this on create)
+async def schedule(redis_client, order_id: str, due: float):
+    if due <= time.time() + LOAD_HORIZON:
+        await redis_client.zadd(DUE_KEY, {order_id: due})
+
+async def unschedule(redis_client, order_id: str):
+    await redis_client.zrem(DUE_KEY, order_id)
+
+async def load_due(pool, redis_client, horizon: float = LOAD_HORIZON):
+    loaded = 0
+    async with pool.acquire() as conn:
+        async with conn.transaction(readonly=True):
+            cursor = await conn.cursor(LOAD_QUERY, horizon)
+            while True:
+                rows = await cursor.fetch(LOAD_CHUNK)
+                if not rows:
+                    break
+                await redis_client.zadd(DUE_KEY, {row['order_id']: row['due'] for row in rows})
+                loaded += len(rows)
+    STANDING_ORDERS_DUE.set(await redis_client.zcard(DUE_KEY))
+    return loaded
+
+async def fire_due(pool, redis_client, claim, batch: int = BATCH):
+    order_ids = [order_id.decode() for order_id in await claim(keys=[DUE_KEY], args=[time.time(), batch])]
+    if not order_ids:
+        return 0
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(CLAIM_QUERY, order_ids, [str(uuid.uuid4()) for _ in order_ids])
+
+    if rows:
+        # Committed before the push: a crash in between leaves these occurrences to
+        # sweep_stale() rather than risking a double transfer
+        enqueued_at = time.time()
+        await redis_client.rpush(SCHEDULED_QUEUE, *[
+            dumps({
+                "transfer_id": row['transfer_id'],
+                "from_account": row['from_account'],
+                "to_account": row['to_account'],
+                "amount": row['amount'],
+                "enqueued_at": enqueued_at
+            })
+            for row in rows
+        ])
+        upcoming = {row['order_id']: row['next_due'] for row in rows if row['active'] and row['next_due'] <= enqueued_at + LOAD_HORIZON}
+        if upcoming:
+            await redis_client.zadd(DUE_KEY, upcoming)
+        STANDING_ORDERS_FIRED.inc(len(rows))
+    if len(rows) < len(order_ids):
+        logger.info("Skipped %s standing orders already claimed or cancelled", len(order_ids) - len(rows))
+    return len(order_ids)
+
+async def sweep_stale(pool, timeout: float = PENDING_TIMEOUT, batch: int = SWEEP_BATCH):
+    swept = 0
+    async with pool.acquire() as conn:
+        while True:
+            status = await conn.execute(SWEEP_QUERY, timeout, batch)
+            count = int(status.split()[-1])
+            swept += count
+            if count < batch:
+                return swept
+
+async def run_scheduler(pool, redis_client):
+    claim = redis_client.register_script(CLAIM_SCRIPT)
+    last_load = 0.0
+    last_sweep = 0.0
+    while True:
+        try:
+            if time.monotonic() - last_load >= LOAD_INTERVAL:
+                loaded = await load_due(pool, redis_client)
+                last_load = time.monotonic()
+                logger.info("Indexed %s standing orders due within %gs", loaded, LOAD_HORIZON)
+            if time.monotonic() - last_sweep >= SWEEP_INTERVAL:
+                last_sweep = time.monotonic()
+                swept = await sweep_stale(pool)
+                if swept:
+                    logger.warning("Failed %s transfers left pending for over %gs", swept, PENDING_TIMEOUT)
+            if await redis_client.llen(SCHEDULED_QUEUE) >= MAX_BACKLOG:
+                await asyncio.sleep(TICK)
+                continue
+            if await fire_due(pool, redis_client, claim) < BATCH:
+                await asyncio.sleep(TICK)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Popped orders that failed to claim are still due in Postgres; the next load re-indexes them
+            logger.error("Scheduler tick failed: %s", e)
+            await asyncio.sleep(TICK)
+
+async def main():
+    redis_client = redis.Redis(host='localhost', port=6379, db=0)
+    pool = await asyncpg.create_pool(
+        database="test_bank",
+        user="test_user",
+        password="TestBank2025",
+        host="localhost",
+        min_size=1,
+        max_size=4
+    )
+    start_http_server(METRICS_PORT)
+    logger.info("Scheduler started, metrics on port %s", METRICS_PORT)
+    await run_scheduler(pool, redis_client)
+
+if __name__ == "__main__":
+    from logging_setup import setup_logging
+    setup_logging(logging.FileHandler(f"/opt/banking-app/scheduler-{os.getpid()}.log"))
+    asyncio.run(main())
@@ -0,0 +1,205 @@
+import asyncio
+import base64
+import bisect
+import logging
+import os
+import orjson
+import shards
+from account_index import CHANNEL as ACCOUNTS_CREATED
+
+logger = logging.getLogger(__name__)
+
+# Account search for app.py's /accounts/search, on one field at a time:
+#
+#   prefix - range scan of the (key COLLATE "C", account_number) index; results come in
+#            key order and pages continue from the last (key, account_number) seen
+#   fuzzy  - trigram similarity (pg_trgm "%" operator) on the GIN index, best match first,
+#            paged by offset
+#
+# Keys are normalised the same way in SQL (FIELDS, matching migrations/006) and Python
+# (normalize), so the in-memory PrefixIndex returns the same order as the database.
+# With sharded accounts (shards.py) each query runs on every shard and the pages are
+# merged in the same order.
+# The range bounds are computed here rather than with LIKE, because LIKE on a
+# parameter cannot use the index in a prepared statement's generic plan.
+
+FIELDS = {
+    "name": "lower(coalesce(first_name, '') || ' ' || coalesce(last_name, ''))",
+    "last_name": "lower(last_name)",
+    "post_code": "upper(replace(post_code, ' ', ''))",
+    "town": "lower(town)",
+    "city": "lower(city)"
+}
+RESULT_COLUMNS = "account_number, first_name, last_name, town, city, post_code"
+MAX_LIMIT = 100
+# Fields kept in memory by PrefixIndex (comma-separated), e.g. "post_code,last_name"
+MEMORY_FIELDS = [field for field in os.environ.get("SEARCH_MEMORY_FIELDS", "").split(",") if field]
+SCAN_CHUNK = 10000
+RETRY_DELAY = 5
+
+def normalize(field: str, value):
+    if value is None:
+        return None
+    if field == "post_code":
+        return value.replace(" ", "").upper()
+    return " ".join(value.split()).lower()
+
+def row_key(field: str, row):
+    if field == "name":
+        return f"{row['first_name'] or ''} {row['last_name'] or ''}".lower()
+    return normalize(field, row[field])
+
+def upper_bound(prefix: str):
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(orjson.dumps(value)).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        return orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, orjson.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+
+# A fuzzy cursor is [offset]; a prefix cursor is [key, account_number] of the last result
+def valid_position(position, fuzzy: bool):
+    if not isinstance(position, list):
+        return False
+    if fuzzy:
+        return len(position) == 1 and type(position[0]) is int and position[0] >= 0
+    return len(position) == 2 and all(isinstance(part, str) for part in position)
+
+def prefix_query(field: str):
+    key = f'{FIELDS[field]} COLLATE "C"'
+    return f"""
+        SELECT {RESULT_COLUMNS}, {FIELDS[field]} AS key FROM accounts
+        WHERE {key} >= $1 AND {key} < $2 AND ({key}, account_number) > ($3, $4)
+        ORDER BY {key}, account_number
+        LIMIT $5
+    """
+
+def fuzzy_query(field: str):
+    return f"""
+        SELECT {RESULT_COLUMNS}, similarity({FIELDS[field]}, $1) AS score FROM accounts
+        WHERE {FIELDS[field]} % $1
+        ORDER BY score DESC, account_number
+        LIMIT $2 OFFSET $3
+    """
+
+async def fetch_shards(pools, query, *args):
+    return [dict(row) for row in await shards.fetch_all(pools, query, *args)]
+
+async def search_prefix(pools, field: str, prefix: str, limit: int, after):
+    after_key, after_number = after or ("", "")
+    rows = await fetch_shards(pools, prefix_query(field), prefix, upper_bound(prefix), after_key, after_number, limit)
+    # Byte order, as COLLATE "C" sorts on each shard
+    results = sorted(rows, key=lambda row: (row['key'].encode(), row['account_number'].encode()))[:limit]
+    next_cursor = encode_cursor([results[-1].pop("key"), results[-1]["account_number"]]) if len(results) == limit else None
+    for result in results:
+        result.pop("key", None)
+    return results, next_cursor
+
+# Every shard returns its first offset + limit matches, so the merged page is exact
+async def search_fuzzy(pools, field: str, text: str, limit: int, offset: int):
+    if len(pools) == 1:
+        results = await fetch_shards(pools, fuzzy_query(field), text, limit, offset)
+    else:
+        rows = await fetch_shards(pools, fuzzy_query(field), text, offset + limit, 0)
+        results = sorted(rows, key=lambda row: (-row['score'], row['account_number']))[offset:offset + limit]
+    return results, encode_cursor([offset + limit]) if len(results) == limit else None
+
+# Sorted "key\0account_number" strings per field, so a prefix page is a bisect plus a
+# slice. Kept current like AccountIndex: rebuilt on (re)subscribe to the
+# accounts:created channel, then extended with the rows of each announced account.
+class PrefixIndex:
+    def __init__(self, fields=MEMORY_FIELDS):
+        self.fields = [field for field in fields if field in FIELDS]
+        self.entries = None
+
+    def covers(self, field: str):
+        return self.entries is not None and field in self.entries
+
+    def lookup(self, field: str, prefix: str, limit: int, after):
+        entries = self.entries[field]
+        start = bisect.bisect_right(entries, "\0".join(after)) if after else bisect.bisect_left(entries, prefix)
+        page = []
+        for entry in entries[start:start + limit]:
+            if not entry.startswith(prefix):
+                break
+            page.append(entry.split("\0", 1))
+        return page
+
+    def _add(self, entries, rows):
+        for field in self.fields:
+            new = sorted(f"{key}\0{row['account_number']}" for row in rows if (key := row_key(field, row)) is not None)
+            if len(new) < 100:
+                for entry in new:
+                    bisect.insort(entries[field], entry)
+            else:
+                entries[field].extend(new)
+                entries[field].sort()
+
+    async def rebuild(self, pools):
+        entries = {field: [] for field in self.fields}
+        for pool in pools:
+            async with pool.acquire() as conn:
+                async with conn.transaction(readonly=True):
+                    cursor = await conn.cursor(f"SELECT {RESULT_COLUMNS} FROM accounts")
+                    while True:
+                        rows = await cursor.fetch(SCAN_CHUNK)
+                        if not rows:
+                            break
+                        for field in self.fields:
+                            entries[field].extend(f"{key}\0{row['account_number']}" for row in rows if (key := row_key(field, row)) is not None)
+        for field in self.fields:
+            entries[field].sort()
+        self.entries = entries
+        logger.info("Search prefix index rebuilt for %s: %s entries", ", ".join(self.fields), sum(map(len, entries.values())))
+
+    async def follow(self, pools, redis_client):
+        if not self.fields or not pools:
+            return
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(ACCOUNTS_CREATED)
+                await self.rebuild(pools)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        rows = await fetch_shards(
+                            pools,
+                            f"SELECT {RESULT_COLUMNS} FROM accounts WHERE account_number = ANY($1)",
+                            message["data"].decode().split("\n")
+                        )
+                        self._add(self.entries, rows)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.entries = None
+                logger.error("Search prefix index follower failed, rebuilding in %ss: %s", RETRY_DELAY, e)
+                await asyncio.sleep(RETRY_DELAY)
+            finally:
+                await pubsub.aclose()
+
+async def search(pools, prefix_index: PrefixIndex, field: str, query: str, fuzzy: bool, limit: int, cursor):
+    if field not in FIELDS:
+        raise ValueError(f"field must be one of {', '.join(FIELDS)}")
+    text = normalize(field, query)
+    if not text:
+        raise ValueError("q must not be empty")
+    limit = max(1, min(limit, MAX_LIMIT))
+    position = decode_cursor(cursor) if cursor else None
+    if position is not None and not valid_position(position, fuzzy):
+        raise ValueError("Invalid cursor")
+
+    if fuzzy:
+        return await search_fuzzy(pools, field, text, limit, position[0] if position else 0)
+
+    if prefix_index.covers(field):
+        page = prefix_index.lookup(field, text, limit, position)
+        rows = await fetch_shards(pools, f"SELECT {RESULT_COLUMNS} FROM accounts WHERE account_number = ANY($1)", [number for _, number in page])
+        by_number = {row['account_number']: row for row in rows}
+        results = [by_number[number] for _, number in page if number in by_number]
+        return results, encode_cursor(page[-1]) if len(page) == limit else None
+
+    return await search_prefix(pools, field, text, limit, position)
@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+import zlib
+import asyncpg
+import job_status
+import ledger
+import versions
+
+logger = logging.getLogger(__name__)
+
+# Account sharding. Accounts and their balances are spread over the databases named in
+# SHARD_DATABASES by a hash of the account number. Everything else stays on the primary
+# test_bank database: users, transfer_jobs, standing orders, rollups and checkpoints.
+# With SHARD_DATABASES unset the router has one shard, the primary pool, and the callers
+# behave exactly as before. Each shard needs schema.sql's accounts table and
+# migrations/008_shards.sql.
+#
+# A transfer between two accounts on the same shard is a local transaction there. A
+# transfer between shards is a saga:
+#
+#   debit  - on the payer's shard: lock and debit the payer, and record the transfer in
+#            shard_transfers as 'debited', in one transaction
+#   credit - on the payee's shard: decide the transfer once in shard_credits, crediting
+#            the payee if it exists; repeating the step returns the same decision
+#   settle - on the payer's shard: mark the transfer 'credited', or refund the payer and
+#            mark it 'compensated' if the payee's shard refused it
+#
+# run_recovery() (started by redis_worker) re-drives sagas still 'debited' SAGA_TIMEOUT
+# seconds after they started, e.g. after a worker crash, and records their outcome.
+#
+# Accounts are placed by crc32(account_number) modulo the number of shards, so changing
+# SHARD_DATABASES moves accounts. Existing rows must be copied to their new shard while
+# transfers are stopped.
+
+# Comma-separated database names on the primary's server, e.g. "bank_shard_0,bank_shard_1"
+SHARD_DATABASES = [name for name in os.environ.get("SHARD_DATABASES", "").split(",") if name]
+SAGA_TIMEOUT = float(os.environ.get("SAGA_TIMEOUT", "30"))
+RECOVERY_INTERVAL = float(os.environ.get("SAGA_RECOVERY_INTERVAL", "10"))
+RECOVERY_BATCH = 500
+
+def shard_of(account_number: str, count: int):
+    return zlib.crc32(account_number.encode()) % count
+
+# The rows of one query run on every pool concurrently, shard by shard
+async def fetch_all(pools, query, *args):
+    async def fetch(pool):
+        async with pool.acquire() as conn:
+            return await conn.fetch(query, *args)
+    results = await asyncio.gather(*(fetch(pool) for pool in pools))
+    return [row for rows in results for row in rows]
+
+class ShardRouter:
+    def __init__(self, pools):
+        self.pools = pools
+        self.sharded = len(pools) > 1
+
+    def shard_of(self, account_number: str):
+        return shard_of(account_number, len(self.pools)) if self.sharded else 0
+
+    def pool_for(self, account_number: str):
+        return self.pools[self.shard_of(account_number)]
+
+    # [(pool, items)] for the shards the items' accounts live on, in shard order
+    def group(self, items, key=lambda item: item):
+        groups = {}
+        for item in items:
+            groups.setdefault(self.shard_of(key(item)), []).append(item)
+        return [(self.pools[shard], groups[shard]) for shard in sorted(groups)]
+
+    async def fetch_all(self, query, *args):
+        return await fetch_all(self.pools, query, *args)
+
+    # The primary pool belongs to the caller; only shard pools are closed here
+    async def close(self):
+        if self.sharded:
+            await asyncio.gather(*(pool.close() for pool in self.pools))
+
+async def create_router(primary, max_size: int = 10, wrap=lambda pool, database: pool):
+    if not SHARD_DATABASES:
+        return ShardRouter([primary])
+    if ledger.ENABLED:
+        raise RuntimeError("BALANCE_STORAGE=ledger does not support sharding")
+    pools = []
+    for database in SHARD_DATABASES:
+        pools.append(wrap(await asyncpg.create_pool(
+            database=database,
+            user="test_user",
+            password="TestBank2025",
+            host="localhost",
+            min_size=1,
+            max_size=max_size
+        ), database))
+    logger.info("Accounts sharded over %s", ", ".join(SHARD_DATABASES))
+    return ShardRouter(pools)
+
+async def account_exists(pool, account_number: str):
+    async with pool.acquire() as conn:
+        return await conn.fetchval("SELECT 1 FROM accounts WHERE account_number = $1", account_number) is not None
+
+# Runs inside the caller's transaction, which already holds the payer's row lock
+async def debit(conn, transfer_id: str, from_account: str, to_account: str, amount: float):
+    await conn.execute("UPDATE accounts SET balance = balance - $1 WHERE account_number = $2", amount, from_account)
+    await conn.execute(
+        "INSERT INTO shard_transfers (transfer_id, from_account, to_account, amount) VALUES ($1, $2, $3, $4)",
+        transfer_id, from_account, to_account, amount
+    )
+
+# The first attempt records its decision and credits in the same statement; later
+# attempts find the earlier decision instead
+CREDIT_QUERY = """
+    WITH claimed AS (
+        INSERT INTO shard_credits (transfer_id, credited)
+        SELECT $1, EXISTS (SELECT 1 FROM accounts WHERE account_number = $2)
+        ON CONFLICT (transfer_id) DO NOTHING
+        RETURNING credited
+    ), credited AS (
+        UPDATE accounts SET balance = balance + $3
+        WHERE account_number = $2 AND (SELECT credited FROM claimed)
+    )
+    SELECT credited FROM claimed
+    UNION ALL
+    SELECT credited FROM shard_credits WHERE transfer_id = $1
+    LIMIT 1
+"""
+
+COMPENSATE_QUERY = """
+    WITH refunded AS (
+        UPDATE shard_transfers SET state = 'compensated', settled_at = now()
+        WHERE transfer_id = $1 AND state = 'debited'
+        RETURNING from_account, amount
+    )
+    UPDATE accounts a SET balance = a.balance + r.amount
+    FROM refunded r WHERE a.account_number = r.from_account
+"""
+
+# Credit on the payee's shard, then settle on the payer's. Returns "completed" or
+# "account_not_found"; raises if the saga could not be finished, leaving it to recovery.
+async def settle(router: ShardRouter, transfer_id: str, from_account: str, to_account: str, amount: float):
+    async with router.pool_for(to_account).acquire() as conn:
+        credited = await conn.fetchval(CREDIT_QUERY, transfer_id, to_account, amount)
+    if credited is None:
+        raise RuntimeError(f"Credit for {transfer_id} is being decided concurrently")
+    async with router.pool_for(from_account).acquire() as conn:
+        if credited:
+            await conn.execute(
+                "UPDATE shard_transfers SET state = 'credited', settled_at = now() WHERE transfer_id = $1 AND state = 'debited'",
+                transfer_id
+            )
+        else:
+            await conn.execute(COMPENSATE_QUERY, transfer_id)
+    return "completed" if credited else "account_not_found"
+
+STALLED_QUERY = """
+    SELECT transfer_id, from_account, to_account, amount FROM shard_transfers
+    WHERE state = 'debited' AND created_at < now() - $1 * interval '1 second'
+    ORDER BY created_at
+    LIMIT $2
+"""
+
+async def recover(router: ShardRouter, redis_client):
+    recovered = 0
+    for pool in router.pools:
+        async with pool.acquire() as conn:
+            stalled = await conn.fetch(STALLED_QUERY, SAGA_TIMEOUT, RECOVERY_BATCH)
+        for row in stalled:
+            transfer_id, from_account, to_account, amount = row['transfer_id'], row['from_account'], row['to_account'], row['amount']
+            try:
+                outcome = await settle(router, transfer_id, from_account, to_account, amount)
+            except Exception as e:
+                logger.error("Recovery of transfer %s failed: %s", transfer_id, e)
+                continue
+            if outcome == "completed":
+                await versions.bump(redis_client, [from_account, to_account])
+                await job_status.record(redis_client, transfer_id, from_account, to_account, amount, "completed", {"message": "Transfer successful"}, attempts=None)
+            else:
+                await versions.bump(redis_client, [from_account])
+                await job_status.record(redis_client, transfer_id, from_account, to_account, amount, "failed", {"error": "Account not found"}, attempts=None)
+            recovered += 1
+    return recovered
+
+async def run_recovery(router: ShardRouter, redis_client, interval: float = RECOVERY_INTERVAL):
+    if not router.sharded:
+        return
+    while True:
+        try:
+            recovered = await recover(router, redis_client)
+            if recovered:
+                logger.info("Recovered %s cross-shard transfers", recovered)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Cross-shard transfer recovery failed: %s", e)
+        await asyncio.sleep(interval)
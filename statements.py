@@ -0,0 +1,170 @@
+import csv
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Account statements for app.py's /statement endpoint. Rows are read from a server-side
+# cursor in CHUNK_SIZE batches and encoded one chunk at a time, so memory stays flat
+# however long the statement is. Every row has the same columns:
+#
+#   type         - "transaction", or "month_total" for the summary rows at the end
+#   date         - ISO timestamp, or YYYY-MM for month totals
+#   transfer_id, counterparty, status - blank on month totals
+#   money_in, money_out - the amount on its side for transactions, the month's sums
+#                         (completed transfers and deposits only) for month totals
+#
+# CSV needs nothing extra; Parquet needs pyarrow, imported only when asked for, and is
+# written one row group per chunk.
+
+CHUNK_SIZE = 2000
+COUNTED_STATUSES = {"completed", "deposit"}
+COLUMNS = ["type", "date", "transfer_id", "counterparty", "status", "money_in", "money_out"]
+
+STATEMENT_QUERY = """
+    SELECT transfer_id, timestamp, from_account, to_account, amount, status
+    FROM transfer_jobs
+    WHERE (from_account = $1 OR to_account = $1) AND timestamp >= $2::date AND timestamp < $3::date + 1
+    ORDER BY timestamp, transfer_id
+"""
+
+# Converts a chunk of transfer_jobs rows to statement columns and folds it into the
+# monthly totals in the same pass
+class Statement:
+    def __init__(self, account_number: str):
+        self.account_number = account_number
+        self.months = {}
+
+    def columns(self, chunk):
+        account_number = self.account_number
+        months = self.months
+        dates, transfer_ids, counterparties, statuses, money_in, money_out = [], [], [], [], [], []
+        for row in chunk:
+            amount = float(row['amount'])
+            outgoing = row['from_account'] == account_number
+            dates.append(row['timestamp'].isoformat())
+            transfer_ids.append(row['transfer_id'])
+            counterparties.append(row['to_account'] if outgoing else row['from_account'])
+            statuses.append(row['status'])
+            money_in.append(None if outgoing else amount)
+            money_out.append(amount if outgoing else None)
+            if row['status'] in COUNTED_STATUSES:
+                totals = months.setdefault(row['timestamp'].strftime("%Y-%m"), [0.0, 0.0])
+                totals[outgoing] += amount
+        return {
+            "type": ["transaction"] * len(chunk),
+            "date": dates,
+            "transfer_id": transfer_ids,
+            "counterparty": counterparties,
+            "status": statuses,
+            "money_in": money_in,
+            "money_out": money_out
+        }
+
+    def month_totals(self):
+        months = sorted(self.months)
+        return {
+            "type": ["month_total"] * len(months),
+            "date": months,
+            "transfer_id": [None] * len(months),
+            "counterparty": [None] * len(months),
+            "status": [None] * len(months),
+            "money_in": [round(self.months[month][0], 2) for month in months],
+            "money_out": [round(self.months[month][1], 2) for month in months]
+        }
+
+class CSVEncoder:
+    media_type = "text/csv"
+    extension = "csv"
+
+    def header(self):
+        return self._encode([COLUMNS])
+
+    def encode(self, columns):
+        return self._encode(zip(*(columns[name] for name in COLUMNS)))
+
+    def close(self):
+        return b""
+
+    def _encode(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+# File-like sink that hands back whatever pyarrow wrote since the last drain
+class _Sink:
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+class ParquetEncoder:
+    media_type = "application/vnd.apache.parquet"
+    extension = "parquet"
+
+    def __init__(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([
+            ("type", pa.string()), ("date", pa.string()), ("transfer_id", pa.string()),
+            ("counterparty", pa.string()), ("status", pa.string()),
+            ("money_in", pa.float64()), ("money_out", pa.float64())
+        ])
+        self.sink = _Sink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema)
+
+    def header(self):
+        return self.sink.drain()
+
+    def encode(self, columns):
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+        return self.sink.drain()
+
+    def close(self):
+        self.writer.close()
+        return self.sink.drain()
+
+ENCODERS = {"csv": CSVEncoder, "parquet": ParquetEncoder}
+
+def make_encoder(name: str):
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown statement format: {name}")
+    try:
+        return ENCODERS[name]()
+    except ImportError:
+        raise ValueError(f"{name} statements need pyarrow installed")
+
+async def stream_statement(pool, conn, transaction, cursor, first_chunk, account_number: str, encoder):
+    statement = Statement(account_number)
+    try:
+        yield encoder.header()
+        chunk = first_chunk
+        while chunk:
+            yield encoder.encode(statement.columns(chunk))
+            if len(chunk) < CHUNK_SIZE:
+                break
+            chunk = await cursor.fetch(CHUNK_SIZE)
+        yield encoder.encode(statement.month_totals())
+        yield encoder.close()
+    except Exception as e:
+        logger.error("Error streaming statement for %s: %s", account_number, e)
+    finally:
+        try:
+            await transaction.rollback()
+        finally:
+            await pool.release(conn)
@@ -0,0 +1,347 @@
+import array
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from fast_json import dumps
+import checkpoints
+import ledger
+import shards
+
+logger = logging.getLogger(__name__)
+
+# Storage backends for users, accounts, transfers and their history, used by app.py and
+# redis_worker.py. Selected with STORAGE_BACKEND:
+#
+#   postgres - the database (default). Balances follow BALANCE_STORAGE (row or ledger)
+#              and accounts are routed over SHARD_DATABASES (shards.py).
+#   memory   - MemoryStorage: balances in one array of doubles indexed by account slot,
+#              __slots__ records, and a lock per account. Nothing is persisted and the
+#              data belongs to one process, so app.py runs the transfer engine itself
+#              (benchmark.py drives it directly). It measures the Python layer without
+#              Postgres; statements, reports, search, bulk credits, standing orders and
+#              as-of balances still need Postgres and answer 501 without it.
+#
+# transfer() takes a decide(from_balance, to_exists) callback returning (outcome, result),
+# so the transfer rules stay in transfer_engine. It returns (outcome, result, changed), where
+# changed lists the accounts whose balance moved.
+
+BACKEND = os.environ.get("STORAGE_BACKEND", "postgres")
+PROFILE_COLUMNS = ("first_name", "last_name", "dob", "address_line_one", "address_line_two", "town", "city", "post_code")
+JOB_COLUMNS = ("transfer_id", "from_account", "to_account", "amount", "status", "result")
+
+PROFILE_QUERY = f"SELECT {', '.join(PROFILE_COLUMNS)} FROM accounts WHERE account_number = $1"
+HISTORY_QUERY = "SELECT transfer_id, from_account, to_account, amount, status, result FROM transfer_jobs WHERE from_account = $1 OR to_account = $1"
+
+# Write-behind upsert for job_status.py. outcome_xid feeds the incremental rollups
+# (rollups.py); a redelivered outcome that is already stored leaves the row, and its
+# xid, untouched so it is not counted twice.
+UPSERT_QUERY = """
+    INSERT INTO transfer_jobs (transfer_id, from_account, to_account, amount, status, result, timestamp, outcome_xid)
+    SELECT j.transfer_id, j.from_account, j.to_account, j.amount, j.status, j.result::jsonb, to_timestamp(j.recorded_at), pg_current_xact_id()
+    FROM unnest($1::text[], $2::text[], $3::text[], $4::float8[], $5::text[], $6::text[], $7::float8[])
+        AS j(transfer_id, from_account, to_account, amount, status, result, recorded_at)
+    ON CONFLICT (transfer_id) DO UPDATE SET status = EXCLUDED.status, result = EXCLUDED.result, outcome_xid = EXCLUDED.outcome_xid
+    WHERE transfer_jobs.status IS DISTINCT FROM EXCLUDED.status
+"""
+
+class PostgresStorage:
+    name = "postgres"
+
+    def __init__(self, pool, router: shards.ShardRouter):
+        self.pool = pool
+        self.router = router
+
+    async def password_hash(self, username: str):
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval("SELECT password_hash FROM users WHERE username = $1", username)
+
+    async def create_user(self, username: str, password_hash: str):
+        async with self.pool.acquire() as conn:
+            await conn.execute("INSERT INTO users (username, password_hash) VALUES ($1, $2)", username, password_hash)
+
+    async def profile(self, account_number: str):
+        async with self.router.pool_for(account_number).acquire() as conn:
+            row = await conn.fetchrow(PROFILE_QUERY, account_number)
+        return dict(row) if row else None
+
+    async def balance(self, account_number: str):
+        async with self.router.pool_for(account_number).acquire() as conn:
+            if ledger.ENABLED:
+                return await ledger.account_balance(conn, account_number)
+            return await conn.fetchval("SELECT balance FROM accounts WHERE account_number = $1", account_number)
+
+    async def balances(self):
+        return await self.router.fetch_all(f"SELECT account_number, balance FROM {ledger.BALANCES}")
+
+    async def existing_accounts(self, account_numbers):
+        rows = await self.router.fetch_all("SELECT account_number FROM accounts WHERE account_number = ANY($1)", account_numbers)
+        return {row['account_number'] for row in rows}
+
+    # Each shard's accounts are inserted in one transaction
+    async def open_accounts(self, accounts):
+        opening_balances = [(acc.account_number, acc.balance) for acc in accounts]
+        for pool, shard_accounts in self.router.group(accounts, key=lambda acc: acc.account_number):
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.executemany(
+                        f"INSERT INTO accounts (account_number, balance, {', '.join(PROFILE_COLUMNS)}) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)",
+                        [(acc.account_number, acc.balance, *(getattr(acc, column) for column in PROFILE_COLUMNS)) for acc in shard_accounts]
+                    )
+                    if ledger.ENABLED:
+                        await ledger.create_snapshots(conn, [(acc.account_number, acc.balance) for acc in shard_accounts])
+                    if not self.router.sharded:
+                        await checkpoints.create_checkpoints(conn, opening_balances)
+        # Checkpoints live on the primary database, not on the account shards
+        if self.router.sharded:
+            async with self.pool.acquire() as conn:
+                await checkpoints.create_checkpoints(conn, opening_balances)
+
+    async def remove_accounts(self, account_numbers):
+        for pool, numbers in self.router.group(account_numbers):
+            async with pool.acquire() as conn:
+                await conn.execute("DELETE FROM accounts WHERE account_number = ANY($1)", numbers)
+
+    # Ledger credits append without locking
+    async def deposit(self, transfer_id: str, account_number: str, amount: float):
+        async with self.router.pool_for(account_number).acquire() as conn:
+            async with conn.transaction():
+                if ledger.ENABLED:
+                    credited = await ledger.account_exists(conn, account_number)
+                    if credited:
+                        await ledger.append_credit(conn, transfer_id, account_number, amount)
+                    return credited
+                return await conn.fetchval(
+                    "UPDATE accounts SET balance = balance + $1 WHERE account_number = $2 RETURNING account_number",
+                    amount, account_number
+                ) is not None
+
+    # Accounts on different shards go through the saga in shards.py: the payer's
+    # transaction only debits, and settle() credits the payee afterwards
+    async def transfer(self, transfer_id: str, from_account: str, to_account: str, amount: float, decide, stamps: dict):
+        router = self.router
+        cross_shard = router.shard_of(from_account) != router.shard_of(to_account)
+        async with router.pool_for(from_account).acquire() as conn:
+            async with conn.transaction():
+                if ledger.ENABLED:
+                    from_balance = await ledger.lock_for_debit(conn, from_account)
+                    stamps["lock_acquired"] = time.time()
+                    to_exists = await ledger.account_exists(conn, to_account)
+                else:
+                    from_balance = await conn.fetchval(
+                        "SELECT balance FROM accounts WHERE account_number = $1 FOR UPDATE",
+                        from_account
+                    )
+                    stamps["lock_acquired"] = time.time()
+                    if cross_shard:
+                        to_exists = await shards.account_exists(router.pool_for(to_account), to_account)
+                    else:
+                        to_exists = await conn.fetchval(
+                            "SELECT 1 FROM accounts WHERE account_number = $1",
+                            to_account
+                        ) is not None
+
+                outcome, result = decide(from_balance, to_exists)
+                if outcome == "completed":
+                    if ledger.ENABLED:
+                        await ledger.append_transfer(conn, transfer_id, from_account, to_account, amount)
+                    elif cross_shard:
+                        await shards.debit(conn, transfer_id, from_account, to_account, amount)
+                    else:
+                        await conn.execute(
+                            "UPDATE accounts SET balance = balance - $1 WHERE account_number = $2",
+                            amount, from_account
+                        )
+                        await conn.execute(
+                            "UPDATE accounts SET balance = balance + $1 WHERE account_number = $2",
+                            amount, to_account
+                        )
+            stamps["committed"] = time.time()
+        if outcome != "completed":
+            return outcome, result, []
+        if not cross_shard:
+            return outcome, result, [from_account, to_account]
+        try:
+            outcome = await shards.settle(router, transfer_id, from_account, to_account, amount)
+        except Exception as e:
+            # The payer is debited; shards.run_recovery finishes the saga and records it
+            logger.error("Transfer %s left for recovery: %s", transfer_id, e)
+            return "settling", None, []
+        if outcome != "completed":
+            logger.warning("Transfer %s failed: Account not found, payer refunded", transfer_id)
+            return outcome, {"error": "Account not found"}, [from_account]
+        return outcome, result, [from_account, to_account]
+
+    async def create_job(self, transfer_id: str, from_account: str, to_account: str, amount: float):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "INSERT INTO transfer_jobs (transfer_id, from_account, to_account, amount, status, timestamp) VALUES ($1, $2, $3, $4, $5, CURRENT_TIMESTAMP)",
+                transfer_id, from_account, to_account, amount, "pending"
+            )
+
+    async def job(self, transfer_id: str):
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(f"SELECT {', '.join(JOB_COLUMNS)} FROM transfer_jobs WHERE transfer_id = $1", transfer_id)
+        return dict(row) if row else None
+
+    # Chunks from a server-side cursor; the connection is held until the generator is
+    # exhausted or closed
+    async def history(self, account_number: str, chunk_size: int):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                cursor = await conn.cursor(HISTORY_QUERY, account_number)
+                while True:
+                    chunk = await cursor.fetch(chunk_size)
+                    if chunk:
+                        yield chunk
+                    if len(chunk) < chunk_size:
+                        break
+
+    async def save_outcomes(self, jobs):
+        columns = JOB_COLUMNS + ("recorded_at",)
+        arrays = [[job[column] for job in jobs] for column in columns]
+        arrays[5] = [dumps(result).decode() for result in arrays[5]]
+        async with self.pool.acquire() as conn:
+            await conn.execute(UPSERT_QUERY, *arrays)
+
+class MemoryAccount:
+    __slots__ = ("slot", "lock") + PROFILE_COLUMNS
+
+    def __init__(self, slot: int, acc):
+        self.slot = slot
+        self.lock = None
+        for column in PROFILE_COLUMNS:
+            setattr(self, column, getattr(acc, column))
+
+class MemoryJob:
+    __slots__ = JOB_COLUMNS + ("recorded_at",)
+
+    def __init__(self, transfer_id: str, from_account: str, to_account: str, amount: float, status: str, result, recorded_at: float):
+        self.transfer_id = transfer_id
+        self.from_account = from_account
+        self.to_account = to_account
+        self.amount = amount
+        self.status = status
+        self.result = result
+        self.recorded_at = recorded_at
+
+    # Rows are read like asyncpg Records by the history renderer
+    def __getitem__(self, column: str):
+        return getattr(self, column)
+
+class MemoryStorage:
+    name = "memory"
+
+    def __init__(self):
+        self.users = {}
+        self.accounts = {}
+        self.balance_array = array.array("d")
+        self.free_slots = []
+        self.jobs = {}
+        self.account_jobs = {}
+
+    async def password_hash(self, username: str):
+        return self.users.get(username)
+
+    async def create_user(self, username: str, password_hash: str):
+        if username in self.users:
+            raise ValueError(f"User {username} already exists")
+        self.users[username] = password_hash
+
+    async def profile(self, account_number: str):
+        account = self.accounts.get(account_number)
+        return {column: getattr(account, column) for column in PROFILE_COLUMNS} if account else None
+
+    async def balance(self, account_number: str):
+        account = self.accounts.get(account_number)
+        return self.balance_array[account.slot] if account else None
+
+    async def balances(self):
+        balances = self.balance_array
+        return [{"account_number": number, "balance": balances[account.slot]} for number, account in self.accounts.items()]
+
+    async def existing_accounts(self, account_numbers):
+        return {number for number in account_numbers if number in self.accounts}
+
+    async def open_accounts(self, accounts):
+        existing = await self.existing_accounts([acc.account_number for acc in accounts])
+        if existing:
+            raise ValueError(f"Accounts already exist: {existing}")
+        for acc in accounts:
+            if self.free_slots:
+                slot = self.free_slots.pop()
+                self.balance_array[slot] = acc.balance
+            else:
+                slot = len(self.balance_array)
+                self.balance_array.append(acc.balance)
+            self.accounts[acc.account_number] = MemoryAccount(slot, acc)
+
+    async def remove_accounts(self, account_numbers):
+        for number in account_numbers:
+            account = self.accounts.pop(number, None)
+            if account is not None:
+                self.free_slots.append(account.slot)
+
+    def _lock(self, account: MemoryAccount):
+        if account.lock is None:
+            account.lock = asyncio.Lock()
+        return account.lock
+
+    async def deposit(self, transfer_id: str, account_number: str, amount: float):
+        account = self.accounts.get(account_number)
+        if account is None:
+            return False
+        async with self._lock(account):
+            self.balance_array[account.slot] += amount
+        return True
+
+    # Both accounts' locks are taken in account-number order, as Postgres row locks would be
+    async def transfer(self, transfer_id: str, from_account: str, to_account: str, amount: float, decide, stamps: dict):
+        payer = self.accounts.get(from_account)
+        payee = self.accounts.get(to_account)
+        async with contextlib.AsyncExitStack() as locks:
+            for number in sorted({number for number, account in ((from_account, payer), (to_account, payee)) if account}):
+                await locks.enter_async_context(self._lock(self.accounts[number]))
+            stamps["lock_acquired"] = time.time()
+            balances = self.balance_array
+            outcome, result = decide(balances[payer.slot] if payer else None, payee is not None)
+            if outcome == "completed":
+                balances[payer.slot] -= amount
+                balances[payee.slot] += amount
+        stamps["committed"] = time.time()
+        return outcome, result, [from_account, to_account] if outcome == "completed" else []
+
+    def _index(self, job: MemoryJob):
+        self.jobs[job.transfer_id] = job
+        self.account_jobs.setdefault(job.from_account, []).append(job)
+        if job.to_account != job.from_account:
+            self.account_jobs.setdefault(job.to_account, []).append(job)
+
+    async def create_job(self, transfer_id: str, from_account: str, to_account: str, amount: float):
+        self._index(MemoryJob(transfer_id, from_account, to_account, amount, "pending", None, time.time()))
+
+    async def job(self, transfer_id: str):
+        job = self.jobs.get(transfer_id)
+        return {column: getattr(job, column) for column in JOB_COLUMNS} if job else None
+
+    async def history(self, account_number: str, chunk_size: int):
+        jobs = self.account_jobs.get(account_number, [])
+        for start in range(0, len(jobs), chunk_size):
+            yield jobs[start:start + chunk_size]
+
+    async def save_outcomes(self, jobs):
+        for job in jobs:
+            stored = self.jobs.get(job["transfer_id"])
+            if stored is None:
+                self._index(MemoryJob(*(job[column] for column in JOB_COLUMNS), job["recorded_at"]))
+            elif stored.status != job["status"]:
+                stored.status = job["status"]
+                stored.result = job["result"]
+
+def make_storage(name: str, pool=None, router: shards.ShardRouter = None):
+    if name == MemoryStorage.name:
+        return MemoryStorage()
+    if name == PostgresStorage.name:
+        return PostgresStorage(pool, router or shards.ShardRouter([pool]))
+    raise ValueError(f"Unknown storage backend: {name}")
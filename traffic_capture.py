@@ -0,0 +1,140 @@
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Recorded-traffic capture for app.py. A sampled fraction of requests is appended to
+# TRAFFIC_CAPTURE_DIR/capture-{pid}.jsonl, one compact JSON object per line:
+#   t  - wall-clock start (epoch seconds)      m  - method
+#   p  - path                                  r  - route template
+#   q  - query string                          ct - request content type
+#   b  - request body (text)                   s  - response status
+#   d  - server-side duration in ms
+# Sensitive fields in the query string, JSON and form bodies are replaced by a keyed hash,
+# so the same value always maps to the same token and replayed requests stay consistent.
+# Writes happen on a background thread; the request path only enqueues a dict.
+
+CAPTURE_RATE = float(os.environ.get("TRAFFIC_CAPTURE_RATE", "0"))
+CAPTURE_DIR = os.environ.get("TRAFFIC_CAPTURE_DIR", "/opt/banking-app/traffic")
+# Required when capturing: with a known key the masked fields could be brute-forced offline
+CAPTURE_KEY = os.environ.get("TRAFFIC_CAPTURE_KEY", "").encode()
+SENSITIVE_FIELDS = {
+    "username", "password", "first_name", "last_name", "dob",
+    "address_line_one", "address_line_two", "post_code"
+}
+EXCLUDED_PREFIXES = ("/metrics", "/admin", "/static")
+QUEUE_SIZE = 100000
+
+def mask(value: str):
+    return "h_" + hmac.new(CAPTURE_KEY, value.encode(), hashlib.sha256).hexdigest()[:16]
+
+def mask_mapping(data):
+    if isinstance(data, list):
+        return [mask_mapping(item) for item in data]
+    if not isinstance(data, dict):
+        return data
+    return {
+        key: mask(str(value)) if key in SENSITIVE_FIELDS and value not in (None, "") else mask_mapping(value)
+        for key, value in data.items()
+    }
+
+def mask_query(query: str):
+    if not query:
+        return query
+    return urlencode([
+        (key, mask(value) if key in SENSITIVE_FIELDS and value else value)
+        for key, value in parse_qsl(query, keep_blank_values=True)
+    ])
+
+def mask_body(body: bytes, content_type: str):
+    if not body:
+        return ""
+    if content_type.startswith("application/json"):
+        try:
+            return orjson.dumps(mask_mapping(orjson.loads(body))).decode()
+        except orjson.JSONDecodeError:
+            return ""
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return mask_query(body.decode("utf-8", "replace"))
+    # Anything else (multipart uploads, binary) is not replayable; drop it
+    return ""
+
+class TrafficRecorder:
+    def __init__(self, rate: float = CAPTURE_RATE, directory: str = CAPTURE_DIR):
+        self.rate = rate
+        self.directory = directory
+        self.enabled = rate > 0 and bool(CAPTURE_KEY)
+        self.missing_key = rate > 0 and not CAPTURE_KEY
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.dropped = 0
+        self.every = max(1, round(1 / rate)) if self.enabled else 0
+        self.seen = 0
+        self.writer = None
+
+    def start(self):
+        if self.missing_key:
+            logger.error("TRAFFIC_CAPTURE_RATE is set but TRAFFIC_CAPTURE_KEY is not; traffic capture disabled")
+        if not self.enabled or self.writer:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"capture-{os.getpid()}.jsonl")
+        self.writer = threading.Thread(target=self._write, args=(path,), name="traffic-capture", daemon=True)
+        self.writer.start()
+        logger.warning("Capturing 1 in %s requests to %s", self.every, path)
+
+    def should_capture(self, path: str):
+        if path.startswith(EXCLUDED_PREFIXES):
+            return False
+        self.seen += 1
+        return self.seen % self.every == 0
+
+    def record(self, entry: dict):
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        if self.writer:
+            self.queue.put(None)
+            self.writer.join(timeout=5)
+            self.writer = None
+
+    def _write(self, path: str):
+        with open(path, "ab", buffering=64 * 1024) as f:
+            while True:
+                entry = self.queue.get()
+                if entry is None:
+                    break
+                f.write(orjson.dumps(entry) + b"\n")
+                if self.queue.empty():
+                    f.flush()
+
+async def capture(recorder: TrafficRecorder, request, call_next):
+    if not recorder.should_capture(request.url.path):
+        return await call_next(request)
+    content_type = request.headers.get("content-type", "")
+    body = await request.body()
+    started = time.time()
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    recorder.record({
+        "t": started,
+        "m": request.method,
+        "p": request.url.path,
+        "r": route.path if route else None,
+        "q": mask_query(request.url.query),
+        "ct": content_type,
+        "b": mask_body(body, content_type),
+        "s": response.status_code,
+        "d": round((time.perf_counter() - start) * 1000, 3)
+    })
+    return response
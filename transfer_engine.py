@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+import time
+from metrics import WORKER_JOBS, WORKER_JOB_DURATION
+from transfer_timing import record_stages
+import job_status
+import versions
+
+logger = logging.getLogger(__name__)
+job_logger = logging.getLogger(f"{__name__}.jobs")
+
+# The transfer engine: pops jobs from a transfer_queue backend and applies them through a
+# storage backend. redis_worker.py runs it against Postgres; with STORAGE_BACKEND=memory
+# app.py runs it in-process, since the accounts live in the app's memory.
+
+FRAUD_CHECK_LIMIT = float(os.environ["FRAUD_CHECK_LIMIT"]) if os.environ.get("FRAUD_CHECK_LIMIT") else None
+
+# Fraud rule carried over from the old rq worker: reject transfers at or above the limit.
+# Off unless FRAUD_CHECK_LIMIT is set.
+def check_fraud(amount):
+    return FRAUD_CHECK_LIMIT is None or amount < FRAUD_CHECK_LIMIT
+
+# The transfer rules, applied by the storage backend once it holds the payer's lock
+def decide(transfer_id, from_account, to_account, amount, from_balance, to_exists):
+    if from_balance is None or not to_exists:
+        logger.warning("Transfer %s failed: Account not found", transfer_id)
+        return "account_not_found", {"error": "Account not found"}
+    if from_balance < amount:
+        logger.warning("Transfer %s failed: Insufficient funds", transfer_id)
+        return "insufficient_funds", {"error": "Insufficient funds"}
+    if not check_fraud(amount):
+        logger.warning("Transfer %s failed: Rejected by fraud check", transfer_id)
+        return "fraud_rejected", {"error": f"Transfer of £{amount:.2f} from {from_account} to {to_account} rejected by fraud check"}
+    return "completed", {"message": "Transfer successful"}
+
+# The single write path for transfers, whichever queue backend the job came from
+async def process_transfer(storage, redis_client, transfer_data):
+    transfer_id = transfer_data['transfer_id']
+    from_account = transfer_data['from_account']
+    to_account = transfer_data['to_account']
+    amount = transfer_data['amount']
+    stamps = {
+        "enqueued": transfer_data.get('enqueued_at'),
+        "dequeued": transfer_data.get('dequeued_at', time.time())
+    }
+
+    # The status row is written behind (job_status.py), so the storage transaction only
+    # touches balances; for jobs from the rq backend the upsert also creates the row
+    try:
+        outcome, result, changed = await storage.transfer(
+            transfer_id, from_account, to_account, amount,
+            lambda from_balance, to_exists: decide(transfer_id, from_account, to_account, amount, from_balance, to_exists),
+            stamps
+        )
+        if outcome == "settling":
+            # A cross-shard saga left to shards.run_recovery, which records the outcome
+            await record_stages(redis_client, transfer_id, stamps)
+            return outcome
+        if changed:
+            await versions.bump(redis_client, changed)
+        if outcome == "completed":
+            job_logger.info("Transfer %s completed", transfer_id)
+    except Exception as e:
+        logger.error("Error processing transfer %s: %s", transfer_id, e)
+        stamps["committed"] = time.time()
+        result = {"error": str(e)}
+        outcome = "error"
+
+    await job_status.record(
+        redis_client, transfer_id, from_account, to_account, amount,
+        "completed" if outcome == "completed" else "failed", result, attempts=None
+    )
+    await record_stages(redis_client, transfer_id, stamps)
+    return outcome
+
+async def run_engine(storage, redis_client, backend, profiler=None):
+    logger.info("Consuming transfers from the %s backend", backend.name)
+    while True:
+        try:
+            transfer = await backend.pop()
+            transfer['dequeued_at'] = time.time()
+            start = time.perf_counter()
+            if profiler and profiler.active and profiler.should_sample():
+                with profiler.profile():
+                    outcome = await process_transfer(storage, redis_client, transfer)
+            else:
+                outcome = await process_transfer(storage, redis_client, transfer)
+            WORKER_JOBS.labels(outcome).inc()
+            WORKER_JOB_DURATION.labels(outcome).observe(time.perf_counter() - start)
+            await backend.complete(transfer, outcome)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Error in worker loop: %s", e)
+            await asyncio.sleep(1)
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Queue backends for the transfer engine in redis_worker.py. A backend hands the engine
+# transfer jobs as dicts (transfer_id, from_account, to_account, amount, ...) and is told
+# the outcome once the job has been processed.
+#
+#   redis-list - JSON jobs on the 'transfers' list, pushed by app.py /transfer and by
+#                worker.py's rq-compatible TransferQueue.enqueue (the default), and on
+#                'transfers:scheduled', pushed by scheduler.py; BLPOP takes from the
+#                second only while the first is empty, so interactive transfers go first
+#   rq         - drains jobs that legacy producers enqueued with rq itself
+#                (rq:queue:<name>), so nothing is stranded while they are migrated
+
+TRANSFER_QUEUE = "transfers"
+SCHEDULED_QUEUE = "transfers:scheduled"
+
+class RedisListBackend:
+    name = "redis-list"
+
+    def __init__(self, redis_client, queue_name: str = TRANSFER_QUEUE, scheduled_queue: str = SCHEDULED_QUEUE):
+        self.redis = redis_client
+        self.queue_name = queue_name
+        self.scheduled_queue = scheduled_queue
+
+    async def pop(self):
+        _, data = await self.redis.blpop([self.queue_name, self.scheduled_queue])
+        return json.loads(data)
+
+    async def complete(self, job: dict, outcome: str):
+        pass
+
+# Legacy rq jobs: the job hash is decoded with rq's own Job class (in a thread, rq is
+# synchronous) and its args mapped onto a transfer. rq job ids become transfer ids; no
+# producer created their transfer_jobs row, so job_status's outcome upsert inserts it.
+class RQBackend:
+    name = "rq"
+
+    def __init__(self, redis_client, queue_name: str = "default"):
+        import redis as sync_redis
+        from rq.job import Job, JobStatus
+        self.redis = redis_client
+        self.queue_key = f"rq:queue:{queue_name}"
+        self.job_class = Job
+        self.job_status = JobStatus
+        kwargs = redis_client.connection_pool.connection_kwargs
+        self.sync_redis = sync_redis.Redis(host=kwargs.get("host", "localhost"), port=kwargs.get("port", 6379), db=kwargs.get("db", 0))
+
+    async def pop(self):
+        while True:
+            _, job_id = await self.redis.blpop(self.queue_key)
+            try:
+                job = await asyncio.to_thread(self.job_class.fetch, job_id.decode(), connection=self.sync_redis)
+                from_account, to_account, amount = job.args
+            except Exception as e:
+                logger.error("Skipping unreadable rq job %s: %s", job_id, e)
+                continue
+            return {
+                "transfer_id": job.id,
+                "from_account": from_account,
+                "to_account": to_account,
+                "amount": float(amount),
+                "enqueued_at": job.enqueued_at.timestamp() if job.enqueued_at else time.time(),
+                "rq_job": job
+            }
+
+    async def complete(self, job: dict, outcome: str):
+        status = self.job_status.FINISHED if outcome == "completed" else self.job_status.FAILED
+        try:
+            await asyncio.to_thread(job["rq_job"].set_status, status)
+        except Exception as e:
+            logger.warning("Failed to update rq status for %s: %s", job["transfer_id"], e)
+
+BACKENDS = {RedisListBackend.name: RedisListBackend, RQBackend.name: RQBackend}
+
+def make_backend(name: str, redis_client):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown transfer queue backend: {name}")
+    return BACKENDS[name](redis_client)
@@ -0,0 +1,131 @@
+import json
+import logging
+import time
+from prometheus_client import Histogram
+from metrics import LATENCY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+# Transfer lifecycle stages, in order. Timestamps (epoch seconds) are kept per job in
+# the Redis hash transfer_timings:{transfer_id}:
+#   enqueued       - /transfer pushed the job onto 'transfers'
+#   dequeued       - redis_worker popped it
+#   lock_acquired  - the FOR UPDATE on the source account returned
+#   committed      - the transaction holding the balance and status updates committed
+#   status_visible - /transfer_status first returned the final status to a client
+STAGES = ("enqueued", "dequeued", "lock_acquired", "committed", "status_visible")
+
+# Interval between consecutive stages, named after what the transfer was waiting on
+INTERVALS = (
+    ("queue_wait", "enqueued", "dequeued"),
+    ("lock_wait", "dequeued", "lock_acquired"),
+    ("commit", "lock_acquired", "committed"),
+    ("visibility", "committed", "status_visible"),
+)
+
+TIMINGS_KEY = "transfer_timings:{}"
+RECENT_KEY = "transfer_timings:recent"
+TIMINGS_TTL = 24 * 3600
+RECENT_LIMIT = 10000
+
+TRANSFER_STAGE_SECONDS = Histogram(
+    'transfer_stage_seconds', 'Time a transfer spent in each lifecycle stage', ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+
+def breakdown(stamps: dict):
+    intervals = {}
+    for name, start, end in INTERVALS:
+        if stamps.get(start) is not None and stamps.get(end) is not None:
+            intervals[name] = stamps[end] - stamps[start]
+    if stamps.get("enqueued") is not None:
+        last = max(stamps[stage] for stage in STAGES if stamps.get(stage) is not None)
+        intervals["total"] = last - stamps["enqueued"]
+    return intervals
+
+def observe(intervals: dict):
+    for name, seconds in intervals.items():
+        if name != "total":
+            TRANSFER_STAGE_SECONDS.labels(name).observe(seconds)
+
+async def push_recent(redis_client, intervals: dict):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.lpush(RECENT_KEY, json.dumps(intervals))
+        pipe.ltrim(RECENT_KEY, 0, RECENT_LIMIT - 1)
+        await pipe.execute()
+
+# The worker and the app each write their own stamps, in either order. Whichever of the two
+# writes second sees both and adds the visibility interval and the end-to-end total to the
+# recent sample; "total" therefore only covers transfers a client has seen finish.
+
+# Called by the worker once a job is finished: store its stamps and feed the recent sample
+async def record_stages(redis_client, transfer_id: str, stamps: dict):
+    stamps = {stage: value for stage, value in stamps.items() if value is not None}
+    try:
+        key = TIMINGS_KEY.format(transfer_id)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hget(key, "status_visible")
+            pipe.hset(key, mapping=stamps)
+            pipe.expire(key, TIMINGS_TTL)
+            visible = (await pipe.execute())[0]
+        if visible is not None:
+            stamps["status_visible"] = float(visible)
+        intervals = breakdown(stamps)
+        if visible is None:
+            intervals.pop("total", None)
+        observe(intervals)
+        await push_recent(redis_client, intervals)
+    except Exception as e:
+        logger.warning("Failed to record stage timings for %s: %s", transfer_id, e)
+
+# Called by the app the first time a client sees a final status
+async def mark_status_visible(redis_client, transfer_id: str):
+    key = TIMINGS_KEY.format(transfer_id)
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hsetnx(key, "status_visible", time.time())
+            pipe.expire(key, TIMINGS_TTL)
+            pipe.hgetall(key)
+            first, _, raw = await pipe.execute()
+        stamps = {name.decode(): float(value) for name, value in raw.items()}
+        if not first or "committed" not in stamps:
+            return
+        intervals = {
+            name: seconds for name, seconds in breakdown(stamps).items()
+            if name in ("visibility", "total")
+        }
+        observe(intervals)
+        await push_recent(redis_client, intervals)
+    except Exception as e:
+        logger.warning("Failed to mark status visible for %s: %s", transfer_id, e)
+
+async def get_stages(redis_client, transfer_id: str):
+    raw = await redis_client.hgetall(TIMINGS_KEY.format(transfer_id))
+    stamps = {key.decode(): float(value) for key, value in raw.items()}
+    return {
+        "transfer_id": transfer_id,
+        "stages": {stage: stamps.get(stage) for stage in STAGES},
+        "intervals": breakdown(stamps)
+    }
+
+def percentile(sorted_values, q: float):
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+# Percentile summary over the most recent RECENT_LIMIT samples; a transfer contributes its
+# worker stages and, once a client has seen it finish, its visibility and total
+async def summarize(redis_client, limit: int = RECENT_LIMIT):
+    samples = [json.loads(item) for item in await redis_client.lrange(RECENT_KEY, 0, limit - 1)]
+    summary = {}
+    for name in [interval[0] for interval in INTERVALS] + ["total"]:
+        values = sorted(sample[name] for sample in samples if name in sample)
+        if not values:
+            continue
+        summary[name] = {
+            "count": len(values),
+            "p50": percentile(values, 0.50),
+            "p90": percentile(values, 0.90),
+            "p99": percentile(values, 0.99),
+            "max": values[-1]
+        }
+    return {"samples": len(samples), "intervals": summary}
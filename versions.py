@@ -0,0 +1,50 @@
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Per-account version counters for conditional GETs. Every write path bumps the versions
+# of the accounts it touched, plus a global high-water mark, after its transaction
+# commits: worker transfers, /deposit, /api/bulk_credit and open_account. ETags are
+# built from the counters alone, so an unchanged poll costs one Redis round trip and no
+# database work.
+#
+# ETags also carry a random epoch stored next to the counters. If Redis loses them, a
+# new epoch is drawn and every previously issued ETag stops matching.
+
+VERSIONS_KEY = "account_versions"
+HIGH_WATER_KEY = "accounts:version"
+EPOCH_KEY = "accounts:version_epoch"
+
+async def bump(redis_client, account_numbers):
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for account_number in set(account_numbers):
+                pipe.hincrby(VERSIONS_KEY, account_number, 1)
+            pipe.incr(HIGH_WATER_KEY)
+            await pipe.execute()
+    except Exception as e:
+        # Clients may keep a stale ETag until the account's next write
+        logger.error("Failed to bump versions for %s: %s", account_numbers, e)
+
+async def _etag(redis_client, read_version):
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.get(EPOCH_KEY)
+        read_version(pipe)
+        epoch, version = await pipe.execute()
+    if epoch is None:
+        await redis_client.set(EPOCH_KEY, uuid.uuid4().hex[:12], nx=True)
+        epoch = await redis_client.get(EPOCH_KEY)
+    return f'"{epoch.decode()}.{int(version or 0)}"'
+
+async def account_etag(redis_client, account_number: str):
+    return await _etag(redis_client, lambda pipe: pipe.hget(VERSIONS_KEY, account_number))
+
+async def list_etag(redis_client):
+    return await _etag(redis_client, lambda pipe: pipe.get(HIGH_WATER_KEY))
+
+def not_modified(if_none_match, etag: str):
+    if not if_none_match or not etag:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
@@ -1,15 +1,23 @@
-import redis
-from rq import Queue, Worker
+import json
 import time
-import psycopg2
+import uuid
+import redis
 from psycopg2 import pool
 
+# worker.py used to run transfers through rq, forking a process per job and writing its
+# own 'transactions' ledger. Transfers are now processed only by the long-lived engine in
+# redis_worker.py. This module keeps the producer side working: `queue.enqueue(
+# process_transfer, from_account, to_account, amount)` has the same call shape as rq's,
+# and `python worker.py` starts the engine.
+
+TRANSFER_QUEUE = "transfers"
+RQ_STATUS = {"pending": "queued", "completed": "finished", "failed": "failed"}
+
 # Redis connection
 redis_conn = redis.Redis(host='localhost', port=6379, db=0)
-queue = Queue(connection=redis_conn)
 
-# Connection pool for PostgreSQL (same as in app.py)
-db_pool = pool.SimpleConnectionPool(
+# Connection pool for PostgreSQL; ThreadedConnectionPool is safe to share between producer threads
+db_pool = pool.ThreadedConnectionPool(
     1, 20,  # Min and max connections
     dbname="test_bank",
     user="test_user",
@@ -17,80 +25,90 @@ db_pool = pool.SimpleConnectionPool(
     host="localhost"
 )
 
-# Database connection management
-def get_db_connection():
-    return db_pool.getconn()
-
-def release_db_connection(conn):
-    db_pool.putconn(conn)
-
-# Fraud check function
-def check_fraud(account, amount):
-    time.sleep(0.01)  # Simulate 0.01-second delay
-    result = amount < 1000  # Approve if under £1000
-    print(f"Fraud check for transfer of £{amount:.2f} from {account}: {'Approved' if result else 'Rejected'}")
-    return result
-
-# Process the transfer (including fraud check and database updates)
-def process_transfer(from_account, to_account, amount):
-    print(f"Processing transfer of £{amount:.2f} from {from_account} to {to_account}")
-    
-    # Connect to the database
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    try:
-        # Start a transaction and lock the rows
-        cursor.execute("BEGIN")
-        cursor.execute("SELECT balance FROM accounts WHERE account_number = %s FOR UPDATE", (from_account,))
-        from_result = cursor.fetchone()
-        cursor.execute("SELECT balance FROM accounts WHERE account_number = %s FOR UPDATE", (to_account,))
-        to_result = cursor.fetchone()
-
-        if not from_result or not to_result:
-            cursor.execute("ROLLBACK")
-            cursor.close()
-            release_db_connection(conn)
-            print(f"One or both accounts not found: {from_account}, {to_account}")
-            return {"status": "failed", "message": "One or both accounts not found"}
-
-        print(f"Balance check: Account {from_account} has £{from_result[0]:.2f}, needs £{amount:.2f}")
-        if from_result[0] < amount:
-            cursor.execute("ROLLBACK")
-            cursor.close()
-            release_db_connection(conn)
-            print(f"Insufficient funds in {from_account} for transfer of £{amount:.2f}")
-            return {"status": "failed", "message": f"Insufficient funds in {from_account}"}
-
-        # Perform the fraud check after the balance check
-        fraud_result = check_fraud(from_account, amount)
-        if not fraud_result:
-            cursor.execute("ROLLBACK")
-            cursor.close()
-            release_db_connection(conn)
-            print(f"Transfer of £{amount:.2f} from {from_account} to {to_account} rejected by fraud check")
-            return {"status": "failed", "message": f"Transfer of £{amount:.2f} from {from_account} to {to_account} rejected by fraud check"}
-
-        # Perform the transfer
-        cursor.execute("UPDATE accounts SET balance = balance - %s WHERE account_number = %s", (amount, from_account))
-        cursor.execute("UPDATE accounts SET balance = balance + %s WHERE account_number = %s", (amount, to_account))
-        cursor.execute("INSERT INTO transactions (account_number, amount, type) VALUES (%s, %s, 'transfer_out')", (from_account, amount))
-        cursor.execute("INSERT INTO transactions (account_number, amount, type) VALUES (%s, %s, 'transfer_in')", (to_account, amount))
-        cursor.execute("COMMIT")
-
-        cursor.close()
-        release_db_connection(conn)
-        print(f"Transfer of £{amount:.2f} from {from_account} to {to_account} completed successfully")
-        return {"status": "success", "message": f"Transferred £{amount:.2f} from {from_account} to {to_account}"}
-
-    except Exception as e:
-        cursor.execute("ROLLBACK")
-        cursor.close()
-        release_db_connection(conn)
-        print(f"Transfer failed: {str(e)}")
-        return {"status": "failed", "message": f"Transfer failed: {str(e)}"}
+# The subset of rq.job.Job that producers use, backed by the transfer_jobs row
+class TransferJob:
+    def __init__(self, transfer_id):
+        self.id = transfer_id
+
+    def _fetch(self):
+        conn = db_pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT from_account, to_account, amount, status, result FROM transfer_jobs WHERE transfer_id = %s",
+                    (self.id,)
+                )
+                return cursor.fetchone()
+        finally:
+            conn.rollback()
+            db_pool.putconn(conn)
+
+    def get_status(self):
+        row = self._fetch()
+        return RQ_STATUS.get(row[3], row[3]) if row else None
+
+    # Same shape as the old process_transfer return value, None until the engine is done
+    @property
+    def result(self):
+        row = self._fetch()
+        if not row or row[3] == "pending":
+            return None
+        from_account, to_account, amount, status, result = row
+        if status == "completed":
+            return {"status": "success", "message": f"Transferred £{amount:.2f} from {from_account} to {to_account}"}
+        result = json.loads(result) if isinstance(result, str) else (result or {})
+        return {"status": "failed", "message": result.get("error", "Transfer failed")}
+
+# rq-compatible producer: records the pending job and hands it to the engine's queue
+class TransferQueue:
+    def __init__(self, connection=redis_conn, name=TRANSFER_QUEUE):
+        self.connection = connection
+        self.name = name
+
+    def enqueue(self, f, *args, **kwargs):
+        func_name = f if isinstance(f, str) else getattr(f, "__name__", "")
+        if not func_name.endswith("process_transfer"):
+            raise ValueError(f"Only process_transfer jobs can be enqueued, got {func_name}")
+        params = dict(zip(("from_account", "to_account", "amount"), args))
+        params.update({key: kwargs[key] for key in ("from_account", "to_account", "amount") if key in kwargs})
+        transfer_id = str(uuid.uuid4())
+
+        conn = db_pool.getconn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO transfer_jobs (transfer_id, from_account, to_account, amount, status, timestamp) VALUES (%s, %s, %s, %s, 'pending', CURRENT_TIMESTAMP)",
+                    (transfer_id, params["from_account"], params["to_account"], params["amount"])
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            db_pool.putconn(conn)
+
+        job = dict(params, transfer_id=transfer_id, amount=float(params["amount"]), enqueued_at=time.time())
+        self.connection.rpush(self.name, json.dumps(job))
+        return TransferJob(transfer_id)
+
+    def __len__(self):
+        return self.connection.llen(self.name)
+
+queue = TransferQueue()
+
+# Synchronous transfer for direct callers: enqueue on the engine and wait for its outcome
+def process_transfer(from_account, to_account, amount, timeout=10):
+    job = queue.enqueue(process_transfer, from_account, to_account, amount)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = job.result
+        if result is not None:
+            return result
+        time.sleep(0.05)
+    return {"status": "failed", "message": "Transfer timed out"}
 
 if __name__ == "__main__":
-    # Start the worker
-    worker = Worker([queue], connection=redis_conn)
-    worker.work()
+    # Start the unified transfer engine
+    import asyncio
+    import redis_worker
+    asyncio.run(redis_worker.main())